@@ -0,0 +1,87 @@
+"""Peak memory of collecting a streamed response, token list versus buffers.
+
+Usage (from the repository root):
+
+    python -m benchmarks.content_memory [--vertices 10000 100000]
+
+"token list" keeps every token and joins the response before extracting the
+OBJ blocks by offsets, "accumulator" writes the parser's spans into
+src.services.parser.ContentAccumulator. Peak memory is measured with
+tracemalloc while the tokens are produced one by one.
+"""
+import argparse
+import time
+import tracemalloc
+from collections.abc import Callable, Iterable
+
+from src.services.parser import ContentAccumulator, OBJParser, ParsedContent
+
+from .synthetic import iter_tokens, response_text, sphere_obj
+
+
+def collect_token_list(tokens: Iterable[str]) -> ParsedContent:
+    parser = OBJParser()
+    collected = []
+
+    for token in tokens:
+        collected.append(token)
+        parser.process_token(token)
+
+    content = "".join(collected)
+    return OBJParser.extract_obj_content(content, parser.get_obj_indexes())
+
+
+def accumulate(tokens: Iterable[str]) -> ParsedContent:
+    parser = OBJParser()
+    accumulator = ContentAccumulator()
+
+    for token in tokens:
+        accumulator.process_spans(parser.process_token(token))
+
+    accumulator.process_spans(parser.finish())
+    return accumulator.get_parsed_content()
+
+
+def measure(
+    collect: Callable[[Iterable[str]], ParsedContent], text: str
+) -> tuple[ParsedContent, float, float]:
+    tracemalloc.start()
+    start = time.perf_counter()
+
+    parsed = collect(iter_tokens(text))
+
+    seconds = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return parsed, peak, seconds
+
+
+def main(vertex_counts: list[int]) -> None:
+    for vertex_count in vertex_counts:
+        text = response_text([sphere_obj(vertex_count // 2, seed=seed) for seed in range(2)])
+        size = len(text.encode())
+        results = {}
+
+        for name, collect in (
+            ("token list", collect_token_list),
+            ("accumulator", accumulate),
+        ):
+            parsed, peak, seconds = measure(collect, text)
+            results[name] = parsed
+
+            print(
+                f"vertices={vertex_count:<8} {name:<12} "
+                f"response={size / 2**20:6.2f} MiB  peak={peak / 2**20:7.2f} MiB  "
+                f"({peak / size:4.1f}x response)  time={seconds * 1000:7.0f} ms"
+            )
+
+        assert results["token list"] == results["accumulator"]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--vertices", type=int, nargs="+", default=[10_000, 100_000])
+    args = parser.parse_args()
+
+    main(args.vertices)
@@ -0,0 +1,56 @@
+"""Size and parse time of the stored OBJ against the GLB export.
+
+Usage (from the repository root):
+
+    python -m benchmarks.glb_export [--vertices 1000 10000 100000] [--repeat 5]
+
+OBJ is parsed with the line loop of benchmarks.obj_parsing (what a viewer
+does with text) and with src.mesh.arrays.parse_obj; GLB is read with
+src.mesh.gltf.from_glb, which only slices the binary chunk. Sizes are
+given raw and gzip-compressed, as served with compression.
+"""
+import argparse
+import gzip
+import timeit
+from collections.abc import Callable
+
+from src.mesh.arrays import parse_obj
+from src.mesh.gltf import from_glb, to_glb
+
+from .obj_parsing import parse_obj_loop
+from .synthetic import sphere_obj
+
+
+def best_of(repeat: int, function: Callable[[], object]) -> float:
+    return min(timeit.repeat(function, number=1, repeat=repeat)) * 1000
+
+
+def main(vertex_counts: list[int], repeat: int) -> None:
+    for vertex_count in vertex_counts:
+        obj = sphere_obj(vertex_count)
+        glb = to_glb(parse_obj(obj))
+        obj_bytes = obj.encode()
+        obj_gzip = len(gzip.compress(obj_bytes))
+        glb_gzip = len(gzip.compress(glb))
+
+        obj_loop = best_of(repeat, lambda: parse_obj_loop(obj))
+        obj_numpy = best_of(repeat, lambda: parse_obj(obj))
+        glb_read = best_of(repeat, lambda: from_glb(glb))
+
+        print(
+            f"vertices={vertex_count:<7} "
+            f"obj={len(obj_bytes) / 1024:7.0f} KiB (gzip {obj_gzip / 1024:6.0f})  "
+            f"glb={len(glb) / 1024:7.0f} KiB (gzip {glb_gzip / 1024:6.0f})  "
+            f"size={len(glb) / len(obj_bytes):4.2f}x  "
+            f"parse obj loop={obj_loop:8.2f} ms  obj numpy={obj_numpy:7.2f} ms  "
+            f"glb={glb_read:6.3f} ms"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--vertices", type=int, nargs="+", default=[1_000, 10_000, 100_000])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    main(args.vertices, args.repeat)
@@ -0,0 +1,65 @@
+"""Compression ratio, speed and error of the compact mesh encoding.
+
+Usage (from the repository root):
+
+    python -m benchmarks.mesh_codec [--vertices 1000 10000 100000] [--bits 10 12 16]
+
+The ratio is against the OBJ text written by src.mesh.arrays.to_obj, next to
+gzip of the same text. The error is the largest coordinate difference after
+a round trip, relative to the longest side of the bounding box.
+"""
+import argparse
+import gzip
+import timeit
+from collections.abc import Callable
+
+import numpy as np
+
+from src.mesh.arrays import parse_obj, to_obj
+from src.mesh.codec import decode_mesh, encode_mesh
+
+from .synthetic import sphere_obj
+
+
+def best_of(repeat: int, function: Callable[[], object]) -> float:
+    return min(timeit.repeat(function, number=1, repeat=repeat))
+
+
+def main(vertex_counts: list[int], bit_counts: list[int], repeat: int) -> None:
+    for vertex_count in vertex_counts:
+        mesh = parse_obj(sphere_obj(vertex_count))
+        obj = to_obj(mesh).encode()
+        obj_gzip = len(gzip.compress(obj))
+        extent = float(np.ptp(mesh.vertices, axis=0).max())
+        megabytes = len(obj) / 1024**2
+
+        print(
+            f"vertices={vertex_count:<7} obj={len(obj) / 1024:7.0f} KiB  "
+            f"gzip={obj_gzip / 1024:6.0f} KiB ({len(obj) / obj_gzip:4.1f}x)"
+        )
+        for bits in bit_counts:
+            encoded = encode_mesh(mesh, bits)
+            decoded = decode_mesh(encoded)
+            assert np.array_equal(decoded.faces, mesh.faces)
+            error = float(np.abs(decoded.vertices - mesh.vertices).max()) / extent
+
+            encode = best_of(repeat, lambda: encode_mesh(mesh, bits))
+            decode = best_of(repeat, lambda: decode_mesh(encoded))
+
+            print(
+                f"  bits={bits:<3} size={len(encoded) / 1024:6.0f} KiB "
+                f"({len(obj) / len(encoded):5.1f}x)  "
+                f"encode={megabytes / encode:6.0f} MB/s  "
+                f"decode={megabytes / decode:6.0f} MB/s  "
+                f"max error={error:.1e}"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--vertices", type=int, nargs="+", default=[1_000, 10_000, 100_000])
+    parser.add_argument("--bits", type=int, nargs="+", default=[10, 12, 16])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    main(args.vertices, args.bits, args.repeat)
@@ -0,0 +1,66 @@
+"""Throughput and peak memory of the streaming STL/PLY/OBJ download converters.
+
+Usage (from the repository root):
+
+    python -m benchmarks.mesh_download [--vertices 100000 400000]
+
+The OBJ is fed in 64 KiB chunks, as read from the bucket. The peak is the
+memory allocated while converting, traced by tracemalloc, and should not
+grow with the mesh except for STL, which keeps 12 bytes per vertex.
+"""
+import argparse
+import time
+import tracemalloc
+from collections.abc import Callable, Iterable, Iterator
+
+from src.mesh.streaming import count_elements, iter_ply, iter_stl
+
+from .synthetic import sphere_obj
+
+CHUNK_BYTES = 1 << 16
+
+
+def _measure(convert: Callable[[], Iterable[bytes]]) -> tuple[float, int, int]:
+    start = time.perf_counter()
+    size = sum(len(chunk) for chunk in convert())
+    seconds = time.perf_counter() - start
+
+    tracemalloc.start()
+    for _ in convert():
+        pass
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return seconds, size, peak
+
+
+def main(vertex_counts: list[int]) -> None:
+    for vertex_count in vertex_counts:
+        obj = sphere_obj(vertex_count).encode()
+
+        def source() -> Iterator[bytes]:
+            for start in range(0, len(obj), CHUNK_BYTES):
+                yield obj[start : start + CHUNK_BYTES]
+
+        vertices, faces = count_elements(source())
+        converters: dict[str, Callable[[], Iterable[bytes]]] = {
+            "obj": source,
+            "stl": lambda: iter_stl(source, faces),
+            "ply": lambda: iter_ply(source, vertices, faces),
+        }
+
+        for name, convert in converters.items():
+            seconds, size, peak = _measure(convert)
+            print(
+                f"vertices={vertex_count:<7} {name}  obj={len(obj) / 2**20:5.1f} MiB  "
+                f"out={size / 2**20:5.1f} MiB  time={seconds * 1000:7.1f} ms  "
+                f"peak={peak / 2**20:5.1f} MiB"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--vertices", type=int, nargs="+", default=[100_000, 400_000])
+    args = parser.parse_args()
+
+    main(args.vertices)
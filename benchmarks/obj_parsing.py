@@ -0,0 +1,66 @@
+"""Vectorized OBJ parsing (src.mesh.arrays.parse_obj) against a Python line loop.
+
+Usage (from the repository root):
+
+    python -m benchmarks.obj_parsing [--vertices 100000] [--repeat 5]
+"""
+import argparse
+import timeit
+
+import numpy as np
+
+from src.mesh.arrays import Mesh, parse_obj
+
+from .synthetic import sphere_obj
+
+
+def parse_obj_loop(content: str) -> Mesh:
+    vertices: list[list[float]] = []
+    faces: list[list[int]] = []
+
+    for line in content.splitlines():
+        parts = line.split()
+
+        if not parts:
+            continue
+
+        if parts[0] == "v":
+            vertices.append([float(coord) for coord in parts[1:4]])
+        elif parts[0] == "f":
+            indexes = [int(part.split("/")[0]) - 1 for part in parts[1:]]
+            for i in range(1, len(indexes) - 1):
+                faces.append([indexes[0], indexes[i], indexes[i + 1]])
+
+    return Mesh(
+        np.array(vertices, dtype=np.float32).reshape(-1, 3),
+        np.array(faces, dtype=np.int32).reshape(-1, 3),
+    )
+
+
+def main(vertex_count: int, repeat: int) -> None:
+    for quads in (False, True):
+        content = sphere_obj(vertex_count, quads=quads)
+        expected = parse_obj_loop(content)
+        actual = parse_obj(content)
+        assert np.array_equal(expected.faces, actual.faces)
+        assert np.allclose(expected.vertices, actual.vertices)
+
+        loop = min(timeit.repeat(lambda: parse_obj_loop(content), number=1, repeat=repeat))
+        vectorized = min(timeit.repeat(lambda: parse_obj(content), number=1, repeat=repeat))
+
+        print(
+            f"{'quads' if quads else 'triangles':<10} "
+            f"vertices={len(actual.vertices):<8} triangles={len(actual.faces):<8} "
+            f"size={len(content) / 2**20:6.2f} MiB  "
+            f"loop={loop * 1000:8.1f} ms  vectorized={vectorized * 1000:8.1f} ms  "
+            f"speedup={loop / vectorized:5.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--vertices", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    main(args.vertices, args.repeat)
@@ -0,0 +1,57 @@
+"""Throughput of the streaming OBJ scanner (src.services.parser.OBJParser).
+
+Usage (from the repository root):
+
+    python -m benchmarks.obj_scanner [--vertices 100000] [--repeat 5]
+
+Responses with fenced and unfenced blocks are split into tokens of 1-4
+characters, fed to the scanner one by one, and the blocks found are checked
+against the generated ones.
+"""
+import argparse
+import timeit
+
+from src.services.parser import OBJParser
+
+from .synthetic import response_text, sphere_obj, tokenize
+
+
+def scan(tokens: list[str]) -> OBJParser:
+    parser = OBJParser()
+
+    for token in tokens:
+        parser.process_token(token)
+
+    parser.finish()
+    return parser
+
+
+def main(vertex_count: int, repeat: int) -> None:
+    blocks = [sphere_obj(vertex_count // 2, seed=seed) for seed in range(2)]
+
+    for fenced in (True, False):
+        text = response_text(blocks, fenced=fenced)
+        tokens = tokenize(text)
+
+        parser = scan(tokens)
+        parsed = OBJParser.extract_obj_content(text, parser.get_obj_indexes())
+        assert parsed["obj_contents"] == blocks
+
+        seconds = min(timeit.repeat(lambda: scan(tokens), number=1, repeat=repeat))
+        size = len(text.encode()) / 2**20
+
+        print(
+            f"{'fenced' if fenced else 'unfenced':<9} size={size:6.2f} MiB  "
+            f"tokens={len(tokens):<9} time={seconds * 1000:8.1f} ms  "
+            f"throughput={size / seconds:6.1f} MB/s  "
+            f"per token={seconds / len(tokens) * 1e9:6.0f} ns"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--vertices", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    main(args.vertices, args.repeat)
@@ -0,0 +1,199 @@
+"""Regression benchmarks of the response parser and its post-processing.
+
+Usage (from the repository root):
+
+    python -m benchmarks.parser_suite [--sizes 1000 10000 100000] [--repeat 5]
+    python -m benchmarks.parser_suite --update-baseline
+    python -m benchmarks.parser_suite --check [--tolerance 0.25]
+
+Synthetic responses with several OBJ blocks and mixed prose are split into
+tokens of 1-4 characters. For every size the suite measures:
+
+- stream: OBJParser.process_token plus ContentAccumulator, per token
+- extract: OBJParser.extract_obj_content on the joined response
+- accumulate: ContentAccumulator.get_parsed_content
+- parse_obj: src.mesh.arrays.parse_obj of every block
+- peak: tracemalloc peak while streaming the response
+
+Baselines are stored in benchmarks/baselines/parser_suite.json, per Python
+version: the memory of io.StringIO differs between versions (before 3.12 it
+keeps every string written until getvalue). Timings depend on the machine,
+update the baseline on the machine the checks run on. With
+--check the exit status is 1 when a metric is slower (or larger) than its
+baseline by more than the tolerance. Pass --sizes 1000000 for a 1M vertex
+response (about 60 MiB of text, several minutes).
+"""
+import argparse
+import gc
+import json
+import sys
+import timeit
+import tracemalloc
+from collections.abc import Callable
+from pathlib import Path
+from typing import TypeAlias
+
+from src.mesh.arrays import parse_obj
+from src.services.parser import ContentAccumulator, OBJParser, ParsedContent
+
+from .synthetic import iter_tokens, mixed_response, tokenize
+
+BASELINE_PATH = Path(__file__).parent / "baselines" / "parser_suite.json"
+DEFAULT_SIZES = [1_000, 10_000, 100_000]
+BLOCKS = 3
+
+PYTHON_VERSION = f"python{sys.version_info.major}.{sys.version_info.minor}"
+
+Metrics: TypeAlias = dict[str, float]
+
+
+def stream(tokens: list[str]) -> tuple[OBJParser, ContentAccumulator]:
+    parser = OBJParser()
+    accumulator = ContentAccumulator()
+
+    for token in tokens:
+        accumulator.process_spans(parser.process_token(token))
+
+    accumulator.process_spans(parser.finish())
+    return parser, accumulator
+
+
+def peak_memory(text: str) -> int:
+    parser = OBJParser()
+    accumulator = ContentAccumulator()
+
+    # Nothing left from the previous measurements in the peak
+    gc.collect()
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    for token in iter_tokens(text):
+        accumulator.process_spans(parser.process_token(token))
+
+    accumulator.process_spans(parser.finish())
+    accumulator.get_parsed_content()
+
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+def best_of(repeat: int, function: Callable[[], object]) -> float:
+    gc.collect()
+    return min(timeit.repeat(function, number=1, repeat=repeat))
+
+
+def measure(vertex_count: int, repeat: int) -> Metrics:
+    text = mixed_response(vertex_count, BLOCKS)
+    tokens = tokenize(text)
+
+    parser, accumulator = stream(tokens)
+    obj_indexes = parser.get_obj_indexes()
+    parsed: ParsedContent = accumulator.get_parsed_content()
+    assert parsed == OBJParser.extract_obj_content(text, obj_indexes)
+    assert len(parsed["obj_contents"]) == BLOCKS
+
+    stream_seconds = best_of(repeat, lambda: stream(tokens))
+    extract_seconds = best_of(
+        repeat, lambda: OBJParser.extract_obj_content(text, obj_indexes)
+    )
+    accumulate_seconds = best_of(repeat, accumulator.get_parsed_content)
+    parse_obj_seconds = best_of(
+        repeat, lambda: [parse_obj(obj) for obj in parsed["obj_contents"]]
+    )
+
+    return {
+        "tokens": len(tokens),
+        "response_mib": len(text.encode()) / 2**20,
+        "stream_ns_per_token": stream_seconds / len(tokens) * 1e9,
+        "extract_ms": extract_seconds * 1000,
+        "accumulate_ms": accumulate_seconds * 1000,
+        "parse_obj_ms": parse_obj_seconds * 1000,
+        "peak_mib": peak_memory(text) / 2**20,
+    }
+
+
+# Metrics compared with the baseline, the others describe the input
+CHECKED_METRICS = [
+    "stream_ns_per_token",
+    "extract_ms",
+    "accumulate_ms",
+    "parse_obj_ms",
+    "peak_mib",
+]
+
+
+def check(
+    results: dict[str, Metrics], baseline: dict[str, Metrics], tolerance: float
+) -> bool:
+    passed = True
+
+    for size, metrics in results.items():
+        if size not in baseline:
+            print(f"vertices={size}: no baseline for {PYTHON_VERSION}")
+            continue
+
+        for metric in CHECKED_METRICS:
+            expected = baseline[size][metric]
+            actual = metrics[metric]
+            # Sub-millisecond timings are dominated by noise
+            if actual > expected * (1 + tolerance) and actual - expected > 0.5:
+                print(
+                    f"REGRESSION vertices={size} {metric}: "
+                    f"{actual:.2f} (baseline {expected:.2f})"
+                )
+                passed = False
+
+    return passed
+
+
+def main(
+    sizes: list[int],
+    repeat: int,
+    update_baseline: bool,
+    check_baseline: bool,
+    tolerance: float,
+) -> int:
+    results: dict[str, Metrics] = {}
+
+    for size in sizes:
+        metrics = measure(size, repeat)
+        results[str(size)] = metrics
+
+        print(
+            f"vertices={size:<8} tokens={metrics['tokens']:<9.0f} "
+            f"response={metrics['response_mib']:6.2f} MiB  "
+            f"stream={metrics['stream_ns_per_token']:6.0f} ns/token  "
+            f"extract={metrics['extract_ms']:7.2f} ms  "
+            f"accumulate={metrics['accumulate_ms']:7.2f} ms  "
+            f"parse_obj={metrics['parse_obj_ms']:7.1f} ms  "
+            f"peak={metrics['peak_mib']:7.2f} MiB"
+        )
+
+    baselines: dict[str, dict[str, Metrics]] = (
+        json.loads(BASELINE_PATH.read_text()) if BASELINE_PATH.exists() else {}
+    )
+    baseline = baselines.setdefault(PYTHON_VERSION, {})
+
+    if update_baseline:
+        baseline.update(results)
+        BASELINE_PATH.write_text(json.dumps(baselines, indent=2, sort_keys=True) + "\n")
+        print(f"Baseline for {PYTHON_VERSION} written to {BASELINE_PATH}")
+
+    if check_baseline and not check(results, baseline, tolerance):
+        return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--update-baseline", action="store_true")
+    parser.add_argument("--check", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    args = parser.parse_args()
+
+    sys.exit(
+        main(args.sizes, args.repeat, args.update_baseline, args.check, args.tolerance)
+    )
@@ -0,0 +1,66 @@
+"""Time to presign a batch of model URLs: botocore one at a time versus S3UrlSigner.
+
+Usage (from the repository root):
+
+    python -m benchmarks.presigned_urls [--urls 1000] [--repeat 20]
+
+Signing is local, no S3 endpoint is needed; placeholder credentials are used
+unless the environment has some. "cold" signs every URL of the batch, "cached"
+is the same batch requested again, as the chat view does.
+"""
+import argparse
+import os
+import timeit
+
+import boto3
+
+from src.repository.s3 import S3UrlSigner, create_s3_client
+
+BUCKET_NAME = "obj-storage-benchmark"
+
+
+def main(url_count: int, repeat: int) -> None:
+    os.environ.setdefault("AWS_ACCESS_KEY_ID", "benchmark")
+    os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "benchmark")
+    os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+
+    session = boto3.session.Session()
+    s3 = create_s3_client(1, session)
+    signer = S3UrlSigner(s3, session.get_credentials())
+
+    locations: dict[int, tuple[str, str] | None] = {
+        model_id: (BUCKET_NAME, f"{model_id:064x}.lod1.obj")
+        for model_id in range(url_count)
+    }
+    signer.sign({0: (BUCKET_NAME, "warmup")})
+
+    def botocore_batch() -> None:
+        for location in locations.values():
+            assert location
+            s3.generate_presigned_url(
+                "get_object",
+                Params={"Bucket": location[0], "Key": location[1]},
+                ExpiresIn=3600,
+            )
+
+    def cold_batch() -> None:
+        signer._urls.clear()
+        signer.sign(locations)
+
+    timings = {
+        "botocore": botocore_batch,
+        "signer cold": cold_batch,
+        "signer cached": lambda: signer.sign(locations),
+    }
+    for name, batch in timings.items():
+        seconds = min(timeit.repeat(batch, number=1, repeat=repeat))
+        print(f"urls={url_count:<6} {name:<14} {seconds * 1000:8.2f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--urls", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    main(args.urls, args.repeat)
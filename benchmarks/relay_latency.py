@@ -0,0 +1,99 @@
+"""Latency of relaying stream events, in-process versus through Postgres.
+
+Usage (from the repository root):
+
+    python -m benchmarks.relay_latency [--events 2000] [--rate 200]
+
+The Postgres relay is measured when the database from src/config.yaml is
+reachable with the POSTGRES_USER/POSTGRES_PASSWORD credentials from .env,
+and the `stream_event_batches` table exists.
+"""
+import argparse
+import asyncio
+import statistics
+import time
+import uuid
+
+import yaml
+from dotenv import dotenv_values
+
+from src.repository import db
+from src.repository.relay import AsyncStreamRelay, create_stream_relay
+
+
+async def measure(relay: AsyncStreamRelay, events: int, rate: float) -> list[float]:
+    stream_id = uuid.uuid4()
+    latencies: list[float] = []
+
+    async def consume() -> None:
+        async for _, data in relay.subscribe(stream_id, idle_timeout=10):
+            latencies.append(time.perf_counter() - data["sent_at"])
+
+    consumer = asyncio.create_task(consume())
+    await asyncio.sleep(0.1)  # let the subscription settle
+
+    async with relay.publisher(stream_id) as publisher:
+        for i in range(events):
+            token = {"role": "assistant", "content": f"v {i} {i} {i}\n"}
+            await publisher.publish(("", {**token, "sent_at": time.perf_counter()}))
+            await asyncio.sleep(1 / rate)
+
+    await consumer
+    return latencies
+
+
+def report(name: str, latencies: list[float]) -> None:
+    latencies_ms = sorted(latency * 1000 for latency in latencies)
+    p95 = latencies_ms[int(len(latencies_ms) * 0.95) - 1]
+    print(
+        f"{name:<28} events={len(latencies_ms):<6} "
+        f"p50={statistics.median(latencies_ms):8.3f} ms  "
+        f"p95={p95:8.3f} ms  max={latencies_ms[-1]:8.3f} ms"
+    )
+
+
+async def main(events: int, rate: float) -> None:
+    memory_relay = create_stream_relay("memory")
+    await memory_relay.start()
+    report("in-process", await measure(memory_relay, events, rate))
+    await memory_relay.aclose()
+
+    with open("src/config.yaml") as file:
+        config = yaml.safe_load(file)
+
+    db_config = config["database"]
+    streams_config = config["streams"]
+    env = dotenv_values()
+
+    if not env.get("POSTGRES_USER"):
+        print("postgres: skipped, POSTGRES_USER is not set")
+        return
+
+    db.setup_db_engine(
+        env["POSTGRES_USER"],
+        env.get("POSTGRES_PASSWORD") or "",
+        db_config["host"],
+        db_config["port"],
+        db_config["database"],
+    )
+
+    for batch_size, max_delay in [
+        (1, 0),
+        (streams_config["relay_batch_size"], streams_config["relay_max_delay"]),
+    ]:
+        relay = create_stream_relay("postgres", batch_size, max_delay)
+        await relay.start()
+        report(
+            f"postgres batch={batch_size} delay={max_delay}",
+            await measure(relay, events, rate),
+        )
+        await relay.aclose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--events", type=int, default=2000)
+    parser.add_argument("--rate", type=float, default=200, help="events per second")
+    args = parser.parse_args()
+
+    asyncio.run(main(args.events, args.rate))
@@ -0,0 +1,115 @@
+"""Event-loop stalls while uploading to S3, with boto3 called on the loop versus in threads.
+
+Usage (from the repository root):
+
+    AWS_ENDPOINT_URL=http://127.0.0.1:5055 python -m benchmarks.s3_event_loop \
+        [--uploads 32] [--size 1000000] [--threads 8]
+
+Point AWS_ENDPOINT_URL at a local S3 stand-in, e.g. `moto_server -p 5055` or
+MinIO (with its credentials in AWS_ACCESS_KEY_ID/AWS_SECRET_ACCESS_KEY). A
+temporary bucket is created and deleted. While the uploads run, a ticker
+sleeps 1 ms at a time: how late it wakes up is how long any SSE stream of
+the process would have been stalled.
+"""
+import argparse
+import asyncio
+import os
+import time
+import uuid
+from collections.abc import Awaitable, Callable
+
+import boto3
+import numpy as np
+from botocore.config import Config
+
+from src.repository.s3 import AsyncS3Executor
+
+TICK = 0.001
+
+
+async def measure_stalls(
+    uploads: Callable[[], Awaitable[None]],
+) -> tuple[float, list[float]]:
+    stalls: list[float] = []
+    done = False
+
+    async def tick() -> None:
+        while not done:
+            start = time.perf_counter()
+            await asyncio.sleep(TICK)
+            stalls.append(time.perf_counter() - start - TICK)
+
+    ticker = asyncio.create_task(tick())
+    await asyncio.sleep(0.05)
+
+    start = time.perf_counter()
+    await uploads()
+    seconds = time.perf_counter() - start
+
+    done = True
+    await ticker
+    return seconds, stalls
+
+
+def report(name: str, seconds: float, stalls: list[float]) -> None:
+    stalls_ms = np.array(stalls) * 1000
+    print(
+        f"{name:<10} total={seconds * 1000:8.1f} ms  "
+        f"stall p50={np.percentile(stalls_ms, 50):7.2f} ms  "
+        f"p99={np.percentile(stalls_ms, 99):7.2f} ms  max={stalls_ms.max():7.2f} ms"
+    )
+
+
+async def main(upload_count: int, size: int, threads: int) -> None:
+    s3 = boto3.client("s3", config=Config(max_pool_connections=threads))
+    bucket_name = f"s3-stall-benchmark-{uuid.uuid4()}"
+    s3.create_bucket(Bucket=bucket_name)
+    body = os.urandom(size)
+
+    async def on_loop() -> None:
+        # What AsyncS3ModelRepository did: boto3 called from coroutines
+        async def upload(key: str) -> None:
+            s3.put_object(Bucket=bucket_name, Key=key, Body=body)
+
+        await asyncio.gather(*(upload(f"loop/{i}") for i in range(upload_count)))
+
+    s3_executor = AsyncS3Executor(threads)
+
+    async def in_threads() -> None:
+        await asyncio.gather(
+            *(
+                s3_executor.run(
+                    s3.put_object, Bucket=bucket_name, Key=f"threads/{i}", Body=body
+                )
+                for i in range(upload_count)
+            )
+        )
+
+    try:
+        # Connections and botocore's lazily loaded models, not measured
+        await asyncio.gather(
+            *(
+                s3_executor.run(s3.put_object, Bucket=bucket_name, Key="warmup", Body=b"")
+                for _ in range(threads)
+            )
+        )
+
+        print(f"uploads={upload_count}  size={size}  threads={threads}")
+        report("on loop", *await measure_stalls(on_loop))
+        report("in threads", *await measure_stalls(in_threads))
+    finally:
+        s3_executor.shutdown()
+        for page in s3.get_paginator("list_objects_v2").paginate(Bucket=bucket_name):
+            for item in page.get("Contents", []):
+                s3.delete_object(Bucket=bucket_name, Key=item["Key"])
+        s3.delete_bucket(Bucket=bucket_name)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--uploads", type=int, default=32)
+    parser.add_argument("--size", type=int, default=1_000_000)
+    parser.add_argument("--threads", type=int, default=AsyncS3Executor.MAX_THREADS_DEFAULT)
+    args = parser.parse_args()
+
+    asyncio.run(main(args.uploads, args.size, args.threads))
@@ -0,0 +1,69 @@
+"""Per-request cost of setting up S3 access: a client per request versus a shared one.
+
+Usage (from the repository root):
+
+    AWS_ENDPOINT_URL=http://127.0.0.1:5055 python -m benchmarks.s3_request_overhead \
+        [--requests 50]
+
+Point AWS_ENDPOINT_URL at a local S3 stand-in (see benchmarks/s3_event_loop.py).
+Each request makes one HEAD on an object, like a save does first. A client per
+request also pays for creating the client, for list_buckets and for a new
+connection; against a remote endpoint, add the TLS handshake.
+"""
+import argparse
+import statistics
+import time
+import uuid
+from collections.abc import Callable
+
+from src.repository.s3 import create_s3_client, get_or_create_bucket
+
+PREFIX = "s3-overhead"
+
+
+def measure(request: Callable[[], None], count: int) -> list[float]:
+    timings = []
+    for _ in range(count):
+        start = time.perf_counter()
+        request()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def report(name: str, timings: list[float]) -> None:
+    timings_ms = [timing * 1000 for timing in timings]
+    print(
+        f"{name:<18} p50={statistics.median(timings_ms):7.2f} ms  "
+        f"mean={statistics.mean(timings_ms):7.2f} ms  max={max(timings_ms):7.2f} ms"
+    )
+
+
+def main(request_count: int) -> None:
+    s3 = create_s3_client(8)
+    prefix = f"{PREFIX}-{uuid.uuid4().hex[:8]}"
+    bucket_name = get_or_create_bucket(s3, prefix)
+    s3.put_object(Bucket=bucket_name, Key="object", Body=b"")
+
+    def per_request_client() -> None:
+        # What every model request did before the client was shared
+        client = create_s3_client(8)
+        client.head_object(Bucket=get_or_create_bucket(client, prefix), Key="object")
+        client.close()
+
+    def shared_client() -> None:
+        s3.head_object(Bucket=bucket_name, Key="object")
+
+    try:
+        report("client per request", measure(per_request_client, request_count))
+        report("shared client", measure(shared_client, request_count))
+    finally:
+        s3.delete_object(Bucket=bucket_name, Key="object")
+        s3.delete_bucket(Bucket=bucket_name)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=50)
+    args = parser.parse_args()
+
+    main(args.requests)
@@ -0,0 +1,121 @@
+"""Query latency and recall of the shape-similarity index.
+
+Usage (from the repository root):
+
+    python -m benchmarks.shape_index [--models 100000] [--owners 1000] [--probes 8 16 24]
+        [--queries 1000]
+
+Descriptors are D2 histograms of boxes and ellipsoids with random proportions,
+mixed and jittered to get as many distinct models as requested, spread over
+`--owners` users at random. Recall@10 is measured against an exact scan of all
+descriptors, or of the owner's for the searches of an owner's models. The
+build is what each process runs on start and once the index needs training
+again.
+"""
+import argparse
+import time
+
+import numpy as np
+import numpy.typing as npt
+
+from src.mesh.arrays import Mesh, parse_obj
+from src.mesh.descriptor import d2_descriptor
+from src.repository.shape_index import ShapeIndex
+
+from .synthetic import sphere_obj
+
+BASE_SHAPES = 200
+
+_CUBE_VERTICES = np.array(
+    [[0, 0, 0], [1, 0, 0], [1, 1, 0], [0, 1, 0], [0, 0, 1], [1, 0, 1], [1, 1, 1], [0, 1, 1]],
+    dtype=np.float32,
+)
+_CUBE_FACES = np.array(
+    [
+        [0, 1, 2], [0, 2, 3], [4, 5, 6], [4, 6, 7], [0, 1, 5], [0, 5, 4],
+        [2, 3, 7], [2, 7, 6], [1, 2, 6], [1, 6, 5], [0, 3, 7], [0, 7, 4],
+    ],
+    dtype=np.int32,
+)
+
+
+def synthetic_descriptors(count: int, rng: np.random.Generator) -> npt.NDArray[np.float32]:
+    sphere = parse_obj(sphere_obj(500))
+    bases = []
+    for shape in range(BASE_SHAPES):
+        proportions = rng.uniform(0.1, 1, 3).astype(np.float32)
+        mesh = Mesh(_CUBE_VERTICES, _CUBE_FACES) if shape % 2 else sphere
+        descriptor = d2_descriptor(Mesh(mesh.vertices * proportions, mesh.faces))
+        assert descriptor is not None
+        bases.append(descriptor**2)
+    histograms = np.array(bases)
+
+    # Mixtures of two base shapes with a little noise, back to square roots
+    first, second = rng.integers(0, BASE_SHAPES, (2, count))
+    weights = rng.random((count, 1))
+    mixed = weights * histograms[first] + (1 - weights) * histograms[second]
+    mixed = np.maximum(mixed + rng.normal(0, 2e-3, mixed.shape), 0)
+    return np.sqrt(mixed / mixed.sum(axis=1, keepdims=True)).astype(np.float32)
+
+
+def measure(
+    index: ShapeIndex,
+    descriptors: npt.NDArray[np.float32],
+    queries: npt.NDArray[np.int64],
+    owners: npt.NDArray[np.int64] | None,
+) -> str:
+    latencies, hits = [], 0
+    for query in queries:
+        candidates = np.arange(len(descriptors))
+        if owners is not None:
+            candidates = np.flatnonzero(owners == owners[query])
+        distances = ((descriptors[candidates] - descriptors[query]) ** 2).sum(axis=1)
+        expected = set(candidates[np.argsort(distances)[:10]].tolist())
+
+        owner = None if owners is None else int(owners[query])
+        start = time.perf_counter()
+        results = index.search(descriptors[query], 10, owner)
+        latencies.append(time.perf_counter() - start)
+        hits += len(expected & {model_id for model_id, _ in results})
+
+    return (
+        f"p50={np.percentile(latencies, 50) * 1000:6.3f} ms  "
+        f"p99={np.percentile(latencies, 99) * 1000:6.3f} ms  "
+        f"recall@10={hits / (10 * len(queries)):.3f}"
+    )
+
+
+def main(
+    model_count: int, owner_count: int, probe_counts: list[int], query_count: int
+) -> None:
+    rng = np.random.default_rng(0)
+    descriptors = synthetic_descriptors(model_count, rng)
+    owners = rng.integers(0, owner_count, model_count)
+    queries = rng.choice(model_count, query_count, replace=False)
+
+    start = time.perf_counter()
+    index = ShapeIndex.build(np.arange(model_count), owners, descriptors)
+    print(f"models={model_count}  build={(time.perf_counter() - start) * 1000:6.1f} ms")
+
+    start = time.perf_counter()
+    for model_id, descriptor in enumerate(descriptors[:1000], model_count):
+        index.add(model_id, 0, descriptor)
+    print(f"add={(time.perf_counter() - start) / 1000 * 1e6:6.1f} us/model")
+    for model_id in range(model_count, model_count + 1000):
+        index.remove(model_id)
+
+    for probes in probe_counts:
+        index._probes = probes
+        print(f"probes={probes:<3} all models:  {measure(index, descriptors, queries, None)}")
+        print(f"probes={probes:<3} owner's:     {measure(index, descriptors, queries, owners)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--models", type=int, default=100_000)
+    parser.add_argument("--owners", type=int, default=1000)
+    parser.add_argument("--probes", type=int, nargs="+", default=[8, 16, 24])
+    parser.add_argument("--queries", type=int, default=1000)
+    args = parser.parse_args()
+
+    main(args.models, args.owners, args.probes, args.queries)
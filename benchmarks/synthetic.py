@@ -0,0 +1,109 @@
+"""Synthetic generated-mesh inputs shared by the benchmarks."""
+from collections.abc import Iterator
+
+import numpy as np
+
+
+def sphere_obj(vertex_count: int, quads: bool = False, seed: int = 0) -> str:
+    """UV sphere with about `vertex_count` vertices, written the way the model does.
+
+    Coordinates are jittered and printed with a varying number of decimals;
+    faces are triangles, or quads when `quads` is set.
+    """
+    rings = max(int(np.sqrt(vertex_count / 2)), 2)
+    segments = max(vertex_count // rings, 3)
+
+    theta = np.linspace(0, np.pi, rings)
+    phi = np.linspace(0, 2 * np.pi, segments, endpoint=False)
+    theta_grid, phi_grid = np.meshgrid(theta, phi, indexing="ij")
+    vertices = np.stack(
+        (
+            np.sin(theta_grid) * np.cos(phi_grid),
+            np.cos(theta_grid),
+            np.sin(theta_grid) * np.sin(phi_grid),
+        ),
+        axis=-1,
+    ).reshape(-1, 3)
+    vertices += np.random.default_rng(seed).normal(0, 1e-3, vertices.shape)
+
+    ring = np.arange(rings - 1)[:, None] * segments
+    segment = np.arange(segments)[None, :]
+    a = (ring + segment).ravel()
+    b = (ring + (segment + 1) % segments).ravel()
+    c = b + segments
+    d = a + segments
+
+    lines = [f"v {x:.4f} {y:.3f} {z:.4f}" for x, y, z in vertices.tolist()]
+    if quads:
+        faces = np.stack((a, b, c, d), axis=1) + 1
+        lines += [f"f {i} {j} {k} {m}" for i, j, k, m in faces.tolist()]
+    else:
+        faces = np.concatenate(
+            (np.stack((a, b, c), axis=1), np.stack((a, c, d), axis=1))
+        ) + 1
+        lines += [f"f {i} {j} {k}" for i, j, k in faces.tolist()]
+
+    return "\n".join(lines) + "\n"
+
+
+PROSE = (
+    "Here is the model you asked for. It is centered at the origin and scaled "
+    "to fit into a unit cube, so it should be easy to place in your scene.\n"
+)
+
+
+def response_text(obj_blocks: list[str], fenced: bool = True) -> str:
+    """Assistant response with prose around each OBJ block."""
+    parts = [PROSE]
+
+    for obj in obj_blocks:
+        parts.append(f"```obj\n{obj}```\n" if fenced else obj)
+        parts.append(PROSE)
+
+    return "".join(parts)
+
+
+def mixed_response(vertex_count: int, blocks: int = 3, seed: int = 0) -> str:
+    """Response with `blocks` OBJ blocks of `vertex_count` vertices in total.
+
+    The blocks alternate between ```obj fences, bare fences and no fences,
+    and the prose around them has markdown headings, lists and a code block
+    in another language, which must not be taken for OBJ content.
+    """
+    block_vertex_count = max(vertex_count // blocks, 8)
+    fences = [("```obj\n", "```\n"), ("```\n", "```\n"), ("", "")]
+    parts = ["# Your model\n\n", PROSE]
+
+    for block in range(blocks):
+        opening, closing = fences[block % len(fences)]
+        obj = sphere_obj(block_vertex_count, quads=bool(block % 2), seed=seed + block)
+
+        parts.append(f"{opening}# part {block}\no part_{block}\n{obj}{closing}")
+        parts.append(f"\n## Part {block}\n\n- vertices: {block_vertex_count}\n")
+        parts.append(PROSE)
+
+    parts.append("```python\nv = load('model.obj')\nf = v.faces\n```\n")
+    return "".join(parts)
+
+
+def iter_tokens(text: str, seed: int = 0) -> Iterator[str]:
+    """Split text into tokens of 1-4 characters, ignoring word boundaries.
+
+    Like with a real tokenizer, line breaks and spaces end up merged with
+    their neighbours, so that tokens such as "v ", " 0." or "\\nf" show up.
+    Every token is a new string, as when it arrives from the assistant.
+    """
+    rng = np.random.default_rng(seed)
+    position = 0
+
+    while position < len(text):
+        for length in rng.integers(1, 5, size=4096).tolist():
+            if position >= len(text):
+                break
+
+            yield text[position : position + length]
+            position += length
+
+
+def tokenize(text: str, seed: int = 0) -> list[str]:
+    return list(iter_tokens(text, seed))
@@ -0,0 +1,42 @@
+"""Thumbnail throughput of the NumPy rasterizer on a single core.
+
+Usage (from the repository root):
+
+    python -m benchmarks.thumbnails [--vertices 1000 10000 100000] [--size 128]
+
+Each mesh is rendered as generated and from its finest level of detail, which
+is what the mesh post-processing renders, PNG encoding included.
+"""
+import argparse
+import timeit
+
+from src.mesh.arrays import parse_obj
+from src.mesh.lod import build_lods
+from src.mesh.thumbnail import render_thumbnail
+
+from .synthetic import sphere_obj
+
+
+def main(vertex_counts: list[int], size: int, repeat: int) -> None:
+    for vertex_count in vertex_counts:
+        mesh = parse_obj(sphere_obj(vertex_count))
+        lods = build_lods(mesh)
+
+        for name, variant in (("mesh", mesh), ("lod1", lods[0] if lods else mesh)):
+            seconds = min(
+                timeit.repeat(lambda: render_thumbnail(variant, size), number=1, repeat=repeat)
+            )
+            print(
+                f"vertices={vertex_count:<7} {name}  faces={len(variant.faces):<7} "
+                f"render={seconds * 1000:7.2f} ms  {60 / seconds:6.0f} thumbnails/min"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--vertices", type=int, nargs="+", default=[1_000, 10_000, 100_000])
+    parser.add_argument("--size", type=int, default=128)
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    main(args.vertices, args.size, args.repeat)
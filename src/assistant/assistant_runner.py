@@ -3,6 +3,7 @@ import asyncio
 import functools
 import logging
 import multiprocessing as mp
+import time
 import uuid
 from concurrent.futures import ProcessPoolExecutor
 from multiprocessing.synchronize import Event as EventClass
@@ -10,6 +11,7 @@ from queue import Empty, Queue
 from typing import AsyncGenerator, ClassVar
 
 from ..models.message import ResponseChunkDTO
+from .budget import BudgetExceededError, GenerationBudget
 from .chat_assistant import ChatAssistant
 
 debug_logger = logging.getLogger("debug")
@@ -47,17 +49,28 @@ class AsyncProcessAssistantRunner:
         query: list[ResponseChunkDTO],
         queue: Queue,
         stop_event: EventClass,
+        budget: GenerationBudget,
     ) -> None:
         try:
             debug_logger.debug(f"Run in process {os.getpid()}, {queue=}")
             print(f"Run in process {os.getpid()}, {queue=}", flush=True)
+            started_at = time.monotonic()
             gen = assistant.generate_response(query)
 
-            for chunk in gen:
+            for token_count, chunk in enumerate(gen, start=1):
                 if stop_event.is_set():
                     break
 
                 queue.put(chunk)
+
+                if budget.max_tokens is not None and token_count >= budget.max_tokens:
+                    raise BudgetExceededError("max_tokens", budget.max_tokens)
+
+                if (
+                    budget.max_seconds is not None
+                    and time.monotonic() - started_at >= budget.max_seconds
+                ):
+                    raise BudgetExceededError("max_seconds", budget.max_seconds)
         except Exception as e:
             queue.put(e)
         finally:
@@ -97,6 +110,7 @@ class AsyncProcessAssistantRunner:
         assistant: ChatAssistant,
         query: list[ResponseChunkDTO],
         stream_id: uuid.UUID,
+        budget: GenerationBudget = GenerationBudget(),
     ) -> AsyncGenerator[ResponseChunkDTO, None]:
         debug_logger.debug(f"_process_pool: {self._process_pool=}")
 
@@ -115,6 +129,7 @@ class AsyncProcessAssistantRunner:
                 query=query,
                 queue=result_queue,
                 stop_event=stop_event,
+                budget=budget,
             ),
         )
         debug_logger.debug(f"task: {task}")
@@ -0,0 +1,35 @@
+from dataclasses import dataclass
+from typing import Any, Literal, Self
+
+type BudgetLimit = Literal["max_tokens", "max_seconds"]
+
+
+@dataclass(frozen=True)
+class GenerationBudget:
+    """Upper bounds of a single generation. None means unbounded."""
+
+    max_tokens: int | None = None
+    max_seconds: float | None = None
+
+    @classmethod
+    def from_config(cls, config: dict[str, Any] | None) -> Self:
+        config = config or {}
+        return cls(
+            max_tokens=config.get("max_tokens"),
+            max_seconds=config.get("max_seconds"),
+        )
+
+    def override(self, other: "GenerationBudget") -> "GenerationBudget":
+        max_tokens = self.max_tokens if other.max_tokens is None else other.max_tokens
+        max_seconds = self.max_seconds if other.max_seconds is None else other.max_seconds
+        return GenerationBudget(max_tokens, max_seconds)
+
+
+class BudgetExceededError(Exception):
+    def __init__(self, limit: BudgetLimit, value: float) -> None:
+        super().__init__(limit, value)
+        self.limit = limit
+        self.value = value
+
+    def __str__(self) -> str:
+        return f"Generation budget exceeded: {self.limit}={self.value}"
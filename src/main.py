@@ -2,6 +2,7 @@ import logging
 import re
 from contextlib import asynccontextmanager
 from typing import AsyncGenerator
+import boto3
 import yaml
 from dotenv import dotenv_values
 
@@ -9,7 +10,26 @@ from fastapi import APIRouter, FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
 from src.assistant.assistant_runner import AsyncProcessAssistantRunner
+from src.assistant.budget import GenerationBudget
+from src.mesh.processing import AsyncMeshProcessor
 from src.repository.db import setup_db_engine, DBSessionMiddleware
+from src.repository.pool import PoolSettings
+from src.repository.model import (
+    AsyncLocalModelRepository,
+    AsyncModelRepository,
+    AsyncS3ModelRepository,
+)
+from src.repository.local import LocalObjectStore
+from src.repository.relay import create_stream_relay
+from src.repository.s3 import (
+    AsyncS3Executor,
+    S3UrlSigner,
+    create_s3_client,
+    get_or_create_bucket,
+)
+from src.repository.shape_index import SharedShapeIndex
+from src.repository.stream import create_stream_registry
+from src.repository.upload_queue import AsyncUploadQueue
 from src.my_logging.logging_config import setup_logging
 from src.my_logging.logging_middleware import LoggingMiddleware
 from src.routers import chat, message, model, user
@@ -27,10 +47,55 @@ async def lifespan(app: FastAPI) -> AsyncGenerator[None]:
         max_workers = config["assistant"]["max_workers"]
         implementation = config["assistant"]["implementation"]
 
+        budgets_config = config["assistant"]["budgets"]
+        default_budget = GenerationBudget.from_config(budgets_config["default"])
+        tier_budgets = {
+            tier: GenerationBudget.from_config(tier_config)
+            for tier, tier_config in (budgets_config.get("tiers") or {}).items()
+        }
+
         db_config = config["database"]
         host = db_config["host"]
         port = db_config["port"]
         database = db_config["database"]
+        pool_settings = PoolSettings.from_config(db_config.get("pool"))
+
+        mesh_config = config["mesh"]
+        mesh_workers = mesh_config["workers"]
+        weld_tolerance = mesh_config["weld_tolerance"]
+        lod_resolutions = mesh_config["lod_resolutions"]
+        thumbnail_size = mesh_config["thumbnail_size"]
+
+        storage_config = config["storage"]
+        quantization_bits = (
+            storage_config["quantization_bits"]
+            if storage_config["mode"] == "compressed"
+            else None
+        )
+        storage_backend = storage_config["backend"]
+        local_storage_path = storage_config["local_path"]
+        s3_io_threads = storage_config["io_threads"]
+        s3_part_size = storage_config["part_size"]
+        presigned_urls_config = storage_config["presigned_urls"]
+        write_behind_config = storage_config["write_behind"]
+
+        similarity_config = config["similarity"]
+        shape_index_probes = similarity_config["probes"]
+
+        streams_config = config["streams"]
+        stream_registry_implementation = streams_config["registry"]
+        stream_lease_duration = streams_config["lease_duration"]
+        stream_heartbeat_interval = streams_config["heartbeat_interval"]
+        stream_relay_implementation = streams_config["relay"]
+        relay_batch_size = streams_config["relay_batch_size"]
+        relay_max_delay = streams_config["relay_max_delay"]
+        relay_max_history = streams_config["relay_max_history"]
+
+        if stream_registry_implementation == "postgres" and stream_relay_implementation == "memory":
+            # Subscribers on another replica than the one running the stream get no events
+            raise ValueError(
+                "The postgres stream registry requires the postgres stream relay"
+            )
 
     env = dotenv_values()
     user = env["POSTGRES_USER"]
@@ -38,16 +103,89 @@ async def lifespan(app: FastAPI) -> AsyncGenerator[None]:
 
     assert user and password
      
-    setup_db_engine(user, password, host, port, database)
+    pool_stats = setup_db_engine(user, password, host, port, database, pool_settings)
+    await pool_stats.start(pool_settings.stats_interval)
     
     debug_logger.debug(f'{max_workers=}')
     debug_logger.debug(f'{implementation=}')
     MessageService.set_max_workers(max_workers)
     MessageService.set_assistant_implementation(implementation)
+    MessageService.set_generation_budgets(default_budget, tier_budgets)
+
+    mesh_processor = AsyncMeshProcessor(
+        mesh_workers, weld_tolerance, lod_resolutions, quantization_bits, thumbnail_size
+    )
+    MessageService.set_mesh_processor(mesh_processor)
+
+    debug_logger.debug(f'{storage_backend=}')
+    AsyncModelRepository.set_storage_backend(storage_backend)
+
+    s3_executor = AsyncS3Executor(s3_io_threads)
+    AsyncModelRepository.set_s3_executor(s3_executor)
+
+    s3 = None
+    upload_queue = None
+    if storage_backend == "s3":
+        s3_session = boto3.session.Session()
+        s3 = create_s3_client(s3_io_threads, s3_session)
+        bucket_name = await s3_executor.run(
+            get_or_create_bucket, s3, AsyncS3ModelRepository.BUCKET_NAME_PREFIX
+        )
+        url_signer = S3UrlSigner(
+            s3,
+            s3_session.get_credentials(),
+            presigned_urls_config["expires_in"],
+            presigned_urls_config["min_remaining"],
+            presigned_urls_config["cache_size"],
+        )
+        AsyncS3ModelRepository.set_s3(s3, bucket_name, url_signer)
+        AsyncS3ModelRepository.set_part_size(s3_part_size)
+
+        if write_behind_config["enabled"]:
+            upload_queue = AsyncUploadQueue(
+                AsyncS3ModelRepository.upload_spooled,
+                AsyncS3ModelRepository.fail_upload,
+                write_behind_config["concurrency"],
+                write_behind_config["retry_delay"],
+                write_behind_config["max_retry_delay"],
+                write_behind_config["max_attempts"],
+            )
+            spool = LocalObjectStore(write_behind_config["spool_path"])
+            AsyncS3ModelRepository.set_write_behind(spool, upload_queue)
+            # Saved before the last shutdown and not uploaded yet
+            await upload_queue.start(await AsyncS3ModelRepository.get_spooled_paths())
+    else:
+        AsyncLocalModelRepository.set_store(LocalObjectStore(local_storage_path))
+
+    shape_index = SharedShapeIndex(shape_index_probes)
+    await shape_index.start()
+    AsyncModelRepository.set_shape_index(shape_index)
+
+    stream_registry = create_stream_registry(
+        stream_registry_implementation, stream_lease_duration, stream_heartbeat_interval
+    )
+    await stream_registry.start()
+    MessageService.set_stream_registry(stream_registry)
+
+    stream_relay = create_stream_relay(
+        stream_relay_implementation, relay_batch_size, relay_max_delay, relay_max_history
+    )
+    await stream_relay.start()
+    MessageService.set_stream_relay(stream_relay)
 
     yield
     
     MessageService.shutdown()
+    mesh_processor.shutdown()
+    await shape_index.aclose()
+    if upload_queue is not None:
+        await upload_queue.aclose()
+    s3_executor.shutdown()
+    if s3 is not None:
+        s3.close()
+    await stream_relay.aclose()
+    await stream_registry.aclose()
+    await pool_stats.aclose()
 
 
 app = FastAPI(lifespan=lifespan)
@@ -57,6 +195,7 @@ api_router.include_router(user.router)
 api_router.include_router(chat.router)
 api_router.include_router(message.router)
 api_router.include_router(model.router)
+api_router.include_router(model.files_router)
 
 app.include_router(api_router)
 
@@ -73,7 +212,9 @@ app.add_middleware(
         re.compile(r".*?/users/me/chats/[^/]+/messages/[^/]+/streams/[^/]+")
     ],
 )
-app.add_middleware(LoggingMiddleware, excluded_paths=["/streams"])
+app.add_middleware(
+    LoggingMiddleware, excluded_paths=["/streams", "/download", "/models/files"]
+)
 
 # app.add_middleware(
 #     CORSMiddleware,
@@ -0,0 +1,162 @@
+import re
+import warnings
+from typing import NamedTuple
+
+import numpy as np
+import numpy.typing as npt
+
+_VERTEX_LINE = re.compile(r"^v[ \t]+([^\n]*)", re.MULTILINE)
+_VERTEX_XYZ = re.compile(r"^v[ \t]+(\S+[ \t]+\S+[ \t]+\S+)?", re.MULTILINE)  # Empty if short
+_FACE_LINE = re.compile(r"^f[ \t]+([^\n]*)", re.MULTILINE)
+_ELEMENT_LINE = re.compile(r"^([vf])[ \t]", re.MULTILINE)
+_INDEX_SUFFIX = re.compile(r"/\S*")  # vt and vn references of `v/vt/vn`
+
+
+class Mesh(NamedTuple):
+    vertices: npt.NDArray[np.float32]  # (N, 3)
+    faces: npt.NDArray[np.int32]  # (M, 3), zero-based triangles
+
+
+def _count_tokens(text: str) -> int:
+    """Count of the whitespace-separated tokens of a non-empty text."""
+    is_space = np.frombuffer(text.encode(), dtype=np.uint8) <= ord(" ")
+    return int(np.count_nonzero(is_space[:-1] & ~is_space[1:])) + int(not is_space[0])
+
+
+def _count_line_tokens(text: str, line_count: int) -> npt.NDArray[np.int64]:
+    """Count of the whitespace-separated tokens of each of the `line_count` lines of a text."""
+    data = np.frombuffer(text.encode(), dtype=np.uint8)
+    is_space = data <= ord(" ")
+    # One past the end, an empty last line starts there
+    is_start = np.zeros(len(data) + 1, dtype=np.uint8)
+    is_start[:-1] = ~is_space
+    is_start[1:-1] &= is_space[:-1]
+
+    line_starts = np.empty(line_count, dtype=np.int64)
+    line_starts[:1] = 0
+    line_starts[1:] = np.flatnonzero(data == ord("\n")) + 1
+    return np.add.reduceat(is_start, line_starts, dtype=np.int64)
+
+
+def _parse_numbers(
+    text: str, dtype: type[np.generic], token_count: int | None = None
+) -> npt.NDArray:
+    """Numbers of a whitespace-separated text, `token_count` if already counted."""
+    if not text:
+        return np.empty(0, dtype=dtype)
+
+    # Before numpy 2.3, fromstring stops at the first token that isn't a number
+    # of `dtype` with a DeprecationWarning and returns the numbers before it
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", DeprecationWarning)
+        numbers = np.fromstring(text, dtype=dtype, sep=" ")
+
+    if token_count is None:
+        token_count = _count_tokens(text)
+    if numbers.size != token_count:
+        raise ValueError(f"Malformed OBJ numbers after {numbers.size} values")
+
+    return numbers
+
+
+def parse_obj(content: str, vertex_offset: int = 0) -> Mesh:
+    """Parse the geometry of an OBJ block into NumPy arrays.
+
+    Vertex and face lines are picked out with regular expressions and the
+    numbers of all lines of a kind are converted in a single call. Extra vertex
+    components (w, colors) and texture/normal references are dropped, negative
+    (relative) indexes are resolved and polygons are triangulated as fans.
+    `vertex_offset` is the count of vertices defined before `content`, when
+    it's a part of a larger file.
+    """
+    vertex_lines = _VERTEX_LINE.findall(content)
+    vertex_text = "\n".join(vertex_lines)
+
+    # Per line: a short line and a long one would add up to the right total
+    if (_count_line_tokens(vertex_text, len(vertex_lines)) == 3).all():
+        vertices = _parse_numbers(vertex_text, np.float32, 3 * len(vertex_lines))
+    else:
+        # Some vertices carry w or color components, or lack coordinates. Those
+        # are kept as NaN, the next ones keep their indexes and repair drops
+        # their faces.
+        xyz_lines = _VERTEX_XYZ.findall(content)
+        complete = np.array([bool(line) for line in xyz_lines], dtype=bool)
+        vertices = np.full((len(xyz_lines), 3), np.nan, dtype=np.float32)
+        vertices[complete] = _parse_numbers(
+            "\n".join(line for line in xyz_lines if line), np.float32
+        ).reshape(-1, 3)
+
+    face_lines = _FACE_LINE.findall(content)
+    face_text = "\n".join(face_lines)
+
+    if "/" in face_text:
+        face_text = _INDEX_SUFFIX.sub("", face_text)
+
+    counts = _count_line_tokens(face_text, len(face_lines))
+    indexes = _parse_numbers(face_text, np.int64, int(counts.sum()))
+
+    if (indexes < 0).any():
+        # Relative indexes count back from the last vertex defined before the face
+        kinds = np.array(_ELEMENT_LINE.findall(content))
+        vertices_before = vertex_offset + np.cumsum(kinds == "v")[kinds == "f"]
+        relative = indexes < 0
+        indexes[relative] += np.repeat(vertices_before, counts)[relative] + 1
+
+    faces = triangulate(indexes - 1, counts)
+    return Mesh(vertices.reshape(-1, 3), faces.astype(np.int32))
+
+
+def triangulate(
+    indexes: npt.NDArray[np.int64], counts: npt.NDArray[np.int64]
+) -> npt.NDArray[np.int64]:
+    """Fan-triangulate polygons given as flat vertex indexes and per-polygon counts."""
+    valid = counts >= 3
+    starts = (np.cumsum(counts) - counts)[valid]
+    triangle_counts = counts[valid] - 2
+
+    if not triangle_counts.size:
+        return np.empty((0, 3), dtype=np.int64)
+
+    polygon = np.repeat(np.arange(triangle_counts.size), triangle_counts)
+    first_triangle = np.cumsum(triangle_counts) - triangle_counts
+    corner = np.arange(polygon.size) - first_triangle[polygon] + 1
+    base = starts[polygon]
+
+    return np.stack(
+        (indexes[base], indexes[base + corner], indexes[base + corner + 1]), axis=1
+    )
+
+
+def remove_unreferenced(
+    vertices: npt.NDArray[np.float32], faces: npt.NDArray[np.int64]
+) -> tuple[npt.NDArray[np.float32], npt.NDArray[np.int64], int]:
+    """Drop the vertices no face uses, returns the remapped faces and the count dropped."""
+    referenced = np.zeros(len(vertices), dtype=bool)
+    referenced[faces] = True
+
+    remap = np.cumsum(referenced) - 1
+    return vertices[referenced], remap[faces], int((~referenced).sum())
+
+
+def unique_faces(faces: npt.NDArray[np.int64]) -> npt.NDArray[np.int64]:
+    """Drop faces over the same vertices as a previous one, in any order and winding."""
+    _, first_faces = np.unique(np.sort(faces, axis=1), axis=0, return_index=True)
+    return faces[np.sort(first_faces)]
+
+
+def degenerate_faces(faces: npt.NDArray[np.int64]) -> npt.NDArray[np.bool_]:
+    """Mask of the faces that repeat a vertex."""
+    return (
+        (faces[:, 0] == faces[:, 1])
+        | (faces[:, 1] == faces[:, 2])
+        | (faces[:, 0] == faces[:, 2])
+    )
+
+
+def to_obj(mesh: Mesh) -> str:
+    # One %-formatting call per element kind, np.savetxt formats row by row
+    vertex_lines = "v %.6g %.6g %.6g\n" * len(mesh.vertices)
+    face_lines = "f %d %d %d\n" * len(mesh.faces)
+    return vertex_lines % tuple(mesh.vertices.ravel().tolist()) + face_lines % tuple(
+        (mesh.faces + 1).ravel().tolist()
+    )
@@ -0,0 +1,93 @@
+import struct
+
+import numpy as np
+import numpy.typing as npt
+import zstandard
+
+from .arrays import Mesh
+
+MAGIC = b"OBJZ"
+VERSION = 1
+QUANTIZATION_BITS_DEFAULT = 16
+ZSTD_LEVEL_DEFAULT = 9
+
+# magic, version, quantization bits, index width in bytes, vertex count, face count,
+# origin xyz, scale
+_HEADER = struct.Struct("<4sBBBxII3ff")
+
+
+def _unsigned_dtype(max_value: int) -> np.dtype:
+    for dtype in (np.uint8, np.uint16, np.uint32):
+        if max_value <= np.iinfo(dtype).max:
+            return np.dtype(dtype).newbyteorder("<")
+    return np.dtype("<u8")
+
+
+def encode_mesh(
+    mesh: Mesh,
+    bits: int = QUANTIZATION_BITS_DEFAULT,
+    level: int = ZSTD_LEVEL_DEFAULT,
+) -> bytes:
+    """Compact binary encoding of a mesh.
+
+    Coordinates are quantized to `bits` bits on the bounding box, so the error
+    is at most half a step of its longest side divided by 2**bits - 1. Face
+    indexes are delta-encoded in the order they are referenced, zigzag-mapped
+    to unsigned and stored in the narrowest integer type that fits. Both
+    streams are then compressed with zstd.
+    """
+    if not 1 <= bits <= 32:
+        raise ValueError(f"Quantization bits out of range: {bits}")
+
+    vertices = mesh.vertices.astype(np.float64)
+    origin = vertices.min(axis=0) if len(vertices) else np.zeros(3)
+    extent = float((vertices.max(axis=0) - origin).max()) if len(vertices) else 0.0
+    steps = (1 << bits) - 1
+    scale = extent / steps if extent > 0 else 1.0
+
+    quantized = np.rint((vertices - origin) / scale).astype(_unsigned_dtype(steps))
+
+    indexes = mesh.faces.astype(np.int64).ravel()
+    deltas = np.diff(indexes, prepend=0)
+    zigzag = (deltas << 1) ^ (deltas >> 63)
+    index_dtype = _unsigned_dtype(int(zigzag.max()) if zigzag.size else 0)
+
+    header = _HEADER.pack(
+        MAGIC,
+        VERSION,
+        bits,
+        index_dtype.itemsize,
+        len(vertices),
+        len(mesh.faces),
+        *origin.astype(np.float32).tolist(),
+        scale,
+    )
+    payload = quantized.tobytes() + zigzag.astype(index_dtype).tobytes()
+
+    return header + zstandard.ZstdCompressor(level=level).compress(payload)
+
+
+def decode_mesh(data: bytes) -> Mesh:
+    magic, version, bits, index_size, vertex_count, face_count, *origin, scale = (
+        _HEADER.unpack_from(data)
+    )
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("Not an encoded mesh")
+
+    payload = zstandard.ZstdDecompressor().decompress(data[_HEADER.size :])
+
+    vertex_dtype = _unsigned_dtype((1 << bits) - 1)
+    quantized = np.frombuffer(payload, dtype=vertex_dtype, count=vertex_count * 3)
+    vertices = quantized.reshape(-1, 3) * np.float64(scale) + np.array(origin)
+
+    index_dtype = np.dtype(f"<u{index_size}")
+    zigzag = np.frombuffer(
+        payload,
+        dtype=index_dtype,
+        count=face_count * 3,
+        offset=quantized.nbytes,
+    ).astype(np.int64)
+    deltas = (zigzag >> 1) ^ -(zigzag & 1)
+    faces: npt.NDArray[np.int64] = np.cumsum(deltas).reshape(-1, 3)
+
+    return Mesh(vertices.astype(np.float32), faces.astype(np.int32))
@@ -0,0 +1,60 @@
+import numpy as np
+import numpy.typing as npt
+
+from .arrays import Mesh
+
+D2_BINS = 64
+D2_SAMPLES = 32768  # the distance between two samplings of a sphere is ~0.02
+# Distances are divided by their mean, those of a segment (the most elongated shape) end at 3
+D2_MAX_DISTANCE = 3.0
+
+
+def sample_surface(
+    mesh: Mesh, count: int, rng: np.random.Generator
+) -> npt.NDArray[np.float64]:
+    """Points drawn uniformly on the surface: faces weighted by area, then barycentric."""
+    vertices = mesh.vertices.astype(np.float64)
+    corners = vertices[mesh.faces]
+    edges_ab, edges_ac = corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0]
+    areas = np.linalg.norm(np.cross(edges_ab, edges_ac), axis=1)
+
+    cumulative = np.cumsum(areas)
+    faces = np.searchsorted(cumulative, rng.random(count) * cumulative[-1], side="right")
+    faces = np.minimum(faces, len(areas) - 1)
+
+    # Folding the unit square onto the triangle keeps the density uniform
+    u, v = rng.random(count), rng.random(count)
+    folded = u + v > 1
+    u[folded], v[folded] = 1 - u[folded], 1 - v[folded]
+
+    return corners[faces, 0] + u[:, None] * edges_ab[faces] + v[:, None] * edges_ac[faces]
+
+
+def d2_descriptor(
+    mesh: Mesh, bins: int = D2_BINS, samples: int = D2_SAMPLES
+) -> npt.NDArray[np.float32] | None:
+    """D2 shape distribution: histogram of the distances between random surface points.
+
+    It doesn't change with rotation or translation, and with scale once the
+    distances are divided by their mean. The square root of the normalized
+    histogram is returned so that the Euclidean distance between descriptors
+    is the Hellinger distance between distributions, in [0, sqrt(2)]. The
+    sampling is seeded, a mesh always gets the same descriptor. None for a
+    mesh without area.
+    """
+    if not len(mesh.faces):
+        return None
+
+    rng = np.random.default_rng(0)
+    points = sample_surface(mesh, 2 * samples, rng)
+    distances = np.linalg.norm(points[:samples] - points[samples:], axis=1)
+
+    mean = distances.mean()
+    if not np.isfinite(mean) or mean <= 0:
+        return None
+
+    histogram = np.bincount(
+        np.minimum(distances / mean * (bins / D2_MAX_DISTANCE), bins - 1).astype(np.int64),
+        minlength=bins,
+    )
+    return np.sqrt(histogram / samples).astype(np.float32)
@@ -0,0 +1,158 @@
+import json
+import struct
+from typing import Any
+
+import numpy as np
+import numpy.typing as npt
+
+from .arrays import Mesh
+
+GLB_MAGIC = 0x46546C67  # "glTF"
+GLB_VERSION = 2
+JSON_CHUNK_TYPE = 0x4E4F534A  # "JSON"
+BIN_CHUNK_TYPE = 0x004E4942  # "BIN\0"
+
+# glTF enums
+ARRAY_BUFFER = 34962
+ELEMENT_ARRAY_BUFFER = 34963
+FLOAT = 5126
+UNSIGNED_SHORT = 5123
+UNSIGNED_INT = 5125
+TRIANGLES = 4
+
+
+def vertex_normals(mesh: Mesh) -> npt.NDArray[np.float32]:
+    """Unit vertex normals, the area-weighted mean of the normals of adjacent faces."""
+    vertices = mesh.vertices.astype(np.float64)
+    corners = vertices[mesh.faces]
+    face_normals = np.cross(corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0])
+
+    indexes = mesh.faces.ravel()
+    corner_normals = np.repeat(face_normals, 3, axis=0)
+    normals = np.stack(
+        [
+            np.bincount(indexes, weights=corner_normals[:, axis], minlength=len(vertices))
+            for axis in range(3)
+        ],
+        axis=1,
+    )
+
+    lengths = np.linalg.norm(normals, axis=1, keepdims=True)
+    # Vertices without faces get an arbitrary unit normal, glTF requires one
+    normals = np.where(lengths > 0, normals / np.where(lengths > 0, lengths, 1), [0, 0, 1])
+    return normals.astype(np.float32)
+
+
+def _padded(data: bytes, padding: bytes) -> bytes:
+    return data + padding * (-len(data) % 4)
+
+
+def to_glb(mesh: Mesh) -> bytes:
+    """Binary glTF 2.0 with one triangle primitive.
+
+    Positions and normals are float32, indexes are uint16 when the vertex
+    count allows it and uint32 otherwise.
+    """
+    positions = np.ascontiguousarray(mesh.vertices, dtype="<f4")
+    normals = np.ascontiguousarray(vertex_normals(mesh), dtype="<f4")
+
+    if len(positions) <= np.iinfo(np.uint16).max:
+        indexes, index_type = np.ascontiguousarray(mesh.faces, dtype="<u2"), UNSIGNED_SHORT
+    else:
+        indexes, index_type = np.ascontiguousarray(mesh.faces, dtype="<u4"), UNSIGNED_INT
+
+    views = [
+        (positions.tobytes(), ARRAY_BUFFER),
+        (normals.tobytes(), ARRAY_BUFFER),
+        (indexes.tobytes(), ELEMENT_ARRAY_BUFFER),
+    ]
+
+    binary = b""
+    buffer_views: list[dict[str, Any]] = []
+    for data, target in views:
+        buffer_views.append(
+            {"buffer": 0, "byteOffset": len(binary), "byteLength": len(data), "target": target}
+        )
+        binary += _padded(data, b"\0")
+
+    has_vertices = len(positions) > 0
+    gltf = {
+        "asset": {"version": "2.0"},
+        "scene": 0,
+        "scenes": [{"nodes": [0]}],
+        "nodes": [{"mesh": 0}],
+        "meshes": [
+            {
+                "primitives": [
+                    {
+                        "attributes": {"POSITION": 0, "NORMAL": 1},
+                        "indices": 2,
+                        "mode": TRIANGLES,
+                    }
+                ]
+            }
+        ],
+        "buffers": [{"byteLength": len(binary)}],
+        "bufferViews": buffer_views,
+        "accessors": [
+            {
+                "bufferView": 0,
+                "componentType": FLOAT,
+                "count": len(positions),
+                "type": "VEC3",
+                # Required for POSITION
+                "min": positions.min(axis=0).tolist() if has_vertices else [0, 0, 0],
+                "max": positions.max(axis=0).tolist() if has_vertices else [0, 0, 0],
+            },
+            {"bufferView": 1, "componentType": FLOAT, "count": len(normals), "type": "VEC3"},
+            {
+                "bufferView": 2,
+                "componentType": index_type,
+                "count": indexes.size,
+                "type": "SCALAR",
+            },
+        ],
+    }
+
+    json_chunk = _padded(json.dumps(gltf, separators=(",", ":")).encode(), b" ")
+    length = 12 + 8 + len(json_chunk) + 8 + len(binary)
+
+    return b"".join(
+        (
+            struct.pack("<III", GLB_MAGIC, GLB_VERSION, length),
+            struct.pack("<II", len(json_chunk), JSON_CHUNK_TYPE),
+            json_chunk,
+            struct.pack("<II", len(binary), BIN_CHUNK_TYPE),
+            binary,
+        )
+    )
+
+
+def from_glb(data: bytes) -> Mesh:
+    """Read back the first primitive of a GLB written by `to_glb`."""
+    magic, version, _ = struct.unpack_from("<III", data, 0)
+    if magic != GLB_MAGIC or version != GLB_VERSION:
+        raise ValueError("Not a glTF 2.0 binary")
+
+    json_length, _ = struct.unpack_from("<II", data, 12)
+    gltf = json.loads(data[20 : 20 + json_length])
+    binary_offset = 20 + json_length + 8
+
+    def read_accessor(index: int, dtype: str) -> npt.NDArray:
+        accessor = gltf["accessors"][index]
+        view = gltf["bufferViews"][accessor["bufferView"]]
+        components = 3 if accessor["type"] == "VEC3" else 1
+        return np.frombuffer(
+            data,
+            dtype=dtype,
+            count=accessor["count"] * components,
+            offset=binary_offset + view["byteOffset"],
+        )
+
+    primitive = gltf["meshes"][0]["primitives"][0]
+    index_accessor = gltf["accessors"][primitive["indices"]]
+    index_dtype = "<u2" if index_accessor["componentType"] == UNSIGNED_SHORT else "<u4"
+
+    vertices = read_accessor(primitive["attributes"]["POSITION"], "<f4").reshape(-1, 3)
+    faces = read_accessor(primitive["indices"], index_dtype).reshape(-1, 3)
+    return Mesh(vertices.astype(np.float32), faces.astype(np.int32))
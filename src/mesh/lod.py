@@ -0,0 +1,62 @@
+from collections.abc import Sequence
+
+import numpy as np
+
+from .arrays import Mesh, degenerate_faces, remove_unreferenced, unique_faces
+
+LOD_RESOLUTIONS_DEFAULT = (64, 32, 16)
+MIN_LOD_REDUCTION = 0.8  # A level must have fewer vertices than this share of the previous one
+
+
+def cluster_vertices(mesh: Mesh, resolution: int) -> Mesh:
+    """Decimate a mesh by vertex clustering.
+
+    The bounding box is divided into a grid of `resolution` cells along its
+    longest side, the vertices of every cell are merged into their mean and
+    the faces that collapse or duplicate another one are dropped.
+    """
+    vertices = mesh.vertices
+    if not len(vertices):
+        return mesh
+
+    lower = vertices.min(axis=0)
+    extent = float((vertices.max(axis=0) - lower).max())
+    cell_size = extent / resolution if extent > 0 else 1.0
+
+    cells = np.minimum(((vertices - lower) / cell_size).astype(np.int64), resolution - 1)
+    keys = (cells[:, 0] * resolution + cells[:, 1]) * resolution + cells[:, 2]
+    _, cluster = np.unique(keys, return_inverse=True)
+
+    counts = np.bincount(cluster)
+    positions = np.stack(
+        [np.bincount(cluster, weights=vertices[:, axis]) for axis in range(3)], axis=1
+    ) / counts[:, None]
+
+    faces = cluster[mesh.faces]
+    faces = unique_faces(faces[~degenerate_faces(faces)])
+    positions, faces, _ = remove_unreferenced(positions, faces)
+
+    return Mesh(positions.astype(np.float32), faces.astype(np.int32))
+
+
+def build_lods(
+    mesh: Mesh, resolutions: Sequence[int] = LOD_RESOLUTIONS_DEFAULT
+) -> list[Mesh]:
+    """Decimated levels of detail, from the finest to the coarsest.
+
+    Levels that wouldn't be noticeably smaller than the previous one, or
+    that have no faces left, are not built. Small meshes get no levels.
+    """
+    lods: list[Mesh] = []
+    vertex_count = len(mesh.vertices)
+
+    for resolution in resolutions:
+        lod = cluster_vertices(mesh, resolution)
+
+        if not len(lod.faces) or len(lod.vertices) > vertex_count * MIN_LOD_REDUCTION:
+            break
+
+        lods.append(lod)
+        vertex_count = len(lod.vertices)
+
+    return lods
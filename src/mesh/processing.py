@@ -0,0 +1,151 @@
+import asyncio
+import functools
+import hashlib
+import logging
+from collections.abc import Sequence
+from concurrent.futures import ProcessPoolExecutor
+from typing import TypedDict
+
+import numpy as np
+import numpy.typing as npt
+
+from .arrays import parse_obj, to_obj
+from .codec import encode_mesh
+from .descriptor import d2_descriptor
+from .gltf import to_glb
+from .lod import LOD_RESOLUTIONS_DEFAULT, build_lods
+from .repair import WELD_TOLERANCE_DEFAULT, RepairReport, is_repaired, repair_mesh
+from .stats import MeshStats, mesh_stats
+from .thumbnail import THUMBNAIL_SIZE_DEFAULT, render_thumbnail
+
+logger = logging.getLogger("app")
+
+
+class ProcessedMesh(TypedDict):
+    content: str  # The repaired OBJ, or the generated one if nothing was fixed
+    repair_report: RepairReport | None  # None if the OBJ couldn't be parsed
+    lods: list[str]  # OBJ of the decimated levels of detail, finest first
+    glbs: list[bytes]  # GLB of the mesh and of its levels of detail, if it has faces
+    encoded: list[bytes]  # Compact encoding of the same, in the compressed storage mode
+    thumbnail: bytes | None  # PNG preview, if the mesh has faces and thumbnails are enabled
+    digest: str  # Hash of the canonical mesh and of the settings, keys the stored objects
+    stats: MeshStats | None  # None if the OBJ couldn't be parsed
+    descriptor: npt.NDArray[np.float32] | None  # D2 shape descriptor, if the mesh has area
+
+
+def _digest(*parts: bytes) -> str:
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part)
+    return digest.hexdigest()
+
+
+def process_obj(
+    content: str,
+    weld_tolerance: float = WELD_TOLERANCE_DEFAULT,
+    lod_resolutions: Sequence[int] = LOD_RESOLUTIONS_DEFAULT,
+    quantization_bits: int | None = None,
+    thumbnail_size: int = THUMBNAIL_SIZE_DEFAULT,
+) -> ProcessedMesh:
+    """Prepare a generated OBJ block for storage, runs in a worker process."""
+    try:
+        mesh = parse_obj(content)
+    except ValueError as e:
+        logger.warning(f"Mesh is saved as generated, it can't be parsed: {e}")
+        return ProcessedMesh(
+            content=content,
+            repair_report=None,
+            lods=[],
+            glbs=[],
+            encoded=[],
+            thumbnail=None,
+            digest=_digest(b"text", content.encode()),
+            stats=None,
+            descriptor=None,
+        )
+
+    mesh, report = repair_mesh(mesh, weld_tolerance)
+
+    if is_repaired(report):
+        # A repaired block is rewritten with vertices and triangles only
+        content = to_obj(mesh)
+
+    lod_meshes = build_lods(mesh, lod_resolutions)
+    lods = [to_obj(lod) for lod in lod_meshes]
+    variants = [mesh, *lod_meshes]
+    glbs = [to_glb(variant) for variant in variants] if len(mesh.faces) else []
+    encoded = (
+        [encode_mesh(variant, quantization_bits) for variant in variants]
+        if quantization_bits
+        else []
+    )
+
+    # The finest level of detail is still about a pixel per cell in a thumbnail
+    thumbnail = (
+        render_thumbnail(lod_meshes[0] if lod_meshes else mesh, thumbnail_size)
+        if thumbnail_size and len(mesh.faces)
+        else None
+    )
+
+    # Identical meshes share their stored objects. The parsed arrays ignore the formatting,
+    # comments and texture references of the text; the settings change the variants.
+    settings = (mesh.vertices.shape, tuple(lod_resolutions), quantization_bits, thumbnail_size)
+    digest = _digest(
+        b"mesh",
+        repr(settings).encode(),
+        mesh.vertices.astype("<f4").tobytes(),
+        mesh.faces.astype("<i4").tobytes(),
+    )
+
+    return ProcessedMesh(
+        content=content,
+        repair_report=report,
+        lods=lods,
+        glbs=glbs,
+        encoded=encoded,
+        thumbnail=thumbnail,
+        digest=digest,
+        stats=mesh_stats(mesh),
+        descriptor=d2_descriptor(mesh),
+    )
+
+
+class AsyncMeshProcessor:
+    """Runs the CPU-bound mesh post-processing in worker processes.
+
+    Parsing, repairing, decimating, converting and rendering a large mesh takes long enough
+    to stall every other request if it ran on the event loop.
+    """
+
+    MAX_WORKERS_DEFAULT = 1
+
+    def __init__(
+        self,
+        max_workers: int = MAX_WORKERS_DEFAULT,
+        weld_tolerance: float = WELD_TOLERANCE_DEFAULT,
+        lod_resolutions: Sequence[int] = LOD_RESOLUTIONS_DEFAULT,
+        quantization_bits: int | None = None,
+        thumbnail_size: int = THUMBNAIL_SIZE_DEFAULT,
+    ) -> None:
+        self._process_pool = ProcessPoolExecutor(max_workers)
+        self._weld_tolerance = weld_tolerance
+        self._lod_resolutions = tuple(lod_resolutions)
+        self._quantization_bits = quantization_bits
+        self._thumbnail_size = thumbnail_size
+
+    async def process(self, content: str) -> ProcessedMesh:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._process_pool,
+            functools.partial(
+                process_obj,
+                content,
+                weld_tolerance=self._weld_tolerance,
+                lod_resolutions=self._lod_resolutions,
+                quantization_bits=self._quantization_bits,
+                thumbnail_size=self._thumbnail_size,
+            ),
+        )
+
+    def shutdown(self) -> None:
+        self._process_pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,103 @@
+from typing import TypedDict
+
+import numpy as np
+import numpy.typing as npt
+
+from .arrays import Mesh, degenerate_faces, remove_unreferenced, unique_faces
+
+WELD_TOLERANCE_DEFAULT = 1e-5
+
+
+class RepairReport(TypedDict):
+    vertices: int  # Vertex count of the mesh as generated
+    faces: int  # Triangle count of the mesh as generated
+    non_finite_vertices: int  # NaN or infinite coordinates, their faces are dropped
+    out_of_range_faces: int  # Faces referencing a missing vertex
+    welded_vertices: int  # Vertices merged into another one at the same position
+    degenerate_faces: int  # Faces with repeated vertices or zero area
+    duplicate_faces: int  # Faces over the same vertices as a previous one
+    unreferenced_vertices: int  # Vertices no face uses, removed
+
+
+def is_repaired(report: RepairReport) -> bool:
+    """Whether anything was fixed."""
+    return any(
+        count
+        for key, count in report.items()
+        if key not in ("vertices", "faces")
+    )
+
+
+def repair_mesh(
+    mesh: Mesh, weld_tolerance: float = WELD_TOLERANCE_DEFAULT
+) -> tuple[Mesh, RepairReport]:
+    """Fix the usual defects of generated meshes with array operations.
+
+    Vertices closer than `weld_tolerance` (on a grid of that size) are welded,
+    faces that reference missing or non-finite vertices, repeat a vertex, have
+    no area or duplicate another face are dropped, and unreferenced vertices
+    are removed, with the face indexes remapped after every step.
+    """
+    vertices, faces = mesh.vertices, mesh.faces.astype(np.int64)
+    report = RepairReport(
+        vertices=len(vertices),
+        faces=len(faces),
+        non_finite_vertices=0,
+        out_of_range_faces=0,
+        welded_vertices=0,
+        degenerate_faces=0,
+        duplicate_faces=0,
+        unreferenced_vertices=0,
+    )
+
+    in_range = ((faces >= 0) & (faces < len(vertices))).all(axis=1)
+    report["out_of_range_faces"] = int((~in_range).sum())
+    faces = faces[in_range]
+
+    finite = np.isfinite(vertices).all(axis=1)
+    report["non_finite_vertices"] = int((~finite).sum())
+    if report["non_finite_vertices"]:
+        faces = faces[finite[faces].all(axis=1)]
+        vertices, faces = vertices[finite], (np.cumsum(finite) - 1)[faces]
+
+    vertices, faces, report["welded_vertices"] = _weld(vertices, faces, weld_tolerance)
+
+    corners = vertices[faces]
+    areas = np.linalg.norm(
+        np.cross(corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0]), axis=1
+    )
+    degenerate = degenerate_faces(faces) | (areas == 0)
+    report["degenerate_faces"] = int(degenerate.sum())
+    faces = faces[~degenerate]
+
+    face_count = len(faces)
+    faces = unique_faces(faces)
+    report["duplicate_faces"] = face_count - len(faces)
+
+    vertices, faces, report["unreferenced_vertices"] = remove_unreferenced(
+        vertices, faces
+    )
+
+    return Mesh(vertices.astype(np.float32), faces.astype(np.int32)), report
+
+
+def _weld(
+    vertices: npt.NDArray[np.float32],
+    faces: npt.NDArray[np.int64],
+    tolerance: float,
+) -> tuple[npt.NDArray[np.float32], npt.NDArray[np.int64], int]:
+    if not len(vertices):
+        return vertices, faces, 0
+
+    quantized = np.round(vertices / tolerance).astype(np.int64)
+    _, first, inverse = np.unique(
+        quantized, axis=0, return_index=True, return_inverse=True
+    )
+
+    # Keep the vertices in their original order, represented by their first copy
+    order = np.argsort(first)
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+
+    welded = vertices[first[order]]
+    return welded, rank[inverse.reshape(-1)][faces], len(vertices) - len(welded)
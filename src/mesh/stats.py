@@ -0,0 +1,40 @@
+from typing import TypedDict
+
+import numpy as np
+
+from .arrays import Mesh
+
+
+class MeshStats(TypedDict):
+    vertex_count: int
+    face_count: int
+    bounding_box: list[float]  # min x, y, z then max x, y, z, zeros for an empty mesh
+    surface_area: float
+    is_watertight: bool  # Every edge is shared by exactly two faces
+
+
+def mesh_stats(mesh: Mesh) -> MeshStats:
+    vertices = mesh.vertices.astype(np.float64)
+    faces = mesh.faces.astype(np.int64)
+
+    if len(vertices):
+        bounding_box = [*vertices.min(axis=0).tolist(), *vertices.max(axis=0).tolist()]
+    else:
+        bounding_box = [0.0] * 6
+
+    corners = vertices[faces]
+    areas = np.linalg.norm(
+        np.cross(corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0]), axis=1
+    )
+
+    # Undirected edges, whatever the winding, as one integer key per (smaller, larger) pair
+    edges = np.sort(faces[:, [0, 1, 1, 2, 2, 0]].reshape(-1, 2), axis=1)
+    _, edge_uses = np.unique(edges[:, 0] * len(vertices) + edges[:, 1], return_counts=True)
+
+    return MeshStats(
+        vertex_count=len(vertices),
+        face_count=len(faces),
+        bounding_box=bounding_box,
+        surface_area=float(areas.sum() / 2),
+        is_watertight=bool(len(faces)) and bool((edge_uses == 2).all()),
+    )
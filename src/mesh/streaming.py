@@ -0,0 +1,140 @@
+import logging
+from collections.abc import Callable, Iterable, Iterator
+
+import numpy as np
+
+from .arrays import Mesh, parse_obj, to_obj
+
+logger = logging.getLogger("app")
+
+BATCH_BYTES = 1 << 18  # Of OBJ text parsed at once, the peak memory is ~16 times that
+BATCH_ELEMENTS = 1 << 16  # Of vertices or faces written at once from arrays
+
+# Opens the OBJ text from the start every time it's called, as a stream of chunks
+type ObjSource = Callable[[], Iterable[bytes]]
+
+_STL_TRIANGLE = np.dtype(
+    [("normal", "<f4", (3,)), ("vertices", "<f4", (3, 3)), ("attributes", "<u2")]
+)
+_PLY_FACE = np.dtype([("count", "u1"), ("indexes", "<i4", (3,))])
+
+
+def iter_text_batches(
+    chunks: Iterable[bytes], batch_bytes: int = BATCH_BYTES
+) -> Iterator[str]:
+    """Regroup chunks of text into batches of whole lines of about `batch_bytes`."""
+    pending = bytearray()
+    for chunk in chunks:
+        pending += chunk
+        if len(pending) < batch_bytes:
+            continue
+
+        end = pending.rfind(b"\n") + 1
+        if end:
+            yield pending[:end].decode()
+            del pending[:end]
+
+    if pending:
+        yield pending.decode()
+
+
+def iter_mesh_batches(chunks: Iterable[bytes]) -> Iterator[Mesh]:
+    """Parse OBJ text batch by batch, faces index the vertices of the whole file."""
+    vertex_count = 0
+    for text in iter_text_batches(chunks):
+        mesh = parse_obj(text, vertex_offset=vertex_count)
+        vertex_count += len(mesh.vertices)
+        yield mesh
+
+
+def iter_obj_chunks(mesh: Mesh) -> Iterator[bytes]:
+    """OBJ text of a mesh in memory, a batch of elements at a time."""
+    for start in range(0, len(mesh.vertices), BATCH_ELEMENTS):
+        vertices = mesh.vertices[start : start + BATCH_ELEMENTS]
+        yield to_obj(Mesh(vertices, mesh.faces[:0])).encode()
+
+    for start in range(0, len(mesh.faces), BATCH_ELEMENTS):
+        faces = mesh.faces[start : start + BATCH_ELEMENTS]
+        yield to_obj(Mesh(mesh.vertices[:0], faces)).encode()
+
+
+def count_elements(chunks: Iterable[bytes]) -> tuple[int, int]:
+    """Vertex and triangle counts of OBJ text, for headers that need them up front."""
+    vertex_count = face_count = 0
+    for mesh in iter_mesh_batches(chunks):
+        vertex_count += len(mesh.vertices)
+        face_count += len(mesh.faces)
+    return vertex_count, face_count
+
+
+def _check_count(kind: str, expected: int, written: int) -> None:
+    if written != expected:
+        logger.error(f"Converted model has {written} {kind}, its header says {expected}")
+
+
+def iter_ply(source: ObjSource, vertex_count: int, face_count: int) -> Iterator[bytes]:
+    """Binary little-endian PLY, in two passes over the OBJ so that the memory stays constant.
+
+    The header needs both counts and every vertex has to come before the
+    first face, wherever the faces are in the OBJ.
+    """
+    yield (
+        "ply\n"
+        "format binary_little_endian 1.0\n"
+        f"element vertex {vertex_count}\n"
+        "property float x\n"
+        "property float y\n"
+        "property float z\n"
+        f"element face {face_count}\n"
+        "property list uchar int vertex_indices\n"
+        "end_header\n"
+    ).encode()
+
+    written = 0
+    for mesh in iter_mesh_batches(source()):
+        written += len(mesh.vertices)
+        yield mesh.vertices.astype("<f4").tobytes()
+    _check_count("vertices", vertex_count, written)
+
+    written = 0
+    for mesh in iter_mesh_batches(source()):
+        records = np.empty(len(mesh.faces), dtype=_PLY_FACE)
+        records["count"] = 3
+        records["indexes"] = mesh.faces
+        written += len(records)
+        yield records.tobytes()
+    _check_count("faces", face_count, written)
+
+
+def iter_stl(source: ObjSource, face_count: int) -> Iterator[bytes]:
+    """Binary STL, in one pass over the OBJ.
+
+    Triangles repeat the coordinates of their vertices, so the vertices read
+    so far are kept as a float32 array (12 bytes each); the faces and the
+    text are not.
+    """
+    yield b"\0" * 80 + np.uint32(face_count).astype("<u4").tobytes()
+
+    vertices = np.empty((0, 3), dtype=np.float32)
+    new_vertices: list[np.ndarray] = []
+    written = 0
+    for mesh in iter_mesh_batches(source()):
+        new_vertices.append(mesh.vertices)
+        if not len(mesh.faces):
+            continue
+
+        # Usually once, OBJ files define the vertices before the faces
+        vertices = np.concatenate([vertices, *new_vertices])
+        new_vertices = []
+
+        corners = vertices[mesh.faces]
+        normals = np.cross(corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0])
+        lengths = np.linalg.norm(normals, axis=1, keepdims=True)
+
+        records = np.zeros(len(mesh.faces), dtype=_STL_TRIANGLE)
+        records["normal"] = np.divide(normals, lengths, where=lengths > 0, out=normals)
+        records["vertices"] = corners
+        written += len(records)
+        yield records.tobytes()
+
+    _check_count("faces", face_count, written)
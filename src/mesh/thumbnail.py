@@ -0,0 +1,150 @@
+import struct
+import zlib
+
+import numpy as np
+import numpy.typing as npt
+
+from .arrays import Mesh
+
+THUMBNAIL_SIZE_DEFAULT = 128
+
+# Fixed three-quarter view: turned around the vertical axis, then tilted toward the camera
+_YAW = np.radians(-35)
+_PITCH = np.radians(25)
+_VIEW = np.array(
+    [[1, 0, 0], [0, np.cos(_PITCH), -np.sin(_PITCH)], [0, np.sin(_PITCH), np.cos(_PITCH)]]
+) @ np.array(
+    [[np.cos(_YAW), 0, np.sin(_YAW)], [0, 1, 0], [-np.sin(_YAW), 0, np.cos(_YAW)]]
+)
+_LIGHT = np.array([-0.4, 0.6, 1.0]) / np.linalg.norm([-0.4, 0.6, 1.0])
+_BASE_COLOR = np.array([150, 170, 205])
+_AMBIENT = 0.3
+_MARGIN = 0.05  # of the thumbnail size, on every side
+
+# Pixel/triangle pairs tested at once, bounds the memory of a render to ~200 MiB
+_MAX_FRAGMENTS = 1 << 22
+
+
+def rasterize(mesh: Mesh, size: int = THUMBNAIL_SIZE_DEFAULT) -> npt.NDArray[np.uint8]:
+    """Flat-shaded orthographic render of a mesh as a (size, size, 4) RGBA image.
+
+    Every triangle is expanded into the pixels of its bounding box, the
+    pixels outside of it are masked with barycentric coordinates and the
+    nearest fragment of every pixel is kept, all with array operations over
+    the whole mesh (in chunks of _MAX_FRAGMENTS). The background is
+    transparent.
+    """
+    image = np.zeros((size * size, 4), dtype=np.uint8)
+    if not len(mesh.faces):
+        return image.reshape(size, size, 4)
+
+    vertices = mesh.vertices.astype(np.float64)
+    referenced = np.zeros(len(vertices), dtype=bool)
+    referenced[mesh.faces] = True
+    used = vertices[referenced]
+    center = (used.min(axis=0) + used.max(axis=0)) / 2
+    radius = float(np.linalg.norm(used - center, axis=1).max()) or 1.0
+
+    view = (vertices - center) @ _VIEW.T
+    scale = size * (0.5 - _MARGIN) / radius
+    # Pixel coordinates, y pointing down, and depth growing away from the camera
+    x = size / 2 + view[:, 0] * scale
+    y = size / 2 - view[:, 1] * scale
+    z = -view[:, 2]
+
+    a, b, c = mesh.faces[:, 0], mesh.faces[:, 1], mesh.faces[:, 2]
+    denominator = (y[b] - y[c]) * (x[a] - x[c]) + (x[c] - x[b]) * (y[a] - y[c])
+
+    # Two-sided lighting, generated meshes don't have a consistent winding
+    corners = view[mesh.faces]
+    normals = np.cross(corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0])
+    lengths = np.linalg.norm(normals, axis=1)
+    visible = (np.abs(denominator) > 1e-12) & (lengths > 0)
+
+    diffuse = np.abs(normals[visible] @ _LIGHT) / lengths[visible]
+    colors = (_BASE_COLOR * (_AMBIENT + (1 - _AMBIENT) * diffuse)[:, None]).astype(np.uint8)
+
+    a, b, c, denominator = a[visible], b[visible], c[visible], denominator[visible]
+    # Barycentric weights of a and b as linear functions of the pixel center
+    wa_x, wa_y = (y[b] - y[c]) / denominator, (x[c] - x[b]) / denominator
+    wb_x, wb_y = (y[c] - y[a]) / denominator, (x[a] - x[c]) / denominator
+    origin_x, origin_y = x[c], y[c]
+    depth_a, depth_b, depth_c = z[a] - z[c], z[b] - z[c], z[c]
+
+    # Pixels whose center (i + 0.5) is inside the bounding box of the triangle
+    x0 = np.clip(np.ceil(np.minimum(np.minimum(x[a], x[b]), x[c]) - 0.5), 0, size)
+    x1 = np.clip(np.floor(np.maximum(np.maximum(x[a], x[b]), x[c]) - 0.5), -1, size - 1)
+    y0 = np.clip(np.ceil(np.minimum(np.minimum(y[a], y[b]), y[c]) - 0.5), 0, size)
+    y1 = np.clip(np.floor(np.maximum(np.maximum(y[a], y[b]), y[c]) - 0.5), -1, size - 1)
+    widths = np.maximum(x1 - x0 + 1, 0).astype(np.int64)
+    counts = widths * np.maximum(y1 - y0 + 1, 0).astype(np.int64)
+
+    depth_buffer = np.full(size * size, np.inf)
+    for triangles in _chunks(counts):
+        chunk_counts = counts[triangles]
+        triangle = np.repeat(triangles, chunk_counts)
+        offset = np.arange(triangle.size) - np.repeat(
+            np.cumsum(chunk_counts) - chunk_counts, chunk_counts
+        )
+        px = x0[triangle] + offset % widths[triangle]
+        py = y0[triangle] + offset // widths[triangle]
+
+        dx, dy = px + 0.5 - origin_x[triangle], py + 0.5 - origin_y[triangle]
+        weight_a = wa_x[triangle] * dx + wa_y[triangle] * dy
+        weight_b = wb_x[triangle] * dx + wb_y[triangle] * dy
+        inside = (weight_a >= 0) & (weight_b >= 0) & (weight_a + weight_b <= 1)
+
+        triangle, weight_a, weight_b = triangle[inside], weight_a[inside], weight_b[inside]
+        pixel = (py[inside] * size + px[inside]).astype(np.int64)
+        depth = (
+            depth_c[triangle]
+            + weight_a * depth_a[triangle]
+            + weight_b * depth_b[triangle]
+        )
+
+        # The nearest fragments so far win, those of later chunks paint over them
+        np.minimum.at(depth_buffer, pixel, depth)
+        nearest = depth == depth_buffer[pixel]
+        pixel = pixel[nearest]
+        image[pixel, :3] = colors[triangle[nearest]]
+        image[pixel, 3] = 255
+
+    return image.reshape(size, size, 4)
+
+
+def _chunks(counts: npt.NDArray[np.int64]) -> list[npt.NDArray[np.int64]]:
+    """Split the triangles in runs of at most _MAX_FRAGMENTS pixels, a big one alone."""
+    ends = np.cumsum(counts)
+    starts = [0]
+    while starts[-1] < len(counts):
+        limit = (ends[starts[-1] - 1] if starts[-1] else 0) + _MAX_FRAGMENTS
+        starts.append(max(int(np.searchsorted(ends, limit, side="right")), starts[-1] + 1))
+    return [np.arange(start, end) for start, end in zip(starts, starts[1:])]
+
+
+def encode_png(image: npt.NDArray[np.uint8]) -> bytes:
+    """PNG of an (height, width, 4) RGBA image, without row filters."""
+    height, width, _ = image.shape
+    rows = np.zeros((height, 1 + width * 4), dtype=np.uint8)
+    rows[:, 1:] = image.reshape(height, -1)
+
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return (
+            struct.pack(">I", len(data))
+            + kind
+            + data
+            + struct.pack(">I", zlib.crc32(kind + data))
+        )
+
+    return b"".join(
+        (
+            b"\x89PNG\r\n\x1a\n",
+            chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 6, 0, 0, 0)),
+            chunk(b"IDAT", zlib.compress(rows.tobytes(), 6)),
+            chunk(b"IEND", b""),
+        )
+    )
+
+
+def render_thumbnail(mesh: Mesh, size: int = THUMBNAIL_SIZE_DEFAULT) -> bytes:
+    return encode_png(rasterize(mesh, size))
@@ -2,10 +2,21 @@ from __future__ import annotations
 
 import typing
 from datetime import datetime
-from typing import Optional, Any, Self, Annotated
+from typing import Optional, Any, Self, Annotated, Literal
 
 from pydantic import BaseModel, ConfigDict, Field
-from sqlalchemy import ForeignKey, Index, String, Text, func
+from sqlalchemy import (
+    BigInteger,
+    Boolean,
+    Float,
+    ForeignKey,
+    Index,
+    Integer,
+    LargeBinary,
+    String,
+    Text,
+    func,
+)
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
 from . import Base
@@ -15,6 +26,14 @@ if typing.TYPE_CHECKING:
     from .user import UserDAO
 
 
+type ModelFormat = Literal["obj", "glb"]
+type DownloadFormat = Literal["obj", "stl", "ply"]
+type StorageBackend = Literal["s3", "local"]
+type ModelSortKey = Literal[
+    "created_at", "name", "vertex_count", "face_count", "surface_area", "byte_size"
+]
+
+
 class ModelDAO(Base):
     __tablename__ = "models"
 
@@ -23,6 +42,25 @@ class ModelDAO(Base):
     created_at: Mapped[datetime] = mapped_column(server_default=func.now())
     content: Mapped[Optional[str]] = mapped_column(Text)
     storage_path: Mapped[Optional[str]] = mapped_column(String(2048))
+    # Decimated variants stored next to the original, see AsyncObjectModelRepository
+    lod_count: Mapped[int] = mapped_column(Integer, server_default="0")
+    has_glb: Mapped[bool] = mapped_column(Boolean, server_default="false")
+    has_thumbnail: Mapped[bool] = mapped_column(Boolean, server_default="false")
+
+    # Statistics of the stored mesh (src.mesh.stats), NULL if it couldn't be parsed
+    vertex_count: Mapped[Optional[int]] = mapped_column(Integer)
+    face_count: Mapped[Optional[int]] = mapped_column(Integer)
+    surface_area: Mapped[Optional[float]] = mapped_column(Float)
+    is_watertight: Mapped[Optional[bool]] = mapped_column(Boolean)
+    bbox_min_x: Mapped[Optional[float]] = mapped_column(Float)
+    bbox_min_y: Mapped[Optional[float]] = mapped_column(Float)
+    bbox_min_z: Mapped[Optional[float]] = mapped_column(Float)
+    bbox_max_x: Mapped[Optional[float]] = mapped_column(Float)
+    bbox_max_y: Mapped[Optional[float]] = mapped_column(Float)
+    bbox_max_z: Mapped[Optional[float]] = mapped_column(Float)
+    byte_size: Mapped[Optional[int]] = mapped_column(BigInteger)  # Of the stored original
+    # D2 shape descriptor (src.mesh.descriptor) as float32, see SharedShapeIndex
+    descriptor: Mapped[Optional[bytes]] = mapped_column(LargeBinary, deferred=True)
 
     message_id: Mapped[Optional[int]] = mapped_column(
         ForeignKey("messages.id", ondelete="SET NULL", onupdate="CASCADE")
@@ -34,12 +72,44 @@ class ModelDAO(Base):
     message: Mapped[Optional["MessageDAO"]] = relationship(back_populates="models")
     user: Mapped[Optional["UserDAO"]] = relationship(back_populates="models")
 
-    __table_args__ = (Index("models_user_id_idx", "user_id"),)
+    # The favorites listing filters and sorts on these within a user's models
+    __table_args__ = (
+        Index("models_user_id_idx", "user_id"),
+        Index("models_user_id_vertex_count_idx", "user_id", "vertex_count"),
+        Index("models_user_id_face_count_idx", "user_id", "face_count"),
+        Index("models_user_id_surface_area_idx", "user_id", "surface_area"),
+        Index("models_user_id_byte_size_idx", "user_id", "byte_size"),
+    )
 
     def __repr__(self) -> str:
         return f"<Model(id={self.id}, filename='{self.name}', user_id={self.user_id})>"
 
 
+class StoredObjectDAO(Base):
+    """Reference count of the bucket objects of a model, shared by identical models.
+
+    Keys are content hashes, see src.mesh.processing.process_obj.
+    """
+
+    __tablename__ = "stored_objects"
+
+    storage_path: Mapped[str] = mapped_column(String(2048), primary_key=True)
+    ref_count: Mapped[int] = mapped_column(Integer, server_default="0")
+    # In the write-behind spool, not uploaded yet (AsyncS3ModelRepository.set_write_behind)
+    is_pending: Mapped[bool] = mapped_column(Boolean, server_default="false")
+    # Start of the upload in flight, it only completes while the row still holds it
+    upload_started_at: Mapped[Optional[datetime]] = mapped_column()
+    # Given up after the upload queue's attempts: served from the spool, not retried
+    upload_failed_at: Mapped[Optional[datetime]] = mapped_column()
+    created_at: Mapped[datetime] = mapped_column(server_default=func.now())
+
+    def __repr__(self) -> str:
+        return (
+            f"<StoredObject(storage_path='{self.storage_path}', "
+            f"ref_count={self.ref_count}, is_pending={self.is_pending})>"
+        )
+
+
 class ModelDTO(BaseModel):
     model_config = ConfigDict(
         from_attributes=True,
@@ -53,6 +123,12 @@ class ModelDTO(BaseModel):
     url: Annotated[str | None, Field(validation_alias="storage_path")] = None
     created_at: datetime | None = None
     is_saved: bool = False
+    vertex_count: int | None = None
+    face_count: int | None = None
+    surface_area: float | None = None
+    is_watertight: bool | None = None
+    bounding_box: list[float] | None = None  # min x, y, z then max x, y, z
+    byte_size: int | None = None
 
     @classmethod
     def model_validate(
@@ -76,6 +152,33 @@ class ModelDTO(BaseModel):
 
         if isinstance(obj, Base) and hasattr(obj, "user_id"):
             result.is_saved = obj.user_id is not None
+
+        if isinstance(obj, ModelDAO) and obj.bbox_min_x is not None:
+            result.bounding_box = [
+                obj.bbox_min_x,
+                obj.bbox_min_y,
+                obj.bbox_min_z,
+                obj.bbox_max_x,
+                obj.bbox_max_y,
+                obj.bbox_max_z,
+            ]
         
         return result
 
+
+class SimilarModelDTO(ModelDTO):
+    distance: float = 0  # Between shape descriptors, from 0 (same shape) to sqrt(2)
+
+
+class ModelFilter(BaseModel):
+    """Filters and order of a model listing, applied in SQL."""
+
+    min_vertices: int | None = Field(None, ge=0)
+    max_vertices: int | None = Field(None, ge=0)
+    min_faces: int | None = Field(None, ge=0)
+    max_faces: int | None = Field(None, ge=0)
+    min_bytes: int | None = Field(None, ge=0)
+    max_bytes: int | None = Field(None, ge=0)
+    is_watertight: bool | None = None
+    sort: ModelSortKey = "created_at"
+    order: Literal["asc", "desc"] = "asc"
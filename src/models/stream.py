@@ -0,0 +1,58 @@
+from __future__ import annotations
+
+import uuid
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import Boolean, Float, ForeignKey, Integer, Text, Uuid, func
+from sqlalchemy.orm import Mapped, mapped_column
+
+from . import Base
+
+
+class StreamDAO(Base):
+    __tablename__ = "streams"
+
+    id: Mapped[uuid.UUID] = mapped_column(Uuid, primary_key=True)
+    is_running: Mapped[bool] = mapped_column(Boolean, server_default="false")
+    stop_requested: Mapped[bool] = mapped_column(Boolean, server_default="false")
+    # Set by the process running the stream, which renews it until the stream ends
+    lease_id: Mapped[Optional[uuid.UUID]] = mapped_column(Uuid)
+    lease_expires_at: Mapped[Optional[datetime]] = mapped_column()
+    max_tokens: Mapped[Optional[int]] = mapped_column(Integer)
+    max_seconds: Mapped[Optional[float]] = mapped_column(Float)
+    created_at: Mapped[datetime] = mapped_column(server_default=func.now())
+
+    chat_id: Mapped[int] = mapped_column(
+        ForeignKey("chats.id", ondelete="CASCADE", onupdate="CASCADE")
+    )
+    message_id: Mapped[int] = mapped_column(
+        ForeignKey("messages.id", ondelete="CASCADE", onupdate="CASCADE")
+    )
+
+    def __repr__(self) -> str:
+        return (
+            f"<Stream(id={self.id}, chat_id={self.chat_id}, "
+            f"message_id={self.message_id}, is_running={self.is_running})>"
+        )
+
+
+class StreamEventBatchDAO(Base):
+    """Relayed SSE events of a stream, kept for subscribers joining late.
+
+    The table is UNLOGGED: batches are only useful while the stream is running,
+    so they are not worth the WAL traffic.
+    """
+
+    __tablename__ = "stream_event_batches"
+
+    stream_id: Mapped[uuid.UUID] = mapped_column(Uuid, primary_key=True)
+    seq: Mapped[int] = mapped_column(Integer, primary_key=True)
+    events: Mapped[str] = mapped_column(Text)  # JSON list of [event, data] pairs
+    is_last: Mapped[bool] = mapped_column(Boolean, server_default="false")
+    created_at: Mapped[datetime] = mapped_column(server_default=func.now())
+
+    __table_args__ = {"prefixes": ["UNLOGGED"]}
+
+    def __repr__(self) -> str:
+        return f"<StreamEventBatch(stream_id={self.stream_id}, seq={self.seq})>"
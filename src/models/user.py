@@ -19,6 +19,7 @@ class UserDAO(Base):
     name: Mapped[str] = mapped_column(Text, server_default="User")
     auth_id: Mapped[str] = mapped_column(Text, unique=True)
     email: Mapped[Optional[str]] = mapped_column(Text, unique=True)
+    tier: Mapped[str] = mapped_column(Text, server_default="free")
     created_at: Mapped[datetime] = mapped_column(server_default=func.now())
 
     chats: Mapped[list["ChatDAO"]] = relationship(
@@ -39,4 +40,5 @@ class UserDTO(BaseModel):
     name: str
     auth_id: str = Field(serialization_alias="sub")
     email: str
+    tier: str | None = None
     created_at: datetime | None = None
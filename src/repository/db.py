@@ -3,27 +3,70 @@ import re
 from pathlib import Path
 from typing import Annotated, TypeAlias, cast
 
+import asyncpg
 from dotenv import dotenv_values
 from fastapi import Depends, Request
 from sqlalchemy.ext.asyncio import (
-    AsyncSession, async_sessionmaker, create_async_engine
+    AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
 )
 from starlette.middleware.base import BaseHTTPMiddleware
 
+from .pool import InstrumentedQueuePool, PoolSettings, PoolStats
+
 
 debug_logger = logging.getLogger("debug")
 
 
-def setup_db_engine(user: str, password: str, host: str, port: str, database: str) -> None:
-    global AsyncSessionFactory
+def setup_db_engine(
+    user: str,
+    password: str,
+    host: str,
+    port: str,
+    database: str,
+    pool: PoolSettings = PoolSettings(),
+) -> PoolStats:
+    global AsyncSessionFactory, Engine
 
     engine = create_async_engine(
-        f"postgresql+asyncpg://{user}:{password}@{host}:{port}/{database}", echo=False
+        f"postgresql+asyncpg://{user}:{password}@{host}:{port}/{database}",
+        echo=False,
+        poolclass=InstrumentedQueuePool,
+        pool_size=pool.size,
+        max_overflow=pool.max_overflow,
+        pool_timeout=pool.timeout,
+        pool_recycle=pool.recycle,
+        pool_pre_ping=pool.pre_ping,
+        connect_args={"statement_cache_size": pool.statement_cache_size},
     )
 
+    pool_stats = PoolStats()
+    pool_stats.attach(cast(InstrumentedQueuePool, engine.sync_engine.pool))
+    InstrumentedQueuePool.stats = pool_stats
+
+    Engine = engine
     AsyncSessionFactory = async_sessionmaker(bind=engine, expire_on_commit=False)
+    return pool_stats
 
 AsyncSessionFactory: async_sessionmaker | None = None
+Engine: AsyncEngine | None = None
+
+
+async def connect_raw() -> asyncpg.Connection:
+    """Open a dedicated asyncpg connection outside of the engine pool.
+
+    Used for long-lived LISTEN subscriptions, which would otherwise pin a pooled
+    connection for the whole lifetime of the application.
+    """
+    assert Engine
+
+    url = Engine.url
+    return await asyncpg.connect(
+        user=url.username,
+        password=url.password,
+        host=url.host,
+        port=url.port,
+        database=url.database,
+    )
 
 
 class DBSessionMiddleware(BaseHTTPMiddleware):
@@ -0,0 +1,143 @@
+import asyncio
+import logging
+from collections.abc import Awaitable, Callable
+from typing import Any, TypeAlias
+
+import asyncpg
+
+from . import db
+
+logger = logging.getLogger("app")
+
+Notify: TypeAlias = Callable[[asyncpg.Connection, int, str, str], Any]
+
+
+class AsyncPostgresListener:
+    """Dedicated connection (see db.connect_raw) for LISTEN, reconnected when it's lost.
+
+    Once the connection is terminated, `on_disconnect` is called and a new one
+    is opened after `reconnect_delay` seconds, doubled after each failure up
+    to `max_reconnect_delay`. The channels are listened to again on it, then
+    `on_reconnect` is awaited: the notifications sent in between are lost,
+    it catches up with what they announced.
+
+    The connection may run queries as well, between awaits of `connection`.
+    """
+
+    RECONNECT_DELAY_DEFAULT = 1.0
+    MAX_RECONNECT_DELAY_DEFAULT = 30.0
+
+    def __init__(
+        self,
+        name: str,
+        on_disconnect: Callable[[], None] | None = None,
+        on_reconnect: Callable[[], Awaitable[None]] | None = None,
+        reconnect_delay: float = RECONNECT_DELAY_DEFAULT,
+        max_reconnect_delay: float = MAX_RECONNECT_DELAY_DEFAULT,
+    ) -> None:
+        self._name = name
+        self._on_disconnect = on_disconnect
+        self._on_reconnect = on_reconnect
+        self._reconnect_delay = reconnect_delay
+        self._max_reconnect_delay = max_reconnect_delay
+
+        self._connection: asyncpg.Connection | None = None
+        self._connected = asyncio.Event()
+        self._channels: dict[str, list[Notify]] = {}
+        self._reconnection: asyncio.Task | None = None
+
+    async def start(self) -> None:
+        await self._connect()
+
+    async def aclose(self) -> None:
+        if self._reconnection:
+            self._reconnection.cancel()
+            await asyncio.gather(self._reconnection, return_exceptions=True)
+            self._reconnection = None
+
+        connection, self._connection = self._connection, None
+        self._connected.clear()
+        self._channels.clear()
+
+        if connection and not connection.is_closed():
+            connection.remove_termination_listener(self._on_terminated)
+            await connection.close()
+
+    async def connection(self) -> asyncpg.Connection:
+        """The open connection, waiting for the reconnection if it was lost."""
+        await self._connected.wait()
+        assert self._connection
+        return self._connection
+
+    async def add_listener(self, channel: str, callback: Notify) -> None:
+        self._channels.setdefault(channel, []).append(callback)
+
+        if self._connected.is_set():
+            assert self._connection
+            await self._connection.add_listener(channel, callback)
+
+    async def remove_listener(self, channel: str, callback: Notify) -> None:
+        callbacks = self._channels.get(channel, [])
+        if callback in callbacks:
+            callbacks.remove(callback)
+        if not callbacks:
+            self._channels.pop(channel, None)
+
+        connection = self._connection
+        if connection and not connection.is_closed():
+            try:
+                await connection.remove_listener(channel, callback)
+            except (asyncpg.PostgresConnectionError, asyncpg.InterfaceError):
+                self.reconnect(connection)
+
+    def reconnect(self, connection: asyncpg.Connection) -> None:
+        """Replace `connection` if it's still the current one, after it failed."""
+        if connection is not self._connection or self._reconnection:
+            return
+
+        self._connected.clear()
+        connection.remove_termination_listener(self._on_terminated)
+        connection.terminate()
+        logger.error(f"{self._name} connection was lost, reconnecting")
+
+        if self._on_disconnect:
+            self._on_disconnect()
+        self._reconnection = asyncio.create_task(self._reconnect())
+
+    def _on_terminated(self, connection: asyncpg.Connection) -> None:
+        self.reconnect(connection)
+
+    async def _connect(self) -> None:
+        connection = await db.connect_raw()
+        try:
+            for channel, callbacks in self._channels.items():
+                for callback in callbacks:
+                    await connection.add_listener(channel, callback)
+        except BaseException:
+            connection.terminate()
+            raise
+
+        connection.add_termination_listener(self._on_terminated)
+        self._connection = connection
+        self._connected.set()
+
+    async def _reconnect(self) -> None:
+        delay = self._reconnect_delay
+
+        while True:
+            await asyncio.sleep(delay)
+            try:
+                await self._connect()
+                break
+            except Exception as e:
+                logger.error(f"Failed to reconnect {self._name} connection: {e}")
+                delay = min(delay * 2, self._max_reconnect_delay)
+
+        logger.info(f"{self._name} connection reconnected")
+        self._reconnection = None
+
+        if self._on_reconnect:
+            try:
+                await self._on_reconnect()
+            except Exception as e:
+                logger.error(f"Failed to catch up after reconnecting {self._name}: {e}")
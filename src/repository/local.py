@@ -0,0 +1,93 @@
+import contextlib
+import logging
+import os
+import tempfile
+from collections.abc import Iterable
+from typing import BinaryIO
+
+logger = logging.getLogger("app")
+
+
+class LocalObjectStore:
+    """Objects stored as files under a directory, by key.
+
+    An object is stored at <root>/<key[:2]>/<key[2:4]>/<key>: with keys that
+    start with a hex digest, the files are spread evenly over 65536
+    directories. Files are written to a temporary file renamed over the final
+    path once complete, a reader never sees a partial object, and synced with
+    their directory before `write` returns.
+
+    Blocking, call it from a thread.
+    """
+
+    def __init__(self, root: str) -> None:
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def get_path(self, object_key: str) -> str:
+        return os.path.join(self.root, object_key[:2], object_key[2:4], object_key)
+
+    def exists(self, object_key: str) -> bool:
+        return os.path.isfile(self.get_path(object_key))
+
+    def write(self, object_key: str, data: bytes) -> None:
+        path = self.get_path(object_key)
+        directory = os.path.dirname(path)
+        is_new_directory = not os.path.isdir(directory)
+        os.makedirs(directory, exist_ok=True)
+
+        # In the same directory, the rename is atomic
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as file:
+                file.write(data)
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(temp_path, path)
+        except BaseException:
+            with contextlib.suppress(OSError):
+                os.remove(temp_path)
+            raise
+
+        # The rename is durable once its directory is synced, a new directory once its parents are
+        self._fsync_directory(directory)
+        if is_new_directory:
+            self._fsync_directory(os.path.dirname(directory))
+            self._fsync_directory(self.root)
+
+    @staticmethod
+    def _fsync_directory(directory: str) -> None:
+        fd = os.open(directory, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def open(self, object_key: str) -> BinaryIO:
+        return open(self.get_path(object_key), "rb")
+
+    def read(self, object_key: str) -> bytes:
+        with self.open(object_key) as file:
+            return file.read()
+
+    def list_keys(self, prefix: str) -> list[str]:
+        """Keys starting with `prefix`, which must include the 4 characters of the directories."""
+        directory = os.path.dirname(self.get_path(prefix))
+        try:
+            names = os.listdir(directory)
+        except FileNotFoundError:
+            return []
+
+        # Temporary files start with a dot, keys don't
+        return sorted(name for name in names if name.startswith(prefix))
+
+    def remove(self, object_keys: Iterable[str]) -> None:
+        """Remove objects in order, stops at the first that can't be removed."""
+        for object_key in object_keys:
+            try:
+                os.remove(self.get_path(object_key))
+            except FileNotFoundError:
+                continue
+            except OSError as e:
+                logger.error(f"Failed to delete {object_key} from {self.root}: {e}")
+                return
@@ -1,17 +1,45 @@
+import contextlib
 import logging
-import uuid
+import posixpath
+import re
+from collections import Counter
 from abc import ABC, abstractmethod
-from typing import Annotated, cast
+from collections.abc import Awaitable, Callable, Iterator, Sequence
+from typing import Annotated, Any, ClassVar, NamedTuple, cast
 
-import boto3
+import asyncio
+
+import numpy as np
+from botocore.client import BaseClient
 from botocore.exceptions import ClientError
 from dotenv import load_dotenv
-from fastapi import Depends
-from sqlalchemy import select, update
+from fastapi import Depends, Request
+from sqlalchemy import Select, delete, func, or_, select, update
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from . import db
 from .db import get_db_session
-from ..models.model import ModelDAO, ModelDTO
+from .local import LocalObjectStore
+from ..mesh.arrays import to_obj
+from ..mesh.codec import decode_mesh
+from ..mesh.processing import ProcessedMesh
+from ..mesh.stats import MeshStats
+from ..mesh.streaming import ObjSource, iter_obj_chunks
+from ..models.chat import ChatDAO
+from ..models.message import MessageDAO
+from ..models.model import (
+    ModelDAO,
+    ModelDTO,
+    ModelFilter,
+    ModelFormat,
+    SimilarModelDTO,
+    StorageBackend,
+    StoredObjectDAO,
+)
+from .s3 import AsyncS3Executor, S3UrlSigner
+from .shape_index import SharedShapeIndex
+from .upload_queue import AsyncUploadQueue
 
 logger = logging.getLogger("app")
 debug_logger = logging.getLogger("debug")
@@ -20,19 +48,127 @@ debug_logger = logging.getLogger("debug")
 load_dotenv()
 
 
+class ContentSource(NamedTuple):
+    name: str
+    open: ObjSource  # Blocking, to be iterated in a thread
+    vertex_count: int | None  # Known for the original from its statistics
+    face_count: int | None
+
+
+class NewObjects(NamedTuple):
+    """Objects of a mesh stored for the first time, see AsyncObjectModelRepository."""
+
+    object_key: str  # Of the original
+    variants: Sequence[str | bytes]  # The original, then its levels of detail
+    glbs: Sequence[bytes]
+    thumbnail: bytes | None
+
+
 class AsyncModelRepository(ABC):
+    _shape_index: ClassVar[SharedShapeIndex | None] = None
+    _s3_executor: ClassVar[AsyncS3Executor] = AsyncS3Executor()
+    _storage_backend: ClassVar[StorageBackend] = "s3"
+
+    @abstractmethod
+    async def save_many(
+        self, message_id: int, meshes: Sequence[ProcessedMesh]
+    ) -> list[ModelDTO]: ...
+    # Ahead of save_many, while the answer is generated
+    @abstractmethod
+    async def prepare_save(self, mesh: ProcessedMesh) -> None: ...
+    # None when the model can't be downloaded directly, see get_content
     @abstractmethod
-    async def save(self, message_id: int, content: str) -> ModelDTO: ...
+    async def get_url(
+        self, model_id: int, lod: int = 0, model_format: ModelFormat = "obj"
+    ) -> str | None: ...
     @abstractmethod
-    async def get_url(self, model_id: int) -> str: ...
+    async def get_batch_urls(
+        self, model_ids: list[int], lod: int = 0, model_format: ModelFormat = "obj"
+    ) -> dict[int, str | None]: ...
     @abstractmethod
-    async def get_batch_urls(self, model_ids: list[int]) -> dict[int, str]: ...
+    async def get_content(self, model_id: int, lod: int = 0) -> str: ...
+    @abstractmethod
+    async def get_content_source(self, model_id: int, lod: int = 0) -> ContentSource: ...
+    # None for models saved without a thumbnail
+    @abstractmethod
+    async def get_thumbnail_url(self, model_id: int) -> str | None: ...
+    @abstractmethod
+    async def get_batch_thumbnail_urls(
+        self, model_ids: list[int]
+    ) -> dict[int, str | None]: ...
     @abstractmethod
     async def aclose(self) -> None: ...
 
     def __init__(self, db_session: Annotated[AsyncSession, Depends(get_db_session)]):
         self._db_session = db_session
 
+    @staticmethod
+    def set_shape_index(shape_index: SharedShapeIndex) -> None:
+        AsyncModelRepository._shape_index = shape_index
+
+    @staticmethod
+    def set_s3_executor(s3_executor: AsyncS3Executor) -> None:
+        AsyncModelRepository._s3_executor = s3_executor
+
+    @staticmethod
+    def set_storage_backend(storage_backend: str) -> None:
+        if storage_backend not in ("s3", "local"):
+            raise ValueError(f"Unknown storage backend: {storage_backend}")
+        AsyncModelRepository._storage_backend = cast(StorageBackend, storage_backend)
+
+    async def get_similar(
+        self, model_id: int, user_id: int, limit: int
+    ) -> list[SimilarModelDTO]:
+        """The user's saved models nearest in shape to one of theirs, nearest first.
+
+        The model is one they saved or one generated in their chats.
+        """
+        shape_index = AsyncModelRepository._shape_index
+        if shape_index is None:
+            raise ValueError("Shape similarity search is not enabled")
+
+        query = (
+            select(ModelDAO.descriptor)
+            .outerjoin(MessageDAO, ModelDAO.message_id == MessageDAO.id)
+            .outerjoin(ChatDAO, MessageDAO.chat_id == ChatDAO.id)
+            .where(
+                ModelDAO.id == model_id,
+                or_(ModelDAO.user_id == user_id, ChatDAO.user_id == user_id),
+            )
+        )
+        result = await self._db_session.execute(query)
+        row = result.one_or_none()
+        if row is None:
+            raise ValueError(f"Model with id {model_id} not found")
+
+        [descriptor] = row
+        if descriptor is None or len(descriptor) != SharedShapeIndex.DESCRIPTOR_BYTES:
+            raise ValueError(f"Model with id {model_id} has no shape descriptor")
+
+        candidates = shape_index.index.search(
+            np.frombuffer(descriptor, dtype=np.float32), limit + 1, owner=user_id
+        )
+        distances = {
+            candidate_id: distance
+            for candidate_id, distance in candidates
+            if candidate_id != model_id
+        }
+
+        # The index may be behind the table for an instant
+        query = select(ModelDAO).filter(
+            ModelDAO.id.in_(distances), ModelDAO.user_id == user_id
+        )
+        result = await self._db_session.execute(query)
+
+        models = []
+        for model_dao in result.scalars().all():
+            model = SimilarModelDTO.model_validate(model_dao)
+            model.distance = distances[model_dao.id]
+            models.append(model)
+
+        models.sort(key=lambda model: model.distance)
+        return models[:limit]
+
     async def set_user_id(self, user_id: int | None, model_id: int) -> None:
         query = (
             update(ModelDAO)
@@ -40,20 +176,48 @@ class AsyncModelRepository(ABC):
             .values(user_id=user_id)
         )
         result = await self._db_session.execute(query)
+        # The shape index keeps the owner of every model
+        await SharedShapeIndex.notify(self._db_session, added=[model_id])
 
         await self._db_session.commit()
 
         if not result.rowcount:
             raise ValueError(f"Model with id {model_id} not found")
 
-    async def get_having_user_id(self, user_id: int) -> list[ModelDTO]:
+    async def get_having_user_id(
+        self, user_id: int, model_filter: ModelFilter | None = None
+    ) -> list[ModelDTO]:
         query = select(ModelDAO).filter(ModelDAO.user_id == user_id)
+        if model_filter:
+            query = self._apply_filter(query, model_filter)
+
         result = await self._db_session.execute(query)
         model_daos = result.scalars().all()
         
         models = [ModelDTO.model_validate(model_dao) for model_dao in model_daos]
         return models
     
+    @staticmethod
+    def _apply_filter(query: Select, model_filter: ModelFilter) -> Select:
+        # Models without statistics never match a bound and are sorted last
+        bounds = [
+            (ModelDAO.vertex_count, model_filter.min_vertices, model_filter.max_vertices),
+            (ModelDAO.face_count, model_filter.min_faces, model_filter.max_faces),
+            (ModelDAO.byte_size, model_filter.min_bytes, model_filter.max_bytes),
+        ]
+        for column, minimum, maximum in bounds:
+            if minimum is not None:
+                query = query.filter(column >= minimum)
+            if maximum is not None:
+                query = query.filter(column <= maximum)
+
+        if model_filter.is_watertight is not None:
+            query = query.filter(ModelDAO.is_watertight == model_filter.is_watertight)
+
+        column = getattr(ModelDAO, model_filter.sort)
+        order = column.asc() if model_filter.order == "asc" else column.desc()
+        return query.order_by(order.nulls_last(), ModelDAO.id)
+
     async def update_model_name(self, model_id: int, name: str) -> ModelDTO:
         query = (
             update(ModelDAO)
@@ -72,47 +236,666 @@ class AsyncModelRepository(ABC):
         return ModelDTO.model_validate(updated_model)
 
 
-class AsyncS3ModelRepository(AsyncModelRepository):
-    def __init__(
-        self, db_session: Annotated[AsyncSession, Depends(get_db_session)]
-    ) -> None:
-        super().__init__(db_session)
+class AsyncObjectModelRepository(AsyncModelRepository):
+    """Models stored as objects keyed by the digest of the mesh, variants next to the original.
+
+    The storage backends implement the object primitives: where an object is
+    (storage_path, its container and key), uploads, reads and URLs.
+    """
 
-        self._s3 = boto3.client("s3")
-        self._bucket_name_prefix = "obj-storage"
-        self._bucket_name = self._get_or_create_bucket(self._bucket_name_prefix)
+    CONTENT_TYPES: dict[str, str] = {
+        ".obj": "model/obj",
+        ".glb": "model/gltf-binary",
+        ".objz": "application/x-obj-zstd",  # src.mesh.codec
+        ".png": "image/png",
+    }
+    ENCODED_EXTENSION = ".objz"
+    THUMBNAIL_EXTENSION = ".thumb.png"
+    # Keys of the objects saved by save_many, see get_object_file
+    OBJECT_KEY_PATTERN = re.compile(
+        r"[0-9a-f]{64}(\.lod[0-9]+)?(\.obj|\.objz|\.glb|\.thumb\.png)", re.ASCII
+    )
+    # Keys are never reused, an object doesn't change once uploaded
+    CACHE_CONTROL = "public, max-age=31536000, immutable"
+    DOWNLOAD_CHUNK_BYTES = 1 << 16
+
+    @abstractmethod
+    def _get_storage_path(self, object_key: str) -> str: ...
+    # Container (bucket, directory) and key of the object at a storage path
+    @abstractmethod
+    def _parse_storage_path(self, storage_path: str) -> tuple[str, str]: ...
+    @abstractmethod
+    async def _run_blocking[T](self, func: Callable[..., T], /, *args: Any) -> T: ...
+    @abstractmethod
+    async def _object_exists(self, object_key: str) -> bool: ...
+    @abstractmethod
+    async def _put_object(self, content: str | bytes, object_key: str) -> None: ...
+    # Blocking, see _run_blocking
+    @abstractmethod
+    def _read_object(self, container: str, object_key: str) -> bytes: ...
+    @abstractmethod
+    def _iter_object(self, container: str, object_key: str) -> Iterator[bytes]: ...
+    @abstractmethod
+    async def _get_urls(
+        self, locations: dict[int, tuple[str, str] | None]
+    ) -> dict[int, str | None]: ...
 
     async def aclose(self) -> None:
         await self._db_session.close()
-        self._s3.close()
 
-    def _get_or_create_bucket(self, prefix: str) -> str:
-        buckets = self._s3.list_buckets()["Buckets"]
+    @staticmethod
+    def _get_variant_key(object_key: str, lod: int = 0, extension: str = ".obj") -> str:
+        """Key of a variant stored next to the original: <name>[.lod<n>]<extension>"""
+        stem, _ = posixpath.splitext(object_key)
+        lod_suffix = f".lod{lod}" if lod else ""
+        return f"{stem}{lod_suffix}{extension}"
 
-        for bucket in buckets:
-            if bucket["Name"].startswith(prefix):
-                return cast(str, bucket["Name"])
+    async def save_many(
+        self, message_id: int, meshes: Sequence[ProcessedMesh]
+    ) -> list[ModelDTO]:
+        """Save the models of a message in one transaction, uploading them concurrently.
 
-        bucket_name = f"{prefix}-{uuid.uuid4()}"
-        bucket_name = bucket_name.lower()
+        Objects are keyed by the digest of the mesh and uploaded only if no
+        identical model was saved: the stored_objects rows count the models
+        using them and their locks serialize saves of the same objects until
+        the transaction ends. The models are inserted in one statement and
+        returned in the order of `meshes`.
+        """
+        if not meshes:
+            return []
 
         try:
-            self._s3.create_bucket(Bucket=bucket_name)
-            return bucket_name
-        except ClientError as e:
-            logger.error(f"Failed to create bucket {bucket_name}: {e}")
+            objects = [self._get_stored_objects(mesh) for mesh in meshes]
+            storage_paths = [self._get_storage_path(key) for key, _ in objects]
+            new_references = Counter(storage_paths)
+            ref_counts = await self._add_references(new_references)
+
+            new_objects = []
+            for mesh, (object_key, variants), storage_path in zip(
+                meshes, objects, storage_paths
+            ):
+                ref_count = ref_counts.pop(storage_path, None)
+                if ref_count is None:
+                    continue  # Identical to a mesh before it in the message
+
+                # The first references can still find the objects of a save that failed later
+                if ref_count == new_references[storage_path]:
+                    new_objects.append(
+                        NewObjects(object_key, variants, mesh["glbs"], mesh["thumbnail"])
+                    )
+                else:
+                    debug_logger.debug(f"Model {object_key} already stored, {ref_count=}")
+
+            await self._store_objects(new_objects)
+
+            rows = [
+                {
+                    "storage_path": storage_path,
+                    "message_id": message_id,
+                    "lod_count": len(mesh["lods"]),
+                    "has_glb": bool(mesh["glbs"]),
+                    "has_thumbnail": bool(mesh["thumbnail"]),
+                    "byte_size": len(variants[0]),
+                    **self._get_stats_values(mesh["stats"]),
+                    "descriptor": (
+                        mesh["descriptor"].tobytes()
+                        if mesh["descriptor"] is not None
+                        else None
+                    ),
+                }
+                for mesh, (_, variants), storage_path in zip(meshes, objects, storage_paths)
+            ]
+            result = await self._db_session.scalars(
+                insert(ModelDAO).returning(ModelDAO, sort_by_parameter_order=True), rows
+            )
+            new_models = result.all()
+            await SharedShapeIndex.notify(
+                self._db_session,
+                added=[
+                    new_model.id
+                    for new_model, mesh in zip(new_models, meshes)
+                    if mesh["descriptor"] is not None
+                ],
+            )
+            await self._db_session.commit()
+        except BaseException as e:
+            logger.error(f"Failed to save the models to the database: {e}")
+            await self._db_session.rollback()
             raise
 
+        return [ModelDTO.model_validate(new_model) for new_model in new_models]
+
+    def _get_stored_objects(self, mesh: ProcessedMesh) -> tuple[str, Sequence[str | bytes]]:
+        """Key of the original and content of the original then of its levels of detail."""
+        if mesh["encoded"]:
+            # Compressed storage mode, the OBJ is decoded on read
+            return f"{mesh['digest']}{self.ENCODED_EXTENSION}", mesh["encoded"]
+
+        return f"{mesh['digest']}.obj", [mesh["content"].encode(), *mesh["lods"]]
+
+    async def prepare_save(self, mesh: ProcessedMesh) -> None:
+        """Store the objects of a mesh ahead of its save, while the answer is generated.
+
+        save_many then finds them and only adds the reference. The objects of
+        a mesh that isn't saved in the end stay stored, like those of a save
+        that failed, for the next identical save.
+        """
+        object_key, variants = self._get_stored_objects(mesh)
+        await self._upload_objects(
+            NewObjects(object_key, variants, mesh["glbs"], mesh["thumbnail"])
+        )
+
+    async def _store_objects(self, new_objects: list[NewObjects]) -> None:
+        # Concurrently, as many objects at once as the backend has I/O threads
+        await asyncio.gather(*(self._upload_objects(objects) for objects in new_objects))
+
+    async def _upload_objects(self, objects: NewObjects) -> None:
+        if await self._object_exists(objects.object_key):
+            debug_logger.debug(f"Model {objects.object_key} already stored")
+            return
+
+        await asyncio.gather(
+            *(self._put_object(data, key) for data, key in self._get_variants(objects))
+        )
+        # Last, its existence means that every variant was uploaded
+        await self._put_object(objects.variants[0], objects.object_key)
+
+    def _get_variants(self, objects: NewObjects) -> list[tuple[str | bytes, str]]:
+        """Content and key of every object but the original."""
+        object_key = objects.object_key
+        extension = self._extension(object_key)
+        variants: list[tuple[str | bytes, str]] = [
+            (variant, self._get_variant_key(object_key, lod, extension))
+            for lod, variant in enumerate(objects.variants[1:], start=1)
+        ]
+        # GLBs of the original and of every level of detail
+        variants += [
+            (glb, self._get_variant_key(object_key, lod, ".glb"))
+            for lod, glb in enumerate(objects.glbs)
+        ]
+        if objects.thumbnail:
+            variants.append(
+                (
+                    objects.thumbnail,
+                    self._get_variant_key(object_key, extension=self.THUMBNAIL_EXTENSION),
+                )
+            )
+        return variants
+
+    @staticmethod
+    def _get_stats_values(stats: MeshStats | None) -> dict[str, int | float | bool | None]:
+        columns = [
+            "vertex_count",
+            "face_count",
+            "surface_area",
+            "is_watertight",
+            "bbox_min_x",
+            "bbox_min_y",
+            "bbox_min_z",
+            "bbox_max_x",
+            "bbox_max_y",
+            "bbox_max_z",
+        ]
+        if not stats:
+            # Every row has the same columns, they're inserted in a single batch
+            return dict.fromkeys(columns)
+
+        values = [
+            stats["vertex_count"],
+            stats["face_count"],
+            stats["surface_area"],
+            stats["is_watertight"],
+            *stats["bounding_box"],
+        ]
+        return dict(zip(columns, values))
+
+    async def _add_references(self, references: Counter[str]) -> dict[str, int]:
+        """Count new references to stored objects, returns their reference counts."""
+        # In a fixed order, two transactions lock the rows they share in the same order
+        values = [
+            {"storage_path": storage_path, "ref_count": count}
+            for storage_path, count in sorted(references.items())
+        ]
+        statement = insert(StoredObjectDAO).values(values)
+        query = statement.on_conflict_do_update(
+            index_elements=[StoredObjectDAO.storage_path],
+            set_={"ref_count": StoredObjectDAO.ref_count + statement.excluded.ref_count},
+        ).returning(StoredObjectDAO.storage_path, StoredObjectDAO.ref_count)
+        result = await self._db_session.execute(query)
+        return {storage_path: ref_count for storage_path, ref_count in result.all()}
+
+    @staticmethod
+    def _extension(object_key: str) -> str:
+        return posixpath.splitext(object_key)[1]
+
+    @staticmethod
+    def _get_model_key(
+        model: ModelDAO, object_key: str, lod: int, model_format: ModelFormat
+    ) -> str:
+        # Small models have fewer levels, the coarsest one stored is used instead.
+        # Models that couldn't be converted are only available as OBJ.
+        if model_format == "glb" and model.has_glb:
+            extension = ".glb"
+        else:
+            extension = AsyncObjectModelRepository._extension(object_key)
+
+        return AsyncObjectModelRepository._get_variant_key(
+            object_key, min(lod, model.lod_count), extension
+        )
+
+    def _get_model_location(
+        self, model: ModelDAO, lod: int, model_format: ModelFormat
+    ) -> tuple[str, str] | None:
+        """Container and key of the object a URL points to, None if it can't have one."""
+        assert model.storage_path
+
+        container, object_key = self._parse_storage_path(model.storage_path)
+        object_key = self._get_model_key(model, object_key, lod, model_format)
+
+        if self._extension(object_key) == self.ENCODED_EXTENSION:
+            return None
+
+        return container, object_key
+
+    def _get_thumbnail_location(self, model: ModelDAO) -> tuple[str, str] | None:
+        if not model.has_thumbnail:
+            return None
+
+        assert model.storage_path
+
+        container, object_key = self._parse_storage_path(model.storage_path)
+        object_key = self._get_variant_key(
+            object_key, extension=self.THUMBNAIL_EXTENSION
+        )
+
+        return container, object_key
+
+    async def _get_model(self, model_id: int) -> ModelDAO:
+        query = select(ModelDAO).filter(ModelDAO.id == model_id)
+        result = await self._db_session.execute(query)
+        model = result.scalar_one_or_none()
+
+        if not model:
+            raise ValueError(f"Model with id {model_id} not found")
+
+        return model
+
+    async def get_url(
+        self, model_id: int, lod: int = 0, model_format: ModelFormat = "obj"
+    ) -> str | None:
+        model = await self._get_model(model_id)
+        location = self._get_model_location(model, lod, model_format)
+        urls = await self._get_urls({model_id: location})
+        return urls[model_id]
+
+    async def get_content(self, model_id: int, lod: int = 0) -> str:
+        model = await self._get_model(model_id)
+        assert model.storage_path
+
+        container, object_key = self._parse_storage_path(model.storage_path)
+        object_key = self._get_model_key(model, object_key, lod, "obj")
+
+        # Decoded in the same thread, a large model takes a while
+        return await self._run_blocking(self._read_content, container, object_key)
+
+    def _read_content(self, container: str, object_key: str) -> str:
+        data = self._read_object(container, object_key)
+
+        if self._extension(object_key) == self.ENCODED_EXTENSION:
+            return to_obj(decode_mesh(data))
+
+        return data.decode()
+
+    async def get_content_source(self, model_id: int, lod: int = 0) -> ContentSource:
+        """The OBJ of a model as a stream of chunks, without reading it whole.
+
+        A compressed model is decoded in memory first, its encoding has to be
+        read whole.
+        """
+        model = await self._get_model(model_id)
+        assert model.storage_path
+
+        container, object_key = self._parse_storage_path(model.storage_path)
+        object_key = self._get_model_key(model, object_key, lod, "obj")
+
+        def open_object() -> Iterator[bytes]:
+            if self._extension(object_key) == self.ENCODED_EXTENSION:
+                yield from iter_obj_chunks(
+                    decode_mesh(self._read_object(container, object_key))
+                )
+            else:
+                yield from self._iter_object(container, object_key)
+
+        is_original = not min(lod, model.lod_count)
+        return ContentSource(
+            name=model.name,
+            open=open_object,
+            vertex_count=model.vertex_count if is_original else None,
+            face_count=model.face_count if is_original else None,
+        )
+
+    async def _get_models(self, model_ids: list[int]) -> Sequence[ModelDAO]:
+        query = select(ModelDAO).filter(ModelDAO.id.in_(model_ids))
+        result = await self._db_session.execute(query)
+        models = result.scalars().all()
+
+        found_ids = {model.id for model in models}
+        missing_ids = set(model_ids) - found_ids
+        if missing_ids:
+            raise ValueError(f"Models with ids {missing_ids} not found")
+
+        return models
+
+    async def get_batch_urls(
+        self, model_ids: list[int], lod: int = 0, model_format: ModelFormat = "obj"
+    ) -> dict[int, str | None]:
+        models = await self._get_models(model_ids)
+
+        locations = {
+            model.id: self._get_model_location(model, lod, model_format)
+            for model in models
+        }
+        return await self._get_urls(locations)
+
+    async def get_thumbnail_url(self, model_id: int) -> str | None:
+        model = await self._get_model(model_id)
+        urls = await self._get_urls(
+            {model_id: self._get_thumbnail_location(model)}
+        )
+        return urls[model_id]
+
+    async def get_batch_thumbnail_urls(
+        self, model_ids: list[int]
+    ) -> dict[int, str | None]:
+        models = await self._get_models(model_ids)
+        locations = {model.id: self._get_thumbnail_location(model) for model in models}
+        return await self._get_urls(locations)
+
+
+class AsyncS3ModelRepository(AsyncObjectModelRepository):
+    BUCKET_NAME_PREFIX = "obj-storage"
+    MIN_PART_BYTES = 5 << 20  # S3's minimum size of a part, but the last one
+
+    # Shared by every request, the connections are reused
+    _shared_s3: ClassVar[BaseClient | None] = None
+    _shared_bucket_name: ClassVar[str | None] = None
+    _url_signer: ClassVar[S3UrlSigner | None] = None
+    # Write-behind, see set_write_behind
+    _spool: ClassVar[LocalObjectStore | None] = None
+    _upload_queue: ClassVar[AsyncUploadQueue | None] = None
+    # Larger objects are uploaded in parts, see set_part_size
+    _part_bytes: ClassVar[int] = MIN_PART_BYTES
+
+    def __init__(
+        self,
+        db_session: Annotated[AsyncSession, Depends(get_db_session)],
+        request: Request | None = None,  # For the URLs of spooled objects
+    ) -> None:
+        super().__init__(db_session)
+
+        s3, bucket_name = self._shared_s3, self._shared_bucket_name
+        assert s3 and bucket_name, "set_s3 is called in the lifespan"
+        self._s3 = s3
+        self._bucket_name = bucket_name
+        self._request = request
+        self._spooled_paths: list[str] = []
+
+    @staticmethod
+    def set_s3(s3: BaseClient, bucket_name: str, url_signer: S3UrlSigner) -> None:
+        AsyncS3ModelRepository._shared_s3 = s3
+        AsyncS3ModelRepository._shared_bucket_name = bucket_name
+        AsyncS3ModelRepository._url_signer = url_signer
+
+    @staticmethod
+    def set_part_size(part_bytes: int) -> None:
+        """Objects larger than `part_bytes` are sent as a multipart upload, parts concurrently."""
+        if part_bytes < AsyncS3ModelRepository.MIN_PART_BYTES:
+            raise ValueError(
+                f"Parts are at least {AsyncS3ModelRepository.MIN_PART_BYTES} bytes: {part_bytes}"
+            )
+        AsyncS3ModelRepository._part_bytes = part_bytes
+
+    @staticmethod
+    def set_write_behind(spool: LocalObjectStore, upload_queue: AsyncUploadQueue) -> None:
+        """Save new objects to a local spool, the upload queue moves them to the bucket.
+
+        A save writes the objects to the spool and marks their stored_objects
+        row pending, in its transaction. After the commit, the queue uploads
+        them with upload_spooled, which clears the mark and removes them from
+        the spool. Meanwhile, their URLs point to the API, which serves them
+        from the spool (see get_object_file) of the node that saved them.
+        Those the queue gives up on are marked with fail_upload and stay in
+        the spool until upload_failed_at is cleared and the API restarted.
+        """
+        AsyncS3ModelRepository._spool = spool
+        AsyncS3ModelRepository._upload_queue = upload_queue
+
     @staticmethod
-    def _get_s3_url(bucket_name: str, object_key: str) -> str:
-        return f"s3://{bucket_name}/{object_key}"
+    async def get_spooled_paths() -> list[str]:
+        """Storage paths of the pending objects in the spool of this node, oldest first."""
+        assert db.AsyncSessionFactory
+        async with db.AsyncSessionFactory() as session:
+            return await AsyncS3ModelRepository(session)._get_spooled_paths()
 
     @staticmethod
-    def _get_bucket_and_object_keys(s3_path: str) -> tuple[str, str]:
-        if not s3_path.startswith("s3://"):
-            raise ValueError(f"Invalid S3 URI: {s3_path}")
+    async def upload_spooled(storage_path: str) -> None:
+        """Upload the spooled objects of a stored object, see set_write_behind."""
+        assert db.AsyncSessionFactory
+        async with db.AsyncSessionFactory() as session:
+            await AsyncS3ModelRepository(session)._upload_spooled(storage_path)
+
+    @staticmethod
+    async def fail_upload(storage_path: str) -> None:
+        """Stop retrying the upload of a stored object, see set_write_behind."""
+        assert db.AsyncSessionFactory
+        async with db.AsyncSessionFactory() as session:
+            await AsyncS3ModelRepository(session)._fail_upload(storage_path)
+
+    @staticmethod
+    async def get_uploaded_url(object_key: str) -> str | None:
+        """URL in the bucket of an object that may have left the spool since its URL was given."""
+        spool, url_signer = AsyncS3ModelRepository._spool, AsyncS3ModelRepository._url_signer
+        bucket_name = AsyncS3ModelRepository._shared_bucket_name
+
+        if (
+            spool is None
+            or url_signer is None
+            or bucket_name is None
+            or not AsyncS3ModelRepository.OBJECT_KEY_PATTERN.fullmatch(object_key)
+        ):
+            return None
+
+        urls = await AsyncModelRepository._s3_executor.run(
+            url_signer.sign, {object_key: (bucket_name, object_key)}
+        )
+        return urls[object_key]
+
+    async def save_many(
+        self, message_id: int, meshes: Sequence[ProcessedMesh]
+    ) -> list[ModelDTO]:
+        self._spooled_paths = []
+        models = await super().save_many(message_id, meshes)
+
+        # Committed, the uploads can see the rows
+        if self._upload_queue is not None:
+            for storage_path in self._spooled_paths:
+                self._upload_queue.put(storage_path)
+
+        return models
+
+    async def prepare_save(self, mesh: ProcessedMesh) -> None:
+        if self._spool is None:
+            await super().prepare_save(mesh)
+        # With write-behind, a save doesn't wait for the bucket
+
+    async def _store_objects(self, new_objects: list[NewObjects]) -> None:
+        spool = self._spool
+        if spool is None or not new_objects:
+            await super()._store_objects(new_objects)
+            return
+
+        def write(content: str | bytes, object_key: str) -> Awaitable[None]:
+            data = content.encode() if isinstance(content, str) else content
+            return asyncio.to_thread(spool.write, object_key, data)
+
+        # Durable before the commit. Originals last, as in the bucket.
+        await asyncio.gather(
+            *(
+                write(data, key)
+                for objects in new_objects
+                for data, key in self._get_variants(objects)
+            )
+        )
+        await asyncio.gather(
+            *(write(objects.variants[0], objects.object_key) for objects in new_objects)
+        )
+
+        storage_paths = [
+            self._get_storage_path(objects.object_key) for objects in new_objects
+        ]
+        await self._db_session.execute(
+            update(StoredObjectDAO)
+            .where(StoredObjectDAO.storage_path.in_(storage_paths))
+            .values(is_pending=True)
+        )
+        self._spooled_paths += storage_paths
+
+    async def _get_spooled_paths(self) -> list[str]:
+        assert self._spool
+        query = (
+            select(StoredObjectDAO.storage_path)
+            .where(StoredObjectDAO.is_pending, StoredObjectDAO.upload_failed_at.is_(None))
+            .order_by(StoredObjectDAO.created_at)
+        )
+        storage_paths = (await self._db_session.scalars(query)).all()
+
+        # The other nodes upload theirs
+        is_spooled = await asyncio.to_thread(
+            lambda: [
+                self._spool.exists(self._parse_storage_path(storage_path)[1])
+                for storage_path in storage_paths
+            ]
+        )
+        return [
+            storage_path
+            for storage_path, spooled in zip(storage_paths, is_spooled)
+            if spooled
+        ]
 
-        path = s3_path[5:]
+    async def _upload_spooled(self, storage_path: str) -> None:
+        spool = self._spool
+        assert spool
+
+        # Committed before uploading: neither a lock nor a connection is held meanwhile
+        query = (
+            update(StoredObjectDAO)
+            .where(
+                StoredObjectDAO.storage_path == storage_path,
+                StoredObjectDAO.is_pending,
+                StoredObjectDAO.upload_failed_at.is_(None),
+            )
+            .values(upload_started_at=func.clock_timestamp())
+            .returning(StoredObjectDAO.upload_started_at)
+        )
+        upload_started_at = await self._db_session.scalar(query)
+        await self._db_session.commit()
+        if upload_started_at is None:
+            return  # Uploaded already, deleted with its models, or given up on
+
+        _, object_key = self._parse_storage_path(storage_path)
+        stem, _ = posixpath.splitext(object_key)
+        object_keys = await asyncio.to_thread(spool.list_keys, f"{stem}.")
+        if object_key not in object_keys:
+            # Lost with the spool, no attempt can succeed
+            logger.error(f"{object_key} is not in the spool {spool.root}, not uploaded")
+            await self._fail_upload(storage_path)
+            return
+
+        async def upload(key: str) -> None:
+            await self._put_object(await asyncio.to_thread(spool.read, key), key)
+
+        variant_keys = [key for key in object_keys if key != object_key]
+        claim = (
+            StoredObjectDAO.storage_path == storage_path,
+            StoredObjectDAO.upload_started_at == upload_started_at,
+        )
+        try:
+            # Every upload ends before any orphan is deleted
+            results = await asyncio.gather(
+                *(upload(key) for key in variant_keys), return_exceptions=True
+            )
+            for result in results:
+                if isinstance(result, BaseException):
+                    raise result
+            await upload(object_key)
+        except Exception:
+            # A deletion of the row removes the spool files as they're read
+            is_claimed = await self._db_session.scalar(
+                select(StoredObjectDAO.storage_path).where(*claim)
+            )
+            await self._db_session.commit()
+            if is_claimed is None:
+                await self._delete_orphans(storage_path, [object_key, *variant_keys])
+                return
+            raise
+
+        # Unless the row was deleted, and maybe saved again, during the upload
+        query = (
+            update(StoredObjectDAO)
+            .where(*claim)
+            .values(is_pending=False, upload_started_at=None)
+            .returning(StoredObjectDAO.storage_path)
+        )
+        is_uploaded = await self._db_session.scalar(query) is not None
+        await self._db_session.commit()
+
+        if not is_uploaded:
+            await self._delete_orphans(storage_path, [object_key, *variant_keys])
+            return
+
+        # Read from the bucket from now on, see get_uploaded_url
+        await asyncio.to_thread(spool.remove, [object_key, *variant_keys])
+
+    async def _delete_orphans(self, storage_path: str, object_keys: list[str]) -> None:
+        """Delete objects uploaded after the deletion of their row, unless saved again since."""
+        # Held until the commit, a save of the same objects waits for the deletion
+        query = (
+            insert(StoredObjectDAO)
+            .values(storage_path=storage_path, ref_count=0)
+            .on_conflict_do_nothing(index_elements=[StoredObjectDAO.storage_path])
+            .returning(StoredObjectDAO.storage_path)
+        )
+        try:
+            if await self._db_session.scalar(query) is not None:
+                bucket_name, _ = self._parse_storage_path(storage_path)
+                await self._delete_objects(bucket_name, object_keys)
+                await self._db_session.execute(
+                    delete(StoredObjectDAO).where(
+                        StoredObjectDAO.storage_path == storage_path
+                    )
+                )
+            await self._db_session.commit()
+        except BaseException:
+            await self._db_session.rollback()
+            raise
+
+    async def _fail_upload(self, storage_path: str) -> None:
+        await self._db_session.execute(
+            update(StoredObjectDAO)
+            .where(StoredObjectDAO.storage_path == storage_path, StoredObjectDAO.is_pending)
+            .values(upload_failed_at=func.now(), upload_started_at=None)
+        )
+        await self._db_session.commit()
+        logger.error(f"Gave up uploading {storage_path}, it stays in the spool")
+
+    def _get_storage_path(self, object_key: str) -> str:
+        return f"s3://{self._bucket_name}/{object_key}"
+
+    def _parse_storage_path(self, storage_path: str) -> tuple[str, str]:
+        if not storage_path.startswith("s3://"):
+            raise ValueError(f"Invalid S3 URI: {storage_path}")
+
+        path = storage_path[5:]
 
         parts = path.split("/", 1)
         bucket = parts[0]
@@ -121,83 +904,282 @@ class AsyncS3ModelRepository(AsyncModelRepository):
 
         return bucket, key
 
-    def _save_content_to_s3(self, content: str) -> str:
-        bucket_name = self._bucket_name
-        object_key = f"{uuid.uuid4()}.obj"
+    async def _run_blocking[T](self, func: Callable[..., T], /, *args: Any) -> T:
+        return await self._s3_executor.run(func, *args)
 
+    async def _object_exists(self, object_key: str) -> bool:
         try:
-            self._s3.put_object(Body=content, Bucket=bucket_name, Key=object_key)
-            s3_url = self._get_s3_url(bucket_name, object_key)
+            await self._s3_executor.run(
+                self._s3.head_object, Bucket=self._bucket_name, Key=object_key
+            )
         except ClientError as e:
-            logger.error(f"Failed to upload the content to the bucket: {e}")
+            if e.response["Error"]["Code"] in ("404", "NoSuchKey"):
+                return False
+            logger.error(f"Failed to check {object_key} in the bucket: {e}")
             raise
 
-        return s3_url
+        return True
+
+    async def _put_object(self, content: str | bytes, object_key: str) -> None:
+        data = content.encode() if isinstance(content, str) else content
+        content_type = self.CONTENT_TYPES[posixpath.splitext(object_key)[1]]
 
-    async def save(self, message_id: int, content: str) -> ModelDTO:  # type: ignore
         try:
-            s3_url = self._save_content_to_s3(content)
+            if len(data) > self._part_bytes:
+                await self._put_multipart(data, object_key, content_type)
+                return
 
-            new_model = ModelDAO(
-                storage_path=s3_url,
-                message_id=message_id,
+            await self._s3_executor.run(
+                self._s3.put_object,
+                Body=data,
+                Bucket=self._bucket_name,
+                Key=object_key,
+                ContentType=content_type,
+                CacheControl=self.CACHE_CONTROL,
             )
-            self._db_session.add(new_model)
-            await self._db_session.commit()
-            await self._db_session.refresh(new_model)
-        except BaseException as e:
-            logger.error(f"Failed to save the model to the database: {e}")
-            await self._db_session.rollback()
+        except ClientError as e:
+            logger.error(f"Failed to upload the content to the bucket: {e}")
             raise
 
-        return ModelDTO.model_validate(new_model)
+    async def _put_multipart(self, data: bytes, object_key: str, content_type: str) -> None:
+        """Upload the parts of an object concurrently, as many as the S3 executor has threads."""
+        bucket_name = self._bucket_name
+        response = await self._s3_executor.run(
+            self._s3.create_multipart_upload,
+            Bucket=bucket_name,
+            Key=object_key,
+            ContentType=content_type,
+            CacheControl=self.CACHE_CONTROL,
+        )
+        upload_id = response["UploadId"]
+
+        async def upload_part(part_number: int, start: int) -> dict[str, Any]:
+            response = await self._s3_executor.run(
+                self._s3.upload_part,
+                Body=data[start : start + self._part_bytes],
+                Bucket=bucket_name,
+                Key=object_key,
+                UploadId=upload_id,
+                PartNumber=part_number,
+            )
+            return {"PartNumber": part_number, "ETag": response["ETag"]}
 
-    def _generate_presigned_url(self, bucket_name: str, object_key: str) -> str:
         try:
-            response = self._s3.generate_presigned_url(
-                "get_object",
-                Params={"Bucket": bucket_name, "Key": object_key},
-                ExpiresIn=3600,  # URL expires in 1 hour
+            parts = await asyncio.gather(
+                *(
+                    upload_part(part_number, start)
+                    for part_number, start in enumerate(
+                        range(0, len(data), self._part_bytes), start=1
+                    )
+                )
+            )
+            await self._s3_executor.run(
+                self._s3.complete_multipart_upload,
+                Bucket=bucket_name,
+                Key=object_key,
+                UploadId=upload_id,
+                MultipartUpload={"Parts": parts},
+            )
+        except BaseException:
+            # Also when the save is cancelled: S3 keeps the parts until it's aborted
+            await asyncio.shield(
+                self._s3_executor.run(
+                    self._abort_multipart, bucket_name, object_key, upload_id
+                )
+            )
+            raise
+
+    def _abort_multipart(self, bucket_name: str, object_key: str, upload_id: str) -> None:
+        try:
+            self._s3.abort_multipart_upload(
+                Bucket=bucket_name, Key=object_key, UploadId=upload_id
             )
         except ClientError as e:
-            logger.error(f"Failed to generate presigned URL: {e}")
+            logger.error(f"Failed to abort the upload of {object_key}: {e}")
+
+    async def _delete_objects(self, bucket_name: str, object_keys: list[str]) -> None:
+        if self._spool is not None:
+            await asyncio.to_thread(self._spool.remove, object_keys)
+
+        # The original goes first: without it, a later save uploads everything again
+        for keys in (object_keys[:1], object_keys[1:]):
+            if not keys:
+                continue
+            try:
+                response = await self._s3_executor.run(
+                    self._s3.delete_objects,
+                    Bucket=bucket_name,
+                    Delete={"Objects": [{"Key": key} for key in keys], "Quiet": True},
+                )
+            except ClientError as e:
+                logger.error(f"Failed to delete {keys} from the bucket: {e}")
+                return
+
+            if response.get("Errors"):
+                logger.error(f"Failed to delete from the bucket: {response['Errors']}")
+                return
+
+    def _read_object(self, container: str, object_key: str) -> bytes:
+        if self._spool is not None:
+            with contextlib.suppress(FileNotFoundError):
+                return self._spool.read(object_key)
+
+        try:
+            response = self._s3.get_object(Bucket=container, Key=object_key)
+            return cast(bytes, response["Body"].read())
+        except ClientError as e:
+            logger.error(f"Failed to download {object_key} from the bucket: {e}")
             raise
 
-        return cast(str, response)
+    def _iter_object(self, container: str, object_key: str) -> Iterator[bytes]:
+        if self._spool is not None:
+            try:
+                file = self._spool.open(object_key)
+            except FileNotFoundError:
+                pass
+            else:
+                with file:
+                    while chunk := file.read(self.DOWNLOAD_CHUNK_BYTES):
+                        yield chunk
+                return
 
-    async def get_url(self, model_id: int) -> str:
-        query = select(ModelDAO).filter(ModelDAO.id == model_id)
-        result = await self._db_session.execute(query)
-        model = result.scalar_one_or_none()
+        try:
+            response = self._s3.get_object(Bucket=container, Key=object_key)
+        except ClientError as e:
+            logger.error(f"Failed to download {object_key} from the bucket: {e}")
+            raise
 
-        if not model:
-            raise ValueError(f"Model with id {model_id} not found")
+        yield from response["Body"].iter_chunks(self.DOWNLOAD_CHUNK_BYTES)
 
-        assert model.storage_path
+    async def _get_urls(
+        self, locations: dict[int, tuple[str, str] | None]
+    ) -> dict[int, str | None]:
+        assert self._url_signer
+        spool, request = self._spool, self._request
 
-        bucket_name, object_key = self._get_bucket_and_object_keys(model.storage_path)
+        spooled: dict[int, str] = {}
+        if spool is not None and request is not None:
+            # Not uploaded yet, served by the API
+            spooled = await asyncio.to_thread(
+                lambda: {
+                    model_id: location[1]
+                    for model_id, location in locations.items()
+                    if location and spool.exists(location[1])
+                }
+            )
+            locations = {
+                model_id: location
+                for model_id, location in locations.items()
+                if model_id not in spooled
+            }
 
-        presigned_url = self._generate_presigned_url(bucket_name, object_key)
+        # Signing doesn't wait for the network, but refreshing the credentials may
+        urls = await self._s3_executor.run(self._url_signer.sign, locations)
 
-        return presigned_url
+        if spooled:
+            assert request
+            for model_id, object_key in spooled.items():
+                urls[model_id] = get_object_file_url(request, object_key)
+        return urls
 
-    async def get_batch_urls(self, model_ids: list[int]) -> dict[int, str]:
-        query = select(ModelDAO).filter(ModelDAO.id.in_(model_ids))
-        result = await self._db_session.execute(query)
-        models = result.scalars().all()
 
-        found_ids = {model.id for model in models}
-        missing_ids = set(model_ids) - found_ids
-        if missing_ids:
-            raise ValueError(f"Models with ids {missing_ids} not found")
+class AsyncLocalModelRepository(AsyncObjectModelRepository):
+    """Models stored as files in a local directory, served by the API.
+
+    For single-node deployments, and to run the service offline. The URLs
+    point to /models/files, see get_object_file.
+    """
+
+    STORAGE_PATH_PREFIX = "local://"
+
+    _store: ClassVar[LocalObjectStore | None] = None
+
+    def __init__(
+        self,
+        db_session: Annotated[AsyncSession, Depends(get_db_session)],
+        request: Request,
+    ) -> None:
+        super().__init__(db_session)
+
+        store = self._store
+        assert store, "set_store is called in the lifespan"
+        self._object_store = store
+        self._request = request
+
+    @staticmethod
+    def set_store(store: LocalObjectStore) -> None:
+        AsyncLocalModelRepository._store = store
+
+    def _get_storage_path(self, object_key: str) -> str:
+        # Relative to the root, the directory can be moved
+        return f"{self.STORAGE_PATH_PREFIX}{object_key}"
+
+    def _parse_storage_path(self, storage_path: str) -> tuple[str, str]:
+        if not storage_path.startswith(self.STORAGE_PATH_PREFIX):
+            raise ValueError(f"Invalid local storage path: {storage_path}")
 
-        id_to_url = {}
-        for model in models:
-            assert model.storage_path
-            bucket_name, object_key = self._get_bucket_and_object_keys(
-                model.storage_path
+        return self._object_store.root, storage_path[len(self.STORAGE_PATH_PREFIX) :]
+
+    async def _run_blocking[T](self, func: Callable[..., T], /, *args: Any) -> T:
+        return await asyncio.to_thread(func, *args)
+
+    async def _object_exists(self, object_key: str) -> bool:
+        return await asyncio.to_thread(self._object_store.exists, object_key)
+
+    async def _put_object(self, content: str | bytes, object_key: str) -> None:
+        data = content.encode() if isinstance(content, str) else content
+
+        try:
+            await asyncio.to_thread(self._object_store.write, object_key, data)
+        except OSError as e:
+            logger.error(f"Failed to write {object_key} to {self._object_store.root}: {e}")
+            raise
+
+    def _read_object(self, container: str, object_key: str) -> bytes:
+        return self._object_store.read(object_key)
+
+    def _iter_object(self, container: str, object_key: str) -> Iterator[bytes]:
+        with self._object_store.open(object_key) as file:
+            while chunk := file.read(self.DOWNLOAD_CHUNK_BYTES):
+                yield chunk
+
+    async def _get_urls(
+        self, locations: dict[int, tuple[str, str] | None]
+    ) -> dict[int, str | None]:
+        return {
+            model_id: get_object_file_url(self._request, location[1]) if location else None
+            for model_id, location in locations.items()
+        }
+
+
+def get_object_file_url(request: Request, object_key: str) -> str:
+    return str(request.url_for("get_model_file", object_key=object_key))
+
+
+async def get_object_file(object_key: str) -> tuple[str, str] | None:
+    """Path and content type of an object served by the API, None if there's no such file.
+
+    Objects of the local storage backend, and objects of the S3 backend
+    waiting in the write-behind spool.
+    """
+    if not AsyncObjectModelRepository.OBJECT_KEY_PATTERN.fullmatch(object_key):
+        return None
+
+    for store in (AsyncLocalModelRepository._store, AsyncS3ModelRepository._spool):
+        if store is not None and await asyncio.to_thread(store.exists, object_key):
+            extension = posixpath.splitext(object_key)[1]
+            return (
+                store.get_path(object_key),
+                AsyncObjectModelRepository.CONTENT_TYPES[extension],
             )
-            presigned_url = self._generate_presigned_url(bucket_name, object_key)
-            id_to_url[model.id] = presigned_url
 
-        return id_to_url
+    return None
+
+
+def get_model_repository(
+    db_session: Annotated[AsyncSession, Depends(get_db_session)], request: Request
+) -> AsyncModelRepository:
+    """Model repository of the storage backend set by set_storage_backend."""
+    if AsyncModelRepository._storage_backend == "local":
+        return AsyncLocalModelRepository(db_session, request)
+    return AsyncS3ModelRepository(db_session, request)
@@ -0,0 +1,157 @@
+import asyncio
+import bisect
+import logging
+import time
+from dataclasses import dataclass
+from typing import Any, ClassVar, Self, TypedDict
+
+from sqlalchemy import event, exc
+from sqlalchemy.pool import AsyncAdaptedQueuePool, ConnectionPoolEntry, PoolProxiedConnection
+
+logger = logging.getLogger("app")
+
+
+@dataclass(frozen=True)
+class PoolSettings:
+    """Connection pool of the engine, the `database.pool` section of config.yaml."""
+
+    size: int = 5
+    max_overflow: int = 10
+    timeout: float = 30.0
+    recycle: int = -1
+    pre_ping: bool = False
+    statement_cache_size: int = 100
+    stats_interval: float = 60.0
+
+    @classmethod
+    def from_config(cls, config: dict[str, Any] | None) -> Self:
+        config = config or {}
+        return cls(
+            size=config.get("size", cls.size),
+            max_overflow=config.get("max_overflow", cls.max_overflow),
+            timeout=config.get("timeout", cls.timeout),
+            recycle=config.get("recycle", cls.recycle),
+            pre_ping=config.get("pre_ping", cls.pre_ping),
+            statement_cache_size=config.get("statement_cache_size", cls.statement_cache_size),
+            stats_interval=config.get("stats_interval", cls.stats_interval),
+        )
+
+
+class PoolSnapshot(TypedDict):
+    size: int
+    checked_out: int
+    max_checked_out: int
+    overflow: int
+    checkouts: int
+    overflow_connections: int
+    timeouts: int
+    max_wait: float
+    waits: dict[str, int]
+
+
+class PoolStats:
+    """Usage of a connection pool, to size it against the concurrent requests and streams.
+
+    Fed by the pool's events: checkouts, and connections opened beyond the
+    pool size (overflow). The time each checkout waits for a connection, a
+    new one being opened included, is counted in a histogram by upper bound,
+    in seconds; the last bucket is unbounded. The peaks are those since the
+    previous log, the counters are cumulative.
+    """
+
+    WAIT_BOUNDS: ClassVar[tuple[float, ...]] = (0.001, 0.005, 0.025, 0.1, 0.5, 2.5, 10.0)
+
+    def __init__(self) -> None:
+        self._pool: AsyncAdaptedQueuePool | None = None
+        self.checkouts = 0
+        self.overflow_connections = 0
+        self.timeouts = 0
+        self.max_checked_out = 0
+        self.max_wait = 0.0
+        self.wait_counts = [0] * (len(self.WAIT_BOUNDS) + 1)
+
+        self._task: asyncio.Task | None = None
+
+    def attach(self, pool: AsyncAdaptedQueuePool) -> None:
+        self._pool = pool
+        event.listen(pool, "connect", self._on_connect)
+        event.listen(pool, "checkout", self._on_checkout)
+
+    def record_wait(self, seconds: float) -> None:
+        self.wait_counts[bisect.bisect_left(self.WAIT_BOUNDS, seconds)] += 1
+        self.max_wait = max(self.max_wait, seconds)
+
+    def record_timeout(self) -> None:
+        self.timeouts += 1
+
+    def _on_connect(self, dbapi_connection: Any, connection_record: ConnectionPoolEntry) -> None:
+        assert self._pool
+        # The overflow is counted before the connection is opened
+        if self._pool.overflow() > 0:
+            self.overflow_connections += 1
+
+    def _on_checkout(
+        self,
+        dbapi_connection: Any,
+        connection_record: ConnectionPoolEntry,
+        connection_proxy: PoolProxiedConnection,
+    ) -> None:
+        assert self._pool
+        self.checkouts += 1
+        self.max_checked_out = max(self.max_checked_out, self._pool.checkedout())
+
+    def snapshot(self) -> PoolSnapshot:
+        assert self._pool
+        labels = [f"<={bound:g}s" for bound in self.WAIT_BOUNDS]
+        labels.append(f">{self.WAIT_BOUNDS[-1]:g}s")
+        return PoolSnapshot(
+            size=self._pool.size(),
+            checked_out=self._pool.checkedout(),
+            max_checked_out=self.max_checked_out,
+            overflow=max(self._pool.overflow(), 0),
+            checkouts=self.checkouts,
+            overflow_connections=self.overflow_connections,
+            timeouts=self.timeouts,
+            max_wait=round(self.max_wait, 6),
+            waits=dict(zip(labels, self.wait_counts)),
+        )
+
+    async def start(self, interval: float) -> None:
+        """Log a snapshot every `interval` seconds, none if it's 0."""
+        if interval > 0:
+            self._task = asyncio.create_task(self._log_periodically(interval))
+
+    async def aclose(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _log_periodically(self, interval: float) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            logger.info(f"Database pool: {self.snapshot()}")
+            self.max_checked_out = self._pool.checkedout() if self._pool else 0
+            self.max_wait = 0.0
+
+
+class InstrumentedQueuePool(AsyncAdaptedQueuePool):
+    """AsyncAdaptedQueuePool that times its checkouts into `stats`.
+
+    The pool events fire once a connection is checked out, none when a
+    checkout starts waiting for one.
+    """
+
+    stats: ClassVar[PoolStats | None] = None
+
+    def connect(self) -> PoolProxiedConnection:
+        start = time.perf_counter()
+        try:
+            return super().connect()
+        except exc.TimeoutError:
+            if self.stats:
+                self.stats.record_timeout()
+            raise
+        finally:
+            if self.stats:
+                self.stats.record_wait(time.perf_counter() - start)
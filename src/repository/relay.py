@@ -0,0 +1,485 @@
+import asyncio
+import json
+import logging
+import uuid
+from abc import ABC, abstractmethod
+from collections.abc import AsyncGenerator, Awaitable, Callable, Sequence
+from types import TracebackType
+from typing import Any, Self, TypeAlias
+
+import asyncpg
+
+from .listener import AsyncPostgresListener
+from ..models.stream import StreamEventBatchDAO
+from ..my_logging.logging_config import setup_logging
+
+setup_logging()
+logger = logging.getLogger("app")
+debug_logger = logging.getLogger("debug")
+
+
+RelayEvent: TypeAlias = tuple[str, Any]  # (event, data) of a server-sent event
+IsAlive: TypeAlias = Callable[[], Awaitable[bool]]
+
+
+class StreamRelayPublisher:
+    """Batches the events of one stream before handing them to the relay.
+
+    A batch is sent when it holds `batch_size` events, when its payload grows
+    past `max_payload_size` (if the relay has a limit) or `max_delay` seconds
+    after its first event, whichever comes first. Closing the publisher sends
+    the last batch.
+    """
+
+    def __init__(
+        self,
+        relay: "AsyncStreamRelay",
+        stream_id: uuid.UUID,
+        batch_size: int,
+        max_delay: float,
+        max_payload_size: int | None,
+    ) -> None:
+        self._relay = relay
+        self._stream_id = stream_id
+        self._batch_size = batch_size
+        self._max_delay = max_delay
+        self._max_payload_size = max_payload_size
+
+        self._events: list[RelayEvent] = []
+        self._payload_size = 0
+        self._seq = 0
+        self._lock = asyncio.Lock()
+        self._delayed_flush: asyncio.Task | None = None
+
+    async def publish(self, event: RelayEvent) -> None:
+        async with self._lock:
+            self._events.append(event)
+
+            if self._max_payload_size is not None and self._batch_size > 1:
+                self._payload_size += len(json.dumps(event))
+
+            if len(self._events) >= self._batch_size or (
+                self._max_payload_size is not None
+                and self._payload_size >= self._max_payload_size
+            ):
+                await self._flush()
+            elif len(self._events) == 1 and self._max_delay > 0:
+                self._delayed_flush = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self) -> None:
+        await asyncio.sleep(self._max_delay)
+
+        async with self._lock:
+            self._delayed_flush = None
+            await self._flush()
+
+    async def _flush(self, is_last: bool = False) -> None:
+        if self._delayed_flush and self._delayed_flush is not asyncio.current_task():
+            self._delayed_flush.cancel()
+            self._delayed_flush = None
+
+        if not self._events and not is_last:
+            return
+
+        events, self._events = self._events, []
+        self._payload_size = 0
+
+        try:
+            await self._relay._send_batch(self._stream_id, self._seq, events, is_last)
+        except Exception as e:
+            logger.error(f"Failed to relay events of stream {self._stream_id}: {e}")
+        finally:
+            self._seq += 1
+
+    async def aclose(self) -> None:
+        async with self._lock:
+            await self._flush(is_last=True)
+
+    async def __aenter__(self) -> Self:
+        return self
+
+    async def __aexit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc_value: BaseException | None,
+        traceback: TracebackType | None,
+    ) -> None:
+        await self.aclose()
+
+
+class AsyncStreamRelay(ABC):
+    """Delivers the SSE events of a running stream to clients on any replica.
+
+    The process running the generation publishes events through a
+    `StreamRelayPublisher`; any process can `subscribe` to the stream and
+    receives every event from the beginning of the stream up to its end.
+
+    A subscription given `is_alive` asks it whether the stream still runs
+    every `ALIVE_CHECK_INTERVAL` seconds without events, and ends early once
+    it doesn't: the process running the stream may have died.
+    """
+
+    MAX_PAYLOAD_SIZE: int | None = None  # Of a batch, serialized
+    ALIVE_CHECK_INTERVAL = 5.0
+
+    def __init__(self, batch_size: int = 1, max_delay: float = 0) -> None:
+        self._batch_size = batch_size
+        self._max_delay = max_delay
+
+    @abstractmethod
+    async def start(self) -> None: ...
+    @abstractmethod
+    async def aclose(self) -> None: ...
+    @abstractmethod
+    async def _send_batch(
+        self,
+        stream_id: uuid.UUID,
+        seq: int,
+        events: Sequence[RelayEvent],
+        is_last: bool,
+    ) -> None: ...
+    @abstractmethod
+    def subscribe(
+        self,
+        stream_id: uuid.UUID,
+        idle_timeout: float | None = None,
+        is_alive: IsAlive | None = None,
+    ) -> AsyncGenerator[RelayEvent]: ...
+
+    async def _get[T](
+        self,
+        queue: asyncio.Queue[T],
+        idle_timeout: float | None,
+        is_alive: IsAlive | None,
+    ) -> T | None:
+        """Next item of the queue, None once the stream is no longer alive.
+
+        Raises TimeoutError after `idle_timeout` seconds without an item.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = None if idle_timeout is None else loop.time() + idle_timeout
+
+        while True:
+            timeout = self.ALIVE_CHECK_INTERVAL if is_alive else None
+            if deadline is not None:
+                remaining = deadline - loop.time()
+                timeout = remaining if timeout is None else min(timeout, remaining)
+
+            try:
+                return await asyncio.wait_for(queue.get(), timeout)
+            except TimeoutError:
+                if deadline is not None and loop.time() >= deadline:
+                    raise
+
+            if is_alive and not await is_alive():
+                return None
+
+    def publisher(self, stream_id: uuid.UUID) -> StreamRelayPublisher:
+        return StreamRelayPublisher(
+            self,
+            stream_id,
+            batch_size=self._batch_size,
+            max_delay=self._max_delay,
+            max_payload_size=self.MAX_PAYLOAD_SIZE,
+        )
+
+
+class AsyncInMemoryStreamRelay(AsyncStreamRelay):
+    """Process-local relay, events are handed over without serialization.
+
+    The events of a stream are kept for subscribers joining late, up to
+    `max_history` events: past that, the history of the stream is dropped and
+    a subscriber joining late receives the events from then on.
+    """
+
+    MAX_HISTORY_DEFAULT = 4096
+
+    def __init__(
+        self,
+        batch_size: int = 1,
+        max_delay: float = 0,
+        max_history: int = MAX_HISTORY_DEFAULT,
+    ) -> None:
+        super().__init__(batch_size, max_delay)
+        self._max_history = max_history
+        self._history: dict[uuid.UUID, list[RelayEvent]] = {}
+        self._history_dropped: set[uuid.UUID] = set()
+        self._subscribers: dict[uuid.UUID, list[asyncio.Queue[RelayEvent | None]]] = {}
+
+    async def start(self) -> None: ...
+
+    async def aclose(self) -> None:
+        for queues in self._subscribers.values():
+            for queue in queues:
+                queue.put_nowait(None)
+
+        self._history.clear()
+        self._history_dropped.clear()
+        self._subscribers.clear()
+
+    async def _send_batch(
+        self,
+        stream_id: uuid.UUID,
+        seq: int,
+        events: Sequence[RelayEvent],
+        is_last: bool,
+    ) -> None:
+        queues = self._subscribers.get(stream_id, [])
+
+        for queue in queues:
+            for event in events:
+                queue.put_nowait(event)
+
+            if is_last:
+                queue.put_nowait(None)
+
+        if is_last:
+            self._history.pop(stream_id, None)
+            self._history_dropped.discard(stream_id)
+        elif stream_id not in self._history_dropped:
+            history = self._history.setdefault(stream_id, [])
+            history.extend(events)
+
+            if len(history) > self._max_history:
+                logger.warning(
+                    f"Dropped the relay history of stream {stream_id}, "
+                    f"longer than {self._max_history} events"
+                )
+                del self._history[stream_id]
+                self._history_dropped.add(stream_id)
+
+    async def subscribe(
+        self,
+        stream_id: uuid.UUID,
+        idle_timeout: float | None = None,
+        is_alive: IsAlive | None = None,
+    ) -> AsyncGenerator[RelayEvent]:
+        queue: asyncio.Queue[RelayEvent | None] = asyncio.Queue()
+
+        for event in self._history.get(stream_id, []):
+            queue.put_nowait(event)
+
+        queues = self._subscribers.setdefault(stream_id, [])
+        queues.append(queue)
+
+        try:
+            while True:
+                event = await self._get(queue, idle_timeout, is_alive)
+
+                if event is None:
+                    break
+
+                yield event
+        finally:
+            queues.remove(queue)
+
+            if not queues:
+                self._subscribers.pop(stream_id, None)
+
+
+class AsyncPostgresStreamRelay(AsyncStreamRelay):
+    """Relay shared by all replicas through Postgres.
+
+    Every batch is inserted into the unlogged `stream_event_batches` table and
+    announced with NOTIFY on a per-stream channel in the same transaction.
+    The notification carries the batch itself when it fits into the NOTIFY
+    payload limit; otherwise, and for subscribers joining late, batches are
+    read back from the table.
+
+    Once the connection is lost, the subscriptions end, as the notifications
+    sent until it's reconnected are lost. Sending a batch waits up to
+    `CONNECTION_TIMEOUT` seconds for the reconnection and is retried once.
+    """
+
+    CHANNEL_PREFIX = "stream_events_"
+    MAX_NOTIFY_PAYLOAD_SIZE = 7900  # Postgres limit is 8000 bytes
+    MAX_PAYLOAD_SIZE = 7000  # Batches stay below it, sent within the notification
+    RETENTION = "10 minutes"
+    CONNECTION_TIMEOUT = 5.0
+    CONNECTION_ERRORS = (asyncpg.PostgresConnectionError, asyncpg.InterfaceError)
+
+    def __init__(self, batch_size: int = 1, max_delay: float = 0) -> None:
+        super().__init__(batch_size, max_delay)
+        self._lock = asyncio.Lock()
+        self._listener = AsyncPostgresListener(
+            "Stream relay", on_disconnect=self._end_subscriptions
+        )
+        # Notifications of each subscription, None once it has to end
+        self._subscriptions: set[asyncio.Queue[str | None]] = set()
+
+    async def start(self) -> None:
+        await self._listener.start()
+
+    async def aclose(self) -> None:
+        self._end_subscriptions()
+        await self._listener.aclose()
+
+    def _end_subscriptions(self) -> None:
+        for notifications in self._subscriptions:
+            notifications.put_nowait(None)
+
+    async def _connection(self) -> asyncpg.Connection:
+        return await asyncio.wait_for(
+            self._listener.connection(), self.CONNECTION_TIMEOUT
+        )
+
+    @classmethod
+    def _channel(cls, stream_id: uuid.UUID) -> str:
+        return f"{cls.CHANNEL_PREFIX}{stream_id.hex}"
+
+    async def _send_batch(
+        self,
+        stream_id: uuid.UUID,
+        seq: int,
+        events: Sequence[RelayEvent],
+        is_last: bool,
+    ) -> None:
+        encoded_events = json.dumps(events)
+        payload = json.dumps({"seq": seq, "last": is_last, "events": events})
+        if len(payload.encode()) > self.MAX_NOTIFY_PAYLOAD_SIZE:
+            payload = json.dumps({"seq": seq, "last": is_last})
+
+        async with self._lock:
+            connection = await self._connection()
+            try:
+                await self._insert_batch(
+                    connection, stream_id, seq, encoded_events, is_last, payload
+                )
+            except self.CONNECTION_ERRORS:
+                self._listener.reconnect(connection)
+                await self._insert_batch(
+                    await self._connection(),
+                    stream_id,
+                    seq,
+                    encoded_events,
+                    is_last,
+                    payload,
+                )
+
+    async def _insert_batch(
+        self,
+        connection: asyncpg.Connection,
+        stream_id: uuid.UUID,
+        seq: int,
+        encoded_events: str,
+        is_last: bool,
+        payload: str,
+    ) -> None:
+        async with connection.transaction():
+            await connection.execute(
+                f"INSERT INTO {StreamEventBatchDAO.__tablename__} "
+                "(stream_id, seq, events, is_last) VALUES ($1, $2, $3, $4)",
+                stream_id,
+                seq,
+                encoded_events,
+                is_last,
+            )
+            await connection.execute(
+                "SELECT pg_notify($1, $2)", self._channel(stream_id), payload
+            )
+
+            if is_last:
+                await connection.execute(
+                    f"DELETE FROM {StreamEventBatchDAO.__tablename__} "
+                    f"WHERE created_at < now() - interval '{self.RETENTION}'"
+                )
+
+    async def _fetch_batches(
+        self, stream_id: uuid.UUID, from_seq: int, to_seq: int | None = None
+    ) -> list[asyncpg.Record]:
+        query = (
+            f"SELECT seq, events, is_last FROM {StreamEventBatchDAO.__tablename__} "
+            "WHERE stream_id = $1 AND seq >= $2 AND ($3::int IS NULL OR seq <= $3) "
+            "ORDER BY seq"
+        )
+        async with self._lock:
+            connection = await self._connection()
+            try:
+                return await connection.fetch(query, stream_id, from_seq, to_seq)
+            except self.CONNECTION_ERRORS:
+                self._listener.reconnect(connection)
+                raise
+
+    async def subscribe(
+        self,
+        stream_id: uuid.UUID,
+        idle_timeout: float | None = None,
+        is_alive: IsAlive | None = None,
+    ) -> AsyncGenerator[RelayEvent]:
+        channel = self._channel(stream_id)
+        notifications: asyncio.Queue[str | None] = asyncio.Queue()
+
+        def on_notify(
+            connection: asyncpg.Connection, pid: int, channel: str, payload: str
+        ) -> None:
+            notifications.put_nowait(payload)
+
+        # Listen first, so that no batch committed after the catch-up read is missed
+        self._subscriptions.add(notifications)
+        async with self._lock:
+            await self._listener.add_listener(channel, on_notify)
+
+        try:
+            next_seq = 0
+
+            try:
+                rows = await self._fetch_batches(stream_id, next_seq)
+            except self.CONNECTION_ERRORS:
+                return
+
+            for row in rows:
+                for event, data in json.loads(row["events"]):
+                    yield event, data
+
+                next_seq = row["seq"] + 1
+                if row["is_last"]:
+                    return
+
+            while True:
+                notification = await self._get(notifications, idle_timeout, is_alive)
+                if notification is None:
+                    return
+
+                batch = json.loads(notification)
+                seq = batch["seq"]
+
+                if seq < next_seq:
+                    continue
+
+                if seq == next_seq and "events" in batch:
+                    rows = [{"seq": seq, "events": batch["events"], "is_last": batch["last"]}]
+                else:
+                    try:
+                        fetched = await self._fetch_batches(stream_id, next_seq, seq)
+                    except self.CONNECTION_ERRORS:
+                        return
+
+                    rows = [
+                        {**row, "events": json.loads(row["events"])} for row in fetched
+                    ]
+
+                for row in rows:
+                    for event, data in row["events"]:
+                        yield event, data
+
+                    next_seq = row["seq"] + 1
+                    if row["is_last"]:
+                        return
+        finally:
+            self._subscriptions.discard(notifications)
+            async with self._lock:
+                await self._listener.remove_listener(channel, on_notify)
+
+
+def create_stream_relay(
+    implementation: str,
+    batch_size: int = 1,
+    max_delay: float = 0,
+    max_history: int = AsyncInMemoryStreamRelay.MAX_HISTORY_DEFAULT,
+) -> AsyncStreamRelay:
+    if implementation == "memory":
+        return AsyncInMemoryStreamRelay(batch_size, max_delay, max_history)
+    elif implementation == "postgres":
+        return AsyncPostgresStreamRelay(batch_size, max_delay)
+    else:
+        raise ValueError(f"Unknown stream relay implementation: {implementation}")
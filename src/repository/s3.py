@@ -0,0 +1,220 @@
+import asyncio
+import functools
+import hashlib
+import hmac
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from collections.abc import Callable, Mapping
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, cast
+from urllib.parse import quote, urlsplit
+
+import boto3
+from botocore.client import BaseClient
+from botocore.config import Config
+from botocore.credentials import Credentials
+from botocore.exceptions import ClientError, NoCredentialsError
+
+logger = logging.getLogger("app")
+
+
+def create_s3_client(
+    max_pool_connections: int, session: boto3.session.Session | None = None
+) -> BaseClient:
+    """S3 client shared by the whole application, boto3 clients are thread-safe."""
+    session = session or boto3.session.Session()
+    return session.client(
+        "s3", config=Config(max_pool_connections=max_pool_connections)
+    )
+
+
+def get_or_create_bucket(s3: BaseClient, prefix: str) -> str:
+    buckets = s3.list_buckets()["Buckets"]
+
+    for bucket in buckets:
+        if bucket["Name"].startswith(prefix):
+            return cast(str, bucket["Name"])
+
+    bucket_name = f"{prefix}-{uuid.uuid4()}"
+    bucket_name = bucket_name.lower()
+
+    try:
+        s3.create_bucket(Bucket=bucket_name)
+        return bucket_name
+    except ClientError as e:
+        logger.error(f"Failed to create bucket {bucket_name}: {e}")
+        raise
+
+
+class AsyncS3Executor:
+    """Runs the blocking boto3 calls in a bounded pool of threads, off the event loop.
+
+    An upload on the event loop stalls every stream of the process until S3
+    answers. boto3 clients are thread-safe; give them a connection pool at
+    least as large as `max_threads` so that the threads don't wait for one.
+    """
+
+    MAX_THREADS_DEFAULT = 32
+
+    def __init__(self, max_threads: int = MAX_THREADS_DEFAULT) -> None:
+        self.max_threads = max_threads
+        self._thread_pool = ThreadPoolExecutor(max_threads, thread_name_prefix="s3")
+
+    async def run[T](self, func: Callable[..., T], /, *args: Any, **kwargs: Any) -> T:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._thread_pool, functools.partial(func, *args, **kwargs)
+        )
+
+    def shutdown(self) -> None:
+        # Uploads in progress are finished, their saves are waiting for them
+        self._thread_pool.shutdown(wait=True)
+
+
+class S3UrlSigner:
+    """Presigned GET URLs, signed locally with SigV4 query parameters and cached.
+
+    A cached URL is returned while it stays valid for `min_remaining` seconds
+    or more, then it's signed again. Past `max_urls`, the least recently used
+    are evicted, and expired ones as soon as they are the least recently used.
+    The URLs of a batch share their timestamp and the signing key, derived
+    once a day: each costs a SHA-256 and an HMAC, without going through
+    botocore. Their scheme, host and path are those botocore presigns for the
+    bucket, asked once per bucket.
+
+    Thread-safe. Call it from the S3 executor: refreshing temporary
+    credentials can wait for the network.
+    """
+
+    EXPIRES_IN_DEFAULT = 3600
+    MIN_REMAINING_DEFAULT = 600
+    MAX_URLS_DEFAULT = 100_000
+
+    def __init__(
+        self,
+        s3: BaseClient,
+        credentials: Credentials | None,
+        expires_in: int = EXPIRES_IN_DEFAULT,
+        min_remaining: int = MIN_REMAINING_DEFAULT,
+        max_urls: int = MAX_URLS_DEFAULT,
+    ) -> None:
+        self._s3 = s3
+        self._credentials = credentials
+        self._region = s3.meta.region_name
+        self._expires_in = expires_in
+        self._min_remaining = min_remaining
+        self._max_urls = max_urls
+
+        self._urls: OrderedDict[tuple[str, str], tuple[str, float]] = OrderedDict()
+        self._origins: dict[str, tuple[str, str, str]] = {}  # bucket -> origin, host, path
+        self._signing_key: tuple[str, str, bytes] | None = None  # secret, date, key
+        self._lock = threading.Lock()
+
+    def sign[K](self, locations: Mapping[K, tuple[str, str] | None]) -> dict[K, str | None]:
+        """URL of the object at each (bucket, key) location, None for no location."""
+        now = time.time()
+        cached: dict[tuple[str, str], str] = {}
+        missing: set[tuple[str, str]] = set()
+
+        with self._lock:
+            for location in locations.values():
+                if location is None or location in cached:
+                    continue
+                entry = self._urls.get(location)
+                if entry and entry[1] - now >= self._min_remaining:
+                    self._urls.move_to_end(location)
+                    cached[location] = entry[0]
+                else:
+                    missing.add(location)
+
+        if missing:
+            signed = self._sign(missing, now)
+            cached.update(signed)
+
+            with self._lock:
+                for location, url in signed.items():
+                    self._urls[location] = (url, now + self._expires_in)
+                    self._urls.move_to_end(location)
+                self._evict(now)
+
+        return {
+            key: cached[location] if location else None
+            for key, location in locations.items()
+        }
+
+    def _evict(self, now: float) -> None:
+        while len(self._urls) > self._max_urls:
+            self._urls.popitem(last=False)
+        while self._urls and next(iter(self._urls.values()))[1] <= now:
+            self._urls.popitem(last=False)
+
+    def _origin(self, bucket_name: str) -> tuple[str, str, str]:
+        """Scheme and host, host, and path prefix of the URLs of the bucket's objects."""
+        if bucket_name not in self._origins:
+            url = urlsplit(
+                self._s3.generate_presigned_url(
+                    "get_object", Params={"Bucket": bucket_name, "Key": "_"}
+                )
+            )
+            self._origins[bucket_name] = (
+                f"{url.scheme}://{url.netloc}",
+                url.netloc,
+                url.path[: -len("_")],
+            )
+        return self._origins[bucket_name]
+
+    def _get_signing_key(self, secret_key: str, date: str) -> bytes:
+        if self._signing_key and self._signing_key[:2] == (secret_key, date):
+            return self._signing_key[2]
+
+        key = f"AWS4{secret_key}".encode()
+        for part in (date, self._region, "s3", "aws4_request"):
+            key = hmac.new(key, part.encode(), hashlib.sha256).digest()
+        self._signing_key = (secret_key, date, key)
+        return key
+
+    def _sign(
+        self, locations: set[tuple[str, str]], now: float
+    ) -> dict[tuple[str, str], str]:
+        if self._credentials is None:
+            raise NoCredentialsError()
+        credentials = self._credentials.get_frozen_credentials()
+
+        amz_date = time.strftime("%Y%m%dT%H%M%SZ", time.gmtime(now))
+        scope = f"{amz_date[:8]}/{self._region}/s3/aws4_request"
+        signing_key = self._get_signing_key(credentials.secret_key, amz_date[:8])
+
+        # Sorted by name, as in the canonical request
+        query = (
+            "X-Amz-Algorithm=AWS4-HMAC-SHA256"
+            f"&X-Amz-Credential={quote(f'{credentials.access_key}/{scope}', safe='')}"
+            f"&X-Amz-Date={amz_date}"
+            f"&X-Amz-Expires={self._expires_in}"
+        )
+        if credentials.token:
+            query += f"&X-Amz-Security-Token={quote(credentials.token, safe='')}"
+        query += "&X-Amz-SignedHeaders=host"
+        string_to_sign = f"AWS4-HMAC-SHA256\n{amz_date}\n{scope}\n".encode()
+        # Keyed once, copying it is cheaper than a new HMAC per URL
+        keyed_hmac = hmac.new(signing_key, string_to_sign, hashlib.sha256)
+
+        urls = {}
+        for bucket_name, object_key in locations:
+            origin, host, path_prefix = self._origin(bucket_name)
+            path = path_prefix + quote(object_key, safe="/~")
+            canonical_request = (
+                f"GET\n{path}\n{query}\nhost:{host}\n\nhost\nUNSIGNED-PAYLOAD"
+            )
+
+            signature = keyed_hmac.copy()
+            signature.update(
+                hashlib.sha256(canonical_request.encode()).hexdigest().encode()
+            )
+            urls[bucket_name, object_key] = (
+                f"{origin}{path}?{query}&X-Amz-Signature={signature.hexdigest()}"
+            )
+
+        return urls
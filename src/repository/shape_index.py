@@ -0,0 +1,391 @@
+import asyncio
+import json
+import logging
+from collections import Counter
+from collections.abc import Sequence
+from typing import Self
+
+import asyncpg
+import numpy as np
+import numpy.typing as npt
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import db
+from .listener import AsyncPostgresListener
+from ..mesh.descriptor import D2_BINS
+from ..models.model import ModelDAO
+
+logger = logging.getLogger("app")
+debug_logger = logging.getLogger("debug")
+
+
+class ShapeIndex:
+    """IVF (inverted file) index of the shape descriptors of the models, kept in memory.
+
+    Descriptors are grouped in the lists of their nearest k-means centroid and
+    a query only scans the `probes` lists nearest to it. Below TRAIN_MIN
+    descriptors there is a single list, scanned whole. The centroids are
+    trained by `build` once there are enough descriptors, and should be
+    trained again once the index has grown RETRAIN_GROWTH times since, see
+    `needs_training`.
+
+    Every model has an owner (NO_OWNER for none) kept next to it in its list.
+    A query for an owner's models masks the others out as the lists are
+    scanned, nearest first, and scans more lists the fewer models the owner
+    has, all of them for most owners, see `_scan_owner`.
+
+    Not thread-safe.
+    """
+
+    TRAIN_MIN = 4096
+    VECTORS_PER_LIST = 400
+    RETRAIN_GROWTH = 4
+    KMEANS_ITERATIONS = 10
+    KMEANS_SAMPLES_PER_LIST = 64
+
+    PROBES_DEFAULT = 24  # Recall@10 of ~0.9 at 100k models, see benchmarks/shape_index.py
+    NO_OWNER = -1
+
+    def __init__(self, dimensions: int = D2_BINS, probes: int = PROBES_DEFAULT) -> None:
+        self._dimensions = dimensions
+        self._probes = probes
+
+        self._centroids = np.empty((0, dimensions), dtype=np.float32)
+        self._list_ids: list[npt.NDArray[np.int64]] = []
+        self._list_owners: list[npt.NDArray[np.int64]] = []
+        self._list_vectors: list[npt.NDArray[np.float32]] = []
+        self._locations: dict[int, int] = {}  # model id -> list
+        self._owner_counts: Counter[int] = Counter()
+        self._trained_count = 0
+        self._reset_lists(1)
+
+    @classmethod
+    def build(
+        cls,
+        ids: npt.NDArray[np.int64],
+        owners: npt.NDArray[np.int64],
+        vectors: npt.NDArray[np.float32],
+        dimensions: int = D2_BINS,
+        probes: int = PROBES_DEFAULT,
+    ) -> Self:
+        """Index of the descriptors, trained if there are enough. Takes seconds at 100k+."""
+        index = cls(dimensions, probes)
+
+        if len(ids) < cls.TRAIN_MIN:
+            lists = np.zeros(len(ids), dtype=np.int32)
+            index._fill_lists(ids, owners, vectors, lists)
+            return index
+
+        index._centroids = _kmeans(vectors, max(len(ids) // cls.VECTORS_PER_LIST, 1))
+        index._trained_count = len(ids)
+        lists = _nearest_centroids(vectors, index._centroids)
+        index._fill_lists(ids, owners, vectors, lists)
+        return index
+
+    def __len__(self) -> int:
+        return len(self._locations)
+
+    def _reset_lists(self, count: int) -> None:
+        self._list_ids = [np.empty(0, dtype=np.int64) for _ in range(count)]
+        self._list_owners = [np.empty(0, dtype=np.int64) for _ in range(count)]
+        self._list_vectors = [
+            np.empty((0, self._dimensions), dtype=np.float32) for _ in range(count)
+        ]
+        self._locations = {}
+        self._owner_counts = Counter()
+
+    def needs_training(self) -> bool:
+        if len(self) < self.TRAIN_MIN:
+            return False
+        return (
+            not self._trained_count
+            or len(self) >= self.RETRAIN_GROWTH * self._trained_count
+        )
+
+    def add(
+        self, model_id: int, owner: int, vector: npt.NDArray[np.float32]
+    ) -> None:
+        vector = np.asarray(vector, dtype=np.float32)
+        self.remove(model_id)
+
+        list_number = self._nearest_list(vector)
+        self._list_ids[list_number] = np.append(self._list_ids[list_number], model_id)
+        self._list_owners[list_number] = np.append(self._list_owners[list_number], owner)
+        self._list_vectors[list_number] = np.vstack(
+            (self._list_vectors[list_number], vector)
+        )
+        self._locations[model_id] = list_number
+        self._owner_counts[owner] += 1
+
+    def remove(self, model_id: int) -> None:
+        list_number = self._locations.pop(model_id, None)
+        if list_number is None:
+            return
+
+        kept = self._list_ids[list_number] != model_id
+        [owner] = self._list_owners[list_number][~kept].tolist()
+        self._list_ids[list_number] = self._list_ids[list_number][kept]
+        self._list_owners[list_number] = self._list_owners[list_number][kept]
+        self._list_vectors[list_number] = self._list_vectors[list_number][kept]
+
+        self._owner_counts[owner] -= 1
+        if not self._owner_counts[owner]:
+            del self._owner_counts[owner]
+
+    def search(
+        self, vector: npt.NDArray[np.float32], limit: int, owner: int | None = None
+    ) -> list[tuple[int, float]]:
+        """The `limit` nearest models as (id, Euclidean distance), nearest first.
+
+        Only those of `owner` if given, the others aren't counted in `limit`.
+        """
+        vector = np.asarray(vector, dtype=np.float32)
+
+        if len(self._centroids):
+            centroid_distances = ((self._centroids - vector) ** 2).sum(axis=1)
+            probes = min(self._probes, len(self._centroids))
+            if owner is None:
+                lists = np.argpartition(centroid_distances, probes - 1)[:probes]
+            else:
+                lists = np.argsort(centroid_distances)
+        else:
+            probes = 1
+            lists = np.arange(len(self._list_ids))
+
+        if owner is None:
+            ids = np.concatenate([self._list_ids[number] for number in lists])
+            vectors = np.concatenate([self._list_vectors[number] for number in lists])
+        else:
+            ids, vectors = self._scan_owner(lists, probes, limit, owner)
+        if not len(ids):
+            return []
+
+        distances = ((vectors - vector) ** 2).sum(axis=1)
+        limit = min(limit, len(ids))
+        nearest = np.argpartition(distances, limit - 1)[:limit]
+        nearest = nearest[np.argsort(distances[nearest])]
+
+        return list(zip(ids[nearest].tolist(), np.sqrt(distances[nearest]).tolist()))
+
+    def _scan_owner(
+        self, lists: npt.NDArray[np.intp], probes: int, limit: int, owner: int
+    ) -> tuple[npt.NDArray[np.int64], npt.NDArray[np.float32]]:
+        """Models of `owner` in `lists`, scanned in order until enough are found.
+
+        The nearest of an owner's models are as many times farther as the
+        owner has fewer models: as many times more lists are scanned for the
+        recall of `probes` lists over all models.
+        """
+        remaining = self._owner_counts.get(owner, 0)
+        min_scanned = probes * len(self) / max(remaining, 1)
+        found_ids = [np.empty(0, dtype=np.int64)]
+        found_vectors = [np.empty((0, self._dimensions), dtype=np.float32)]
+        found = 0
+
+        for scanned, number in enumerate(lists.tolist()):
+            if not remaining or (scanned >= min_scanned and found >= limit):
+                break
+
+            owned = np.flatnonzero(self._list_owners[number] == owner)
+            if not len(owned):
+                continue
+
+            found_ids.append(self._list_ids[number][owned])
+            found_vectors.append(self._list_vectors[number][owned])
+            found += len(owned)
+            remaining -= len(owned)
+
+        return np.concatenate(found_ids), np.concatenate(found_vectors)
+
+    def _nearest_list(self, vector: npt.NDArray[np.float32]) -> int:
+        if not len(self._centroids):
+            return 0
+        return int(((self._centroids - vector) ** 2).sum(axis=1).argmin())
+
+    def _fill_lists(
+        self,
+        ids: npt.NDArray[np.int64],
+        owners: npt.NDArray[np.int64],
+        vectors: npt.NDArray[np.float32],
+        lists: npt.NDArray[np.int32],
+    ) -> None:
+        self._reset_lists(max(len(self._centroids), 1))
+
+        order = np.argsort(lists, kind="stable")
+        ids, owners, vectors, lists = ids[order], owners[order], vectors[order], lists[order]
+        bounds = np.searchsorted(lists, np.arange(len(self._list_ids) + 1))
+
+        for number, (start, end) in enumerate(zip(bounds, bounds[1:])):
+            self._list_ids[number] = ids[start:end].copy()
+            self._list_owners[number] = owners[start:end].copy()
+            self._list_vectors[number] = vectors[start:end].copy()
+
+        self._locations = dict(zip(ids.tolist(), lists.tolist()))
+        self._owner_counts = Counter(owners.tolist())
+
+
+class SharedShapeIndex:
+    """The ShapeIndex of this process, in step with the descriptors stored in Postgres.
+
+    The `models.descriptor` column is the index of record, every process
+    loads it on start with the owners of the models (`models.user_id`).
+    Saves, deletions and changes of owner announce their model ids with
+    NOTIFY on CHANNEL in their transaction; every process LISTENs and applies
+    them in order, reading the added descriptors back from the table. Once
+    the index needs training, or the listener reconnected after missing
+    notifications, it's built again from a new read of the table in a
+    thread, and searches use the previous one meanwhile.
+    """
+
+    CHANNEL = "shape_index"
+    DESCRIPTOR_BYTES = D2_BINS * 4  # float32, those of another size have other settings
+    READ_BATCH_SIZE = 2_000  # ~10 ms of row processing on the event loop
+
+    def __init__(self, probes: int = ShapeIndex.PROBES_DEFAULT) -> None:
+        self._probes = probes
+        self.index = ShapeIndex(probes=probes)
+
+        self._listener = AsyncPostgresListener(
+            "Shape index listener", on_reconnect=self._on_reconnect
+        )
+        self._updates: asyncio.Queue[str | None] = asyncio.Queue()  # None to rebuild
+        self._task: asyncio.Task | None = None
+
+    async def start(self) -> None:
+        # Listening before the first read, no change committed in between is missed
+        await self._listener.add_listener(self.CHANNEL, self._on_update)
+        await self._listener.start()
+
+        await self._rebuild()
+        self._task = asyncio.create_task(self._apply_updates())
+
+    async def aclose(self) -> None:
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+        await self._listener.aclose()
+
+    @classmethod
+    async def notify(
+        cls,
+        session: AsyncSession,
+        added: Sequence[int] = (),
+        removed: Sequence[int] = (),
+    ) -> None:
+        """Announce changed descriptors to every process, delivered when `session` commits."""
+        payload = json.dumps({"added": list(added), "removed": list(removed)})
+        await session.execute(select(func.pg_notify(cls.CHANNEL, payload)))
+
+    def _on_update(
+        self, connection: asyncpg.Connection, pid: int, channel: str, payload: str
+    ) -> None:
+        self._updates.put_nowait(payload)
+
+    async def _on_reconnect(self) -> None:
+        # After the updates received so far, those received meanwhile apply to the new index
+        self._updates.put_nowait(None)
+
+    async def _apply_updates(self) -> None:
+        while True:
+            payload = await self._updates.get()
+
+            try:
+                if payload is None:
+                    await self._rebuild()
+                    continue
+
+                update = json.loads(payload)
+                for model_id in update["removed"]:
+                    self.index.remove(model_id)
+
+                if update["added"]:
+                    ids, owners, vectors = await self._read(update["added"])
+                    for model_id, owner, vector in zip(
+                        ids.tolist(), owners.tolist(), vectors
+                    ):
+                        self.index.add(model_id, owner, vector)
+
+                if self.index.needs_training():
+                    await self._rebuild()
+            except Exception as e:
+                logger.error(f"Failed to update the shape index with {payload}: {e}")
+
+    async def _rebuild(self) -> None:
+        ids, owners, vectors = await self._read()
+        # Updates wait for the new index, they are applied to it afterwards
+        self.index = await asyncio.to_thread(
+            ShapeIndex.build, ids, owners, vectors, D2_BINS, self._probes
+        )
+        logger.info(f"Shape index built: {len(self.index)} models")
+
+    async def _read(
+        self, model_ids: Sequence[int] | None = None
+    ) -> tuple[npt.NDArray[np.int64], npt.NDArray[np.int64], npt.NDArray[np.float32]]:
+        """Ids, owners and descriptors of the models, of all models by default."""
+        assert db.AsyncSessionFactory
+
+        query = select(
+            ModelDAO.id,
+            func.coalesce(ModelDAO.user_id, ShapeIndex.NO_OWNER),
+            ModelDAO.descriptor,
+        ).where(func.octet_length(ModelDAO.descriptor) == self.DESCRIPTOR_BYTES)
+        if model_ids is not None:
+            query = query.where(ModelDAO.id.in_(model_ids))
+
+        ids: list[int] = []
+        owners: list[int] = []
+        descriptors: list[bytes] = []
+        async with db.AsyncSessionFactory() as session:
+            # In batches, the event loop runs between them
+            result = await session.stream(
+                query.execution_options(yield_per=self.READ_BATCH_SIZE)
+            )
+            async for rows in result.partitions():
+                for model_id, owner, descriptor in rows:
+                    ids.append(model_id)
+                    owners.append(owner)
+                    descriptors.append(descriptor)
+
+        return (
+            np.array(ids, dtype=np.int64),
+            np.array(owners, dtype=np.int64),
+            np.frombuffer(b"".join(descriptors), dtype=np.float32).reshape(-1, D2_BINS),
+        )
+
+
+def _kmeans(
+    vectors: npt.NDArray[np.float32], list_count: int
+) -> npt.NDArray[np.float32]:
+    rng = np.random.default_rng(0)
+
+    sample_size = min(len(vectors), list_count * ShapeIndex.KMEANS_SAMPLES_PER_LIST)
+    sample = vectors[rng.choice(len(vectors), sample_size, replace=False)]
+    centroids = sample[rng.choice(sample_size, list_count, replace=False)]
+
+    for _ in range(ShapeIndex.KMEANS_ITERATIONS):
+        labels = _nearest_centroids(sample, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, sample)
+        counts = np.bincount(labels, minlength=list_count)
+        # An empty cluster keeps its centroid
+        filled = counts > 0
+        centroids[filled] = sums[filled] / counts[filled, None]
+
+    return centroids.astype(np.float32)
+
+
+def _nearest_centroids(
+    vectors: npt.NDArray[np.float32], centroids: npt.NDArray[np.float32]
+) -> npt.NDArray[np.int32]:
+    # |v - c|^2 = |v|^2 - 2 v.c + |c|^2, the first term doesn't change the argmin
+    labels = np.empty(len(vectors), dtype=np.int32)
+    centroid_norms = (centroids**2).sum(axis=1)
+    for start in range(0, len(vectors), 8192):
+        chunk = vectors[start : start + 8192]
+        labels[start : start + 8192] = (centroid_norms - 2 * chunk @ centroids.T).argmin(
+            axis=1
+        )
+    return labels
@@ -0,0 +1,360 @@
+import asyncio
+import logging
+import uuid
+from abc import ABC, abstractmethod
+from datetime import timedelta
+
+import asyncpg
+from sqlalchemy import delete, func, or_, select, update
+
+from . import db
+from .listener import AsyncPostgresListener
+from ..assistant.budget import GenerationBudget
+from ..models.stream import StreamDAO, StreamEventBatchDAO
+from ..my_logging.logging_config import setup_logging
+from ..services.streaming import Stream
+
+setup_logging()
+logger = logging.getLogger("app")
+debug_logger = logging.getLogger("debug")
+
+
+class AsyncStreamRegistry(ABC):
+    """Shared bookkeeping of pending and running message streams.
+
+    A stream is registered by the POST that creates the message, attached by the
+    GET that runs the generation and stopped by the DELETE. With a shared
+    implementation these requests may be served by different processes.
+    Attached streams are tracked locally, so that a stop request coming from
+    any process reaches the process that actually runs the generation.
+
+    Each attachment gets a new lease: a stream is running while its lease is
+    valid, and subscribers follow it as long as the lease they saw is.
+    """
+
+    def __init__(self) -> None:
+        self._local_streams: dict[uuid.UUID, Stream] = {}
+
+    @abstractmethod
+    async def start(self) -> None: ...
+    @abstractmethod
+    async def aclose(self) -> None: ...
+    @abstractmethod
+    async def register(self, stream_id: uuid.UUID, stream: Stream) -> None: ...
+    @abstractmethod
+    async def _claim(self, stream_id: uuid.UUID) -> Stream | None: ...
+    @abstractmethod
+    async def get_lease(self, stream_id: uuid.UUID) -> uuid.UUID | None: ...
+    @abstractmethod
+    async def request_stop(self, stream_id: uuid.UUID) -> None: ...
+    @abstractmethod
+    async def _forget(self, stream_id: uuid.UUID) -> None: ...
+
+    async def attach(self, stream_id: uuid.UUID) -> Stream | None:
+        """Claim the stream for running in this process.
+
+        Returns None if the stream doesn't exist or is already running.
+        """
+        stream = await self._claim(stream_id)
+
+        if stream:
+            self._local_streams[stream_id] = stream
+
+        return stream
+
+    async def is_running(self, stream_id: uuid.UUID) -> bool:
+        return await self.get_lease(stream_id) is not None
+
+    async def remove(self, stream_id: uuid.UUID) -> None:
+        self._local_streams.pop(stream_id, None)
+        await self._forget(stream_id)
+
+    def _stop_local(self, stream_id: uuid.UUID) -> None:
+        stream = self._local_streams.get(stream_id)
+
+        if stream:
+            stream.stop()
+
+
+class AsyncInMemoryStreamRegistry(AsyncStreamRegistry):
+    """Process-local registry. Requires running the API in a single worker."""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self._streams: dict[uuid.UUID, Stream] = {}
+        self._leases: dict[uuid.UUID, uuid.UUID] = {}
+        self._stop_requested: set[uuid.UUID] = set()
+
+    async def start(self) -> None: ...
+
+    async def aclose(self) -> None:
+        self._streams.clear()
+        self._leases.clear()
+        self._stop_requested.clear()
+        self._local_streams.clear()
+
+    async def register(self, stream_id: uuid.UUID, stream: Stream) -> None:
+        self._streams[stream_id] = stream
+
+    async def _claim(self, stream_id: uuid.UUID) -> Stream | None:
+        stream = self._streams.get(stream_id)
+
+        if not stream or stream_id in self._leases:
+            return None
+
+        self._leases[stream_id] = uuid.uuid4()
+        stream.is_running = stream_id not in self._stop_requested
+        return stream
+
+    async def get_lease(self, stream_id: uuid.UUID) -> uuid.UUID | None:
+        return self._leases.get(stream_id)
+
+    async def request_stop(self, stream_id: uuid.UUID) -> None:
+        if stream_id not in self._streams:
+            raise ValueError("Stream not found")
+
+        self._stop_requested.add(stream_id)
+        self._streams[stream_id].stop()
+
+    async def _forget(self, stream_id: uuid.UUID) -> None:
+        self._streams.pop(stream_id, None)
+        self._leases.pop(stream_id, None)
+        self._stop_requested.discard(stream_id)
+
+
+class AsyncPostgresStreamRegistry(AsyncStreamRegistry):
+    """Registry shared by all processes through the `streams` table.
+
+    Stop requests are broadcast with NOTIFY on `STOP_CHANNEL`; every process
+    LISTENs on a dedicated connection and stops its locally attached stream.
+    After the connection was lost, the stop requests persisted meanwhile are
+    read back for the local streams.
+
+    A lease lasts `lease_duration` seconds and is renewed every
+    `heartbeat_interval` seconds by the process running the stream. When that
+    process dies, the lease expires: the stream no longer counts as running,
+    its subscribers end, and the next attach runs it again from the start.
+    """
+
+    STOP_CHANNEL = "stream_stop"
+    LEASE_DURATION_DEFAULT = 30.0
+    HEARTBEAT_INTERVAL_DEFAULT = 10.0
+
+    def __init__(
+        self,
+        lease_duration: float = LEASE_DURATION_DEFAULT,
+        heartbeat_interval: float = HEARTBEAT_INTERVAL_DEFAULT,
+    ) -> None:
+        if heartbeat_interval >= lease_duration:
+            raise ValueError(
+                f"Heartbeat interval {heartbeat_interval}s must be shorter than "
+                f"the lease duration {lease_duration}s"
+            )
+
+        super().__init__()
+        self._lease_duration = timedelta(seconds=lease_duration)
+        self._heartbeat_interval = heartbeat_interval
+        self._leases: dict[uuid.UUID, uuid.UUID] = {}  # of the locally attached streams
+        self._heartbeat: asyncio.Task | None = None
+        self._listener = AsyncPostgresListener(
+            "Stream stop listener", on_reconnect=self._stop_requested_meanwhile
+        )
+
+    async def start(self) -> None:
+        await self._listener.add_listener(self.STOP_CHANNEL, self._on_stop)
+        await self._listener.start()
+        self._heartbeat = asyncio.create_task(self._renew_leases())
+
+    async def aclose(self) -> None:
+        if self._heartbeat:
+            self._heartbeat.cancel()
+            await asyncio.gather(self._heartbeat, return_exceptions=True)
+            self._heartbeat = None
+
+        self._local_streams.clear()
+        self._leases.clear()
+
+        await self._listener.aclose()
+
+    def _on_stop(
+        self, connection: asyncpg.Connection, pid: int, channel: str, payload: str
+    ) -> None:
+        debug_logger.debug(f"stop notification: {payload=}")
+        try:
+            stream_id = uuid.UUID(payload)
+        except ValueError:
+            logger.error(f"Malformed stop notification payload: {payload}")
+            return
+
+        self._stop_local(stream_id)
+
+    async def _stop_requested_meanwhile(self) -> None:
+        assert db.AsyncSessionFactory
+
+        if not self._leases:
+            return
+
+        query = select(StreamDAO.id).where(
+            StreamDAO.id.in_(list(self._leases)), StreamDAO.stop_requested.is_(True)
+        )
+        async with db.AsyncSessionFactory() as session:
+            result = await session.execute(query)
+            stream_ids = list(result.scalars())
+
+        for stream_id in stream_ids:
+            self._stop_local(stream_id)
+
+    async def _renew_leases(self) -> None:
+        while True:
+            await asyncio.sleep(self._heartbeat_interval)
+            leases = dict(self._leases)
+
+            if not leases:
+                continue
+
+            try:
+                renewed = await self._renew(list(leases.values()))
+            except Exception as e:
+                logger.error(f"Failed to renew the leases of {len(leases)} streams: {e}")
+                continue
+
+            for stream_id, lease_id in leases.items():
+                # Expired and attached again by another process
+                if lease_id not in renewed and self._leases.get(stream_id) == lease_id:
+                    logger.warning(f"Lost the lease of stream {stream_id}, stopping it")
+                    self._stop_local(stream_id)
+
+    async def _renew(self, lease_ids: list[uuid.UUID]) -> set[uuid.UUID]:
+        assert db.AsyncSessionFactory
+
+        query = (
+            update(StreamDAO)
+            .where(StreamDAO.lease_id.in_(lease_ids))
+            .values(lease_expires_at=func.now() + self._lease_duration)
+            .returning(StreamDAO.lease_id)
+        )
+        async with db.AsyncSessionFactory() as session:
+            result = await session.execute(query)
+            renewed = set(result.scalars())
+            await session.commit()
+
+        return renewed
+
+    async def register(self, stream_id: uuid.UUID, stream: Stream) -> None:
+        assert db.AsyncSessionFactory
+
+        async with db.AsyncSessionFactory() as session:
+            session.add(
+                StreamDAO(
+                    id=stream_id,
+                    chat_id=stream.chat_id,
+                    message_id=stream.message_id,
+                    max_tokens=stream.budget.max_tokens,
+                    max_seconds=stream.budget.max_seconds,
+                )
+            )
+            await session.commit()
+
+    async def _claim(self, stream_id: uuid.UUID) -> Stream | None:
+        assert db.AsyncSessionFactory
+
+        lease_id = uuid.uuid4()
+        query = (
+            update(StreamDAO)
+            .where(
+                StreamDAO.id == stream_id,
+                or_(
+                    StreamDAO.is_running.is_(False),
+                    StreamDAO.lease_expires_at < func.now(),
+                ),
+            )
+            .values(
+                is_running=True,
+                lease_id=lease_id,
+                lease_expires_at=func.now() + self._lease_duration,
+            )
+            .returning(StreamDAO)
+        )
+        async with db.AsyncSessionFactory() as session:
+            result = await session.execute(query)
+            stream_dao = result.scalar_one_or_none()
+
+            if stream_dao:
+                # Events relayed by a previous attachment whose process died
+                await session.execute(
+                    delete(StreamEventBatchDAO).where(
+                        StreamEventBatchDAO.stream_id == stream_id
+                    )
+                )
+            await session.commit()
+
+        if not stream_dao:
+            return None
+
+        self._leases[stream_id] = lease_id
+
+        return Stream(
+            chat_id=stream_dao.chat_id,
+            message_id=stream_dao.message_id,
+            budget=GenerationBudget(stream_dao.max_tokens, stream_dao.max_seconds),
+            is_running=not stream_dao.stop_requested,
+        )
+
+    async def get_lease(self, stream_id: uuid.UUID) -> uuid.UUID | None:
+        assert db.AsyncSessionFactory
+
+        query = select(StreamDAO.lease_id).where(
+            StreamDAO.id == stream_id,
+            StreamDAO.is_running.is_(True),
+            StreamDAO.lease_expires_at >= func.now(),
+        )
+        async with db.AsyncSessionFactory() as session:
+            result = await session.execute(query)
+            return result.scalar_one_or_none()
+
+    async def request_stop(self, stream_id: uuid.UUID) -> None:
+        assert db.AsyncSessionFactory
+
+        query = (
+            update(StreamDAO)
+            .where(StreamDAO.id == stream_id)
+            .values(stop_requested=True)
+            .returning(StreamDAO.id)
+        )
+        async with db.AsyncSessionFactory() as session:
+            result = await session.execute(query)
+
+            if not result.scalar_one_or_none():
+                raise ValueError("Stream not found")
+
+            # Delivered to the listeners on commit
+            await session.execute(
+                select(func.pg_notify(self.STOP_CHANNEL, str(stream_id)))
+            )
+            await session.commit()
+
+    async def _forget(self, stream_id: uuid.UUID) -> None:
+        assert db.AsyncSessionFactory
+
+        query = delete(StreamDAO).where(StreamDAO.id == stream_id)
+        lease_id = self._leases.pop(stream_id, None)
+        if lease_id:
+            # Unless another process attached it again
+            query = query.where(StreamDAO.lease_id == lease_id)
+
+        async with db.AsyncSessionFactory() as session:
+            await session.execute(query)
+            await session.commit()
+
+
+def create_stream_registry(
+    implementation: str,
+    lease_duration: float = AsyncPostgresStreamRegistry.LEASE_DURATION_DEFAULT,
+    heartbeat_interval: float = AsyncPostgresStreamRegistry.HEARTBEAT_INTERVAL_DEFAULT,
+) -> AsyncStreamRegistry:
+    if implementation == "memory":
+        return AsyncInMemoryStreamRegistry()
+    elif implementation == "postgres":
+        return AsyncPostgresStreamRegistry(lease_duration, heartbeat_interval)
+    else:
+        raise ValueError(f"Unknown stream registry implementation: {implementation}")
@@ -0,0 +1,94 @@
+import asyncio
+import logging
+from collections.abc import Awaitable, Callable, Iterable
+
+logger = logging.getLogger("app")
+debug_logger = logging.getLogger("debug")
+
+
+class AsyncUploadQueue:
+    """Runs uploads in the background, `concurrency` at a time, retrying those that fail.
+
+    A failed upload is attempted again after `retry_delay` seconds, doubled
+    after each failure up to `max_retry_delay`: while S3 is unreachable, the
+    items wait in the queue. After `max_attempts` failures, the item is
+    handed to `on_failure` and dropped. Items not uploaded when the queue is
+    closed are dropped too, their owner keeps them and puts them again on the
+    next start (see AsyncS3ModelRepository.get_spooled_paths).
+    """
+
+    CONCURRENCY_DEFAULT = 4
+    RETRY_DELAY_DEFAULT = 1.0
+    MAX_RETRY_DELAY_DEFAULT = 60.0
+    MAX_ATTEMPTS_DEFAULT = 20  # ~15 minutes with the default delays
+
+    def __init__(
+        self,
+        upload: Callable[[str], Awaitable[None]],
+        on_failure: Callable[[str], Awaitable[None]],
+        concurrency: int = CONCURRENCY_DEFAULT,
+        retry_delay: float = RETRY_DELAY_DEFAULT,
+        max_retry_delay: float = MAX_RETRY_DELAY_DEFAULT,
+        max_attempts: int = MAX_ATTEMPTS_DEFAULT,
+    ) -> None:
+        if max_attempts < 1:
+            raise ValueError(f"An upload is attempted at least once: {max_attempts=}")
+
+        self._upload = upload
+        self._on_failure = on_failure
+        self._concurrency = concurrency
+        self._retry_delay = retry_delay
+        self._max_retry_delay = max_retry_delay
+        self._max_attempts = max_attempts
+
+        self._queue: asyncio.Queue[str] = asyncio.Queue()
+        self._workers: list[asyncio.Task] = []
+
+    async def start(self, items: Iterable[str] = ()) -> None:
+        for item in items:
+            self.put(item)
+
+        self._workers = [
+            asyncio.create_task(self._work()) for _ in range(self._concurrency)
+        ]
+
+    def put(self, item: str) -> None:
+        self._queue.put_nowait(item)
+
+    async def aclose(self) -> None:
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    async def _work(self) -> None:
+        while True:
+            item = await self._queue.get()
+            if await self._upload_with_retries(item):
+                continue
+
+            try:
+                await self._on_failure(item)
+            except Exception as e:
+                logger.error(f"Failed to record the failed upload of {item}: {e}")
+
+    async def _upload_with_retries(self, item: str) -> bool:
+        delay = self._retry_delay
+
+        for attempt in range(1, self._max_attempts + 1):
+            try:
+                await self._upload(item)
+                debug_logger.debug(f"Uploaded {item} ({attempt=})")
+                return True
+            except Exception as e:
+                if attempt == self._max_attempts:
+                    logger.error(f"Failed to upload {item} ({attempt=}), giving up: {e}")
+                    break
+                logger.error(
+                    f"Failed to upload {item} ({attempt=}), retrying in {delay}s: {e}"
+                )
+
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self._max_retry_delay)
+
+        return False
@@ -9,6 +9,7 @@ from ..dependencies import validate_chat_id
 from ..models.message import MessageDTO
 from ..my_logging.logging_config import setup_logging
 from ..services.message import MessageService
+from ..utils.authentication import CurrentUserDep
 from .sse_streamer import async_sse_stream
 
 setup_logging()
@@ -36,9 +37,13 @@ async def get_messages(
 async def create_message(
     chat_id: int,
     message: MessageDTO,
+    user: CurrentUserDep,
     message_service: Annotated[MessageService, Depends()],
 ) -> dict[str, uuid.UUID | MessageDTO]:
-    stream_id, created_message = await message_service.create_message(chat_id, message)
+    user_auth_id = user["sub"]
+    stream_id, created_message = await message_service.create_message(
+        chat_id, message, user_auth_id
+    )
 
     return {"stream_id": stream_id, "message": created_message}
 
@@ -1,32 +1,177 @@
+import re
 from typing import Annotated
 
-from fastapi import APIRouter, Body, Depends, Query
+from fastapi import (
+    APIRouter,
+    Body,
+    Depends,
+    Header,
+    HTTPException,
+    Query,
+    Request,
+    Response,
+)
+from fastapi.responses import FileResponse, RedirectResponse, StreamingResponse
 
 from ..services.model import ModelService
-from ..repository.model import ModelDTO
+from ..repository.model import AsyncObjectModelRepository, ModelDTO
+from ..models.model import DownloadFormat, ModelFilter, ModelFormat, SimilarModelDTO
 from ..utils.authentication import get_current_user, CurrentUserDep 
 
 router = APIRouter(
     prefix="/users/me/models", tags=["Models"], dependencies=[Depends(get_current_user)]
 )
+# Objects of the local storage backend and of the write-behind spool. Like presigned
+# URLs, their URLs are enough to read them: the keys are digests of the meshes.
+files_router = APIRouter(prefix="/models/files", tags=["Models"])
+
+
+MODEL_MEDIA_TYPES: dict[str, ModelFormat] = {
+    "model/obj": "obj",
+    "model/gltf-binary": "glb",
+}
+
+DOWNLOAD_MEDIA_TYPES: dict[DownloadFormat, str] = {
+    "obj": "model/obj",
+    "stl": "model/stl",
+    "ply": "application/x-ply",
+}
+
+
+def negotiate_model_format(
+    response: Response, accept: Annotated[str | None, Header()] = None
+) -> ModelFormat:
+    """Format of the model the URLs point to, GLB only if the client prefers it."""
+    response.headers["Vary"] = "Accept"
+    qualities: dict[ModelFormat, float] = {"obj": 0, "glb": 0}
+
+    for media_range in (accept or "").split(","):
+        media_type, *parameters = [part.strip() for part in media_range.split(";")]
+
+        if media_type.lower() not in MODEL_MEDIA_TYPES:
+            continue
+
+        quality = 1.0
+        for parameter in parameters:
+            name, _, value = parameter.partition("=")
+            if name.strip() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0
+
+        qualities[MODEL_MEDIA_TYPES[media_type.lower()]] = quality
+
+    return "glb" if qualities["glb"] > qualities["obj"] else "obj"
+
+
+def get_content_url(request: Request, model_id: int, lod: int) -> str:
+    """URL of the model served by the API, for models stored compressed."""
+    url = request.url_for("get_model_content", model_id=model_id)
+    return str(url.include_query_params(lod=lod))
 
 
 @router.get("/urls")
 async def get_batch(
-    id: Annotated[list[int], Query()], model_service: Annotated[ModelService, Depends()]
+    id: Annotated[list[int], Query()],
+    request: Request,
+    model_service: Annotated[ModelService, Depends()],
+    model_format: Annotated[ModelFormat, Depends(negotiate_model_format)],
+    lod: Annotated[int, Query(ge=0)] = 0,
 ) -> dict[int, str]:
-    urls = await model_service.get_batch_urls(id)
-    return urls
+    urls = await model_service.get_batch_urls(id, lod, model_format)
+    return {
+        model_id: url or get_content_url(request, model_id, lod)
+        for model_id, url in urls.items()
+    }
 
 
 @router.get("/{model_id}/url")
 async def get_model_url(
-    model_id: int, model_service: Annotated[ModelService, Depends()]
+    model_id: int,
+    request: Request,
+    model_service: Annotated[ModelService, Depends()],
+    model_format: Annotated[ModelFormat, Depends(negotiate_model_format)],
+    lod: Annotated[int, Query(ge=0)] = 0,
 ) -> str:
-    url = await model_service.get_url_by_id(model_id)
+    url = await model_service.get_url_by_id(model_id, lod, model_format)
+    return url or get_content_url(request, model_id, lod)
+
+
+@router.get("/thumbnail-urls")
+async def get_batch_thumbnails(
+    id: Annotated[list[int], Query()],
+    model_service: Annotated[ModelService, Depends()],
+) -> dict[int, str | None]:
+    """PNG previews, null for models saved without one."""
+    urls = await model_service.get_batch_thumbnail_urls(id)
+    return urls
+
+
+@router.get("/{model_id}/thumbnail-url")
+async def get_model_thumbnail_url(
+    model_id: int,
+    model_service: Annotated[ModelService, Depends()],
+) -> str | None:
+    url = await model_service.get_thumbnail_url(model_id)
     return url
 
 
+@router.get("/{model_id}/content")
+async def get_model_content(
+    model_id: int,
+    model_service: Annotated[ModelService, Depends()],
+    lod: Annotated[int, Query(ge=0)] = 0,
+) -> Response:
+    content = await model_service.get_content(model_id, lod)
+    return Response(content, media_type="model/obj")
+
+
+@router.get("/{model_id}/download")
+async def download_model(
+    model_id: int,
+    model_service: Annotated[ModelService, Depends()],
+    format: DownloadFormat = "obj",
+    lod: Annotated[int, Query(ge=0)] = 0,
+) -> StreamingResponse:
+    """The model as a file, converted while it's sent: binary STL and PLY, or OBJ."""
+    name, chunks = await model_service.get_download(model_id, format, lod)
+    filename = re.sub(r"[^\w.-]+", "_", name, flags=re.ASCII).strip("._") or "model"
+
+    return StreamingResponse(
+        chunks,
+        media_type=DOWNLOAD_MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}.{format}"'},
+    )
+
+
+@files_router.get("/{object_key}")
+async def get_model_file(
+    object_key: str,
+    if_none_match: Annotated[str | None, Header()] = None,
+) -> Response:
+    """A stored model, thumbnail or GLB, with Range requests and revalidation by ETag."""
+    object_file = await ModelService.get_object_file(object_key)
+    if object_file is None:
+        # Uploaded from the spool since its URL was given
+        if url := await ModelService.get_uploaded_url(object_key):
+            return RedirectResponse(url, status_code=307)
+        raise HTTPException(status_code=404, detail="Object not found")
+
+    path, media_type = object_file
+    # Objects never change, their key identifies their content
+    etag = f'"{object_key}"'
+    headers = {"ETag": etag, "Cache-Control": AsyncObjectModelRepository.CACHE_CONTROL}
+
+    if if_none_match:
+        tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        if etag in tags or "*" in tags:
+            return Response(status_code=304, headers=headers)
+
+    # Zero-copy where the server supports http.response.pathsend, Range by Starlette
+    return FileResponse(path, media_type=media_type, headers=headers)
+
+
 @router.patch("/{model_id}/add-to-favorites")
 async def add_to_favorites(
     model_id: int,
@@ -41,9 +186,26 @@ async def add_to_favorites(
 async def get_favorite_models(
     user: CurrentUserDep,
     model_service: Annotated[ModelService, Depends()],
+    model_filter: Annotated[ModelFilter, Query()],
 ) -> list[ModelDTO]:
     user_auth_id = user["sub"]
-    models = await model_service.get_favorite_models(user_auth_id)
+    models = await model_service.get_favorite_models(user_auth_id, model_filter)
+    return models
+
+
+@router.get("/{model_id}/similar")
+async def get_similar_models(
+    model_id: int,
+    user: CurrentUserDep,
+    model_service: Annotated[ModelService, Depends()],
+    limit: Annotated[int, Query(ge=1, le=100)] = 10,
+) -> list[SimilarModelDTO]:
+    """The current user's saved models nearest in shape, nearest first."""
+    try:
+        user_auth_id = user["sub"]
+        models = await model_service.get_similar_models(user_auth_id, model_id, limit)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
     return models
 
 
@@ -54,6 +216,7 @@ async def remove_from_favorites(
 ) -> None:
     await model_service.remove_from_favorites(model_id)
 
+
 @router.patch("/{model_id}/rename")
 async def update_model_name(
     model_id: int,
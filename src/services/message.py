@@ -1,3 +1,5 @@
+import asyncio
+import functools
 import logging
 import uuid
 from contextlib import aclosing
@@ -8,6 +10,7 @@ from datetime import datetime
 from fastapi import Depends
 
 from ..assistant.assistant_runner import AsyncProcessAssistantRunner
+from ..assistant.budget import BudgetExceededError, GenerationBudget
 from ..assistant.chat_assistant import (
     ChatAssistant, LlamaChatAssistant, LlamaMockChatAssistant,
     MockChatAssistant, ObjChatAssistant
@@ -15,12 +18,17 @@ from ..assistant.chat_assistant import (
 from ..assistant.object_pool import (
     AsyncObjectPool, AsyncPooledObjectContextManager
 )
-from .parser import OBJParser
+from .parser import ContentAccumulator, OBJMeshBuilder, OBJParser
+from ..mesh.processing import AsyncMeshProcessor, ProcessedMesh
+from ..mesh.repair import RepairReport, is_repaired
 from ..models.message import MessageDTO, ResponseChunkDTO, MessageRole
 # from ..assistant.llama import LlamaMock as Llama
 from ..my_logging.logging_config import setup_logging
 from ..repository.message import AsyncMessageRepository
-from ..repository.model import AsyncModelRepository, AsyncS3ModelRepository
+from ..repository.model import AsyncModelRepository, get_model_repository
+from ..repository.relay import AsyncStreamRelay
+from ..repository.stream import AsyncStreamRegistry
+from ..repository.user import AsyncUserRepository
 from ..routers.sse_streamer import ServerSentEvent
 from .streaming import AsyncResponseGenerator, Stream
 
@@ -33,26 +41,37 @@ logging.getLogger("sqlalchemy.engine").setLevel(logging.INFO)
 
 class Event(StrEnum):
     OBJ_CONTENT = "obj_content"
+    MESH_DELTA = "mesh_delta"
     DONE = "done"
     ERROR = "error"
     BUSY = "busy"
+    BUDGET_EXCEEDED = "budget_exceeded"
+    MESH_REPAIR = "mesh_repair"
 
 
 class MessageService:    
-    _stream_pool: ClassVar[dict[uuid.UUID, Stream]] = dict()
+    RELAY_IDLE_TIMEOUT: ClassVar[float] = 300
+
+    _stream_registry: ClassVar[AsyncStreamRegistry | None] = None
+    _stream_relay: ClassVar[AsyncStreamRelay | None] = None
+    _mesh_processor: ClassVar[AsyncMeshProcessor | None] = None
     _runner: ClassVar[AsyncProcessAssistantRunner | None] = None
     _max_workers: ClassVar[int | None] = None
     _implementation: ClassVar[str | None] = None
+    _default_budget: ClassVar[GenerationBudget] = GenerationBudget()
+    _tier_budgets: ClassVar[dict[str, GenerationBudget]] = dict()
 
     def __init__(
         self,
         message_repository: Annotated[AsyncMessageRepository, Depends()],
         model_repository: Annotated[
-            AsyncModelRepository, Depends(AsyncS3ModelRepository)
+            AsyncModelRepository, Depends(get_model_repository)
         ],
+        user_repository: Annotated[AsyncUserRepository, Depends()],
     ) -> None:
         self._message_repository = message_repository
         self._model_repository = model_repository
+        self._user_repository = user_repository
 
     @staticmethod
     def set_max_workers(max_workers: int) -> None:
@@ -63,20 +82,80 @@ class MessageService:
     def set_assistant_implementation(implementation: str) -> None:
         MessageService._implementation = implementation
 
+    @staticmethod
+    def set_stream_registry(stream_registry: AsyncStreamRegistry) -> None:
+        MessageService._stream_registry = stream_registry
+
+    @staticmethod
+    def set_generation_budgets(
+        default: GenerationBudget, tiers: dict[str, GenerationBudget]
+    ) -> None:
+        MessageService._default_budget = default
+        MessageService._tier_budgets = {
+            tier: default.override(budget) for tier, budget in tiers.items()
+        }
+
+    @staticmethod
+    def get_generation_budget(tier: str | None) -> GenerationBudget:
+        if tier and tier in MessageService._tier_budgets:
+            return MessageService._tier_budgets[tier]
+
+        return MessageService._default_budget
+
+    @staticmethod
+    def set_stream_relay(stream_relay: AsyncStreamRelay) -> None:
+        MessageService._stream_relay = stream_relay
+
+    @staticmethod
+    def set_mesh_processor(mesh_processor: AsyncMeshProcessor) -> None:
+        MessageService._mesh_processor = mesh_processor
+
+    @staticmethod
+    async def process_mesh(content: str) -> ProcessedMesh:
+        assert MessageService._mesh_processor
+        return await MessageService._mesh_processor.process(content)
+
+    async def _prepare_mesh(self, content: str) -> ProcessedMesh:
+        """Process an OBJ block and store its objects, while the answer is generated."""
+        processed_mesh = await MessageService.process_mesh(content)
+
+        try:
+            await self._model_repository.prepare_save(processed_mesh)
+        except Exception as e:
+            # save_many stores them
+            logger.warning(f"Failed to store the objects of a mesh ahead of its save: {e}")
+
+        return processed_mesh
+
+    def _prepare_ended_blocks(
+        self,
+        obj_parser: OBJParser,
+        content_accumulator: ContentAccumulator,
+        prepared_meshes: list[asyncio.Task[ProcessedMesh]],
+    ) -> None:
+        for block in range(len(prepared_meshes), len(obj_parser.obj_indexes)):
+            obj_content = content_accumulator.get_obj_content(block)
+            prepared_meshes.append(asyncio.create_task(self._prepare_mesh(obj_content)))
+
     async def get_by_chat_id(self, chat_id: int) -> list[MessageDTO]:
         messages = await self._message_repository.get_by_chat_id(chat_id)
         return messages
 
     async def create_message(
-        self, chat_id: int, message: MessageDTO
+        self, chat_id: int, message: MessageDTO, auth_id: str
     ) -> tuple[uuid.UUID, MessageDTO]:
-        debug_logger.debug(f"stream pool id: {id(MessageService._stream_pool)}")
+        assert MessageService._stream_registry
+        user = await self._user_repository.get_by_auth_id(auth_id)
+        budget = MessageService.get_generation_budget(user.tier if user else None)
+
         message = await self._message_repository.create(chat_id, message)
 
         assert message.id
 
         stream_id = uuid.uuid4()
-        MessageService._stream_pool[stream_id] = Stream(chat_id, message.id)
+        await MessageService._stream_registry.register(
+            stream_id, Stream(chat_id, message.id, budget)
+        )
 
         return stream_id, message
 
@@ -98,13 +177,49 @@ class MessageService:
     async def create_stream(
         self, chat_id: int, stream_id: uuid.UUID
     ) -> AsyncGenerator[ServerSentEvent]:
-        debug_logger.debug(f"stream pool length: {len(MessageService._stream_pool)}")
+        assert MessageService._stream_registry
+        assert MessageService._stream_relay
+
+        stream_registry = MessageService._stream_registry
+        stream = await stream_registry.attach(stream_id)
+
+        if not stream:
+            lease_id = await stream_registry.get_lease(stream_id)
+            if not lease_id:
+                raise ValueError("Stream not found")
+
+            async def is_alive() -> bool:
+                return await stream_registry.get_lease(stream_id) == lease_id
+
+            # The stream is generated by another request, possibly on another replica
+            event = None
+            async for event, data in MessageService._stream_relay.subscribe(
+                stream_id, MessageService.RELAY_IDLE_TIMEOUT, is_alive
+            ):
+                yield ServerSentEvent(event=event, data=data)
+
+            if event not in (Event.DONE, Event.ERROR):
+                yield ServerSentEvent(event=Event.ERROR, data="Stream was interrupted")
+            return
+
+        try:
+            async with (
+                MessageService._stream_relay.publisher(stream_id) as publisher,
+                aclosing(self._run_stream(chat_id, stream_id, stream)) as events,
+            ):
+                async for event in events:
+                    await publisher.publish(event)
+                    yield event
+        finally:
+            # Running until its last event is relayed
+            await stream_registry.remove(stream_id)
+
+    async def _run_stream(
+        self, chat_id: int, stream_id: uuid.UUID, stream: Stream
+    ) -> AsyncGenerator[ServerSentEvent]:
         assert MessageService._runner
         assert MessageService._max_workers
 
-        if stream_id not in MessageService._stream_pool:
-            raise ValueError("Stream not found")
-
         messages = await self._message_repository.get_last_n_by_chat_id(chat_id, 1)
         message_history = [
             ResponseChunkDTO(role=cast(MessageRole, message.role), content=message.content)
@@ -129,38 +244,71 @@ class MessageService:
                 aclosing(self._model_repository)
             ):
                 obj_indexes_list = []
-                tokens = []
+                content_accumulator = ContentAccumulator()
+                repair_reports: list[RepairReport | None] = []
+                mesh_builder = OBJMeshBuilder()
+                # Processed and stored as soon as their block ends, see _prepare_mesh
+                prepared_meshes: list[asyncio.Task[ProcessedMesh]] = []
+                budget_exceeded: BudgetExceededError | None = None
                 chunk: ResponseChunkDTO
                 try:
-
-                    stream = MessageService._stream_pool[stream_id]
                     stream.generator = MessageService._runner.stream_response(
-                        chat_assistant, message_history, stream_id
+                        chat_assistant, message_history, stream_id, stream.budget
+                    )
+                    stream.on_stop = functools.partial(
+                        MessageService._runner.stop_stream, stream_id
                     )
-                    stream.is_running = True
-
-                    async with aclosing(stream.generator) as stream_gen:
-                        async for chunk in stream_gen:
-                            if not stream.is_running:
-                                MessageService._runner.stop_stream(stream_id)
-                                break
-
-                            content = chunk["content"]
-                            if content == "EOS":
-                                break
 
-                            tokens.append(content)
-                            obj_parser.process_token(content)
-                            yield ServerSentEvent(data=chunk)
+                    try:
+                        async with aclosing(stream.generator) as stream_gen:
+                            async for chunk in stream_gen:
+                                if not stream.is_running:
+                                    MessageService._runner.stop_stream(stream_id)
+                                    break
+
+                                content = chunk["content"]
+                                if content == "EOS":
+                                    break
+
+                                spans = obj_parser.process_token(content)
+                                content_accumulator.process_spans(spans)
+                                yield ServerSentEvent(data=chunk)
+
+                                for kind, text, block in spans:
+                                    if kind == "obj":
+                                        mesh_builder.process_text(text, cast(int, block))
+
+                                for mesh_delta in mesh_builder.pop_deltas():
+                                    yield ServerSentEvent(
+                                        event=Event.MESH_DELTA, data=mesh_delta
+                                    )
+
+                                self._prepare_ended_blocks(
+                                    obj_parser, content_accumulator, prepared_meshes
+                                )
+                    except BudgetExceededError as e:
+                        # Keep the partial output, it's persisted as a regular answer
+                        logger.warning(f"Stream {stream_id} was terminated: {e}")
+                        budget_exceeded = e
+
+                    spans = obj_parser.finish()
+                    content_accumulator.process_spans(spans)
+
+                    for kind, text, block in spans:
+                        if kind == "obj":
+                            mesh_builder.process_text(text, cast(int, block))
+
+                    mesh_builder.finish()
+                    for mesh_delta in mesh_builder.pop_deltas():
+                        yield ServerSentEvent(event=Event.MESH_DELTA, data=mesh_delta)
 
                     obj_indexes_list = obj_parser.get_obj_indexes()
-                    parsed_content = OBJParser.extract_obj_content(
-                        tokens, obj_indexes_list
-                    )
+                    parsed_content = content_accumulator.get_parsed_content()
                     message_content = parsed_content["message_content"]
-                    obj_contents = parsed_content["obj_contents"]
+                    self._prepare_ended_blocks(
+                        obj_parser, content_accumulator, prepared_meshes
+                    )
 
-                    content = "".join(tokens)
                     assistant_message = MessageDTO(
                         content=message_content, role="assistant"
                     )
@@ -168,33 +316,54 @@ class MessageService:
                         chat_id, assistant_message
                     )
 
-                    for obj_content in obj_contents:
-                        await self._model_repository.save(
-                            cast(int, created_message.id), obj_content
-                        )
+                    # As many blocks at once as the mesh processor has workers
+                    processed_meshes = await asyncio.gather(*prepared_meshes)
+                    for processed_mesh in processed_meshes:
+                        repair_report = processed_mesh["repair_report"]
+                        repair_reports.append(repair_report)
+
+                        if repair_report and is_repaired(repair_report):
+                            logger.info(
+                                f"Repaired mesh of stream {stream_id}: {repair_report}"
+                            )
+
+                    await self._model_repository.save_many(
+                        cast(int, created_message.id), processed_meshes
+                    )
 
                 except Exception as e:
                     logger.error(f"Error during message generation: {e}")
                     yield ServerSentEvent(event=Event.ERROR, data=str(e))
                 else:
+                    if budget_exceeded:
+                        yield ServerSentEvent(
+                            event=Event.BUDGET_EXCEEDED,
+                            data={
+                                "limit": budget_exceeded.limit,
+                                "value": budget_exceeded.value,
+                            },
+                        )
+                    if repair_reports:
+                        yield ServerSentEvent(
+                            event=Event.MESH_REPAIR, data=repair_reports
+                        )
                     yield ServerSentEvent(
                         event=Event.OBJ_CONTENT, data=obj_indexes_list
                     )
                     yield ServerSentEvent(event=Event.DONE)
                 finally:
+                    # Blocks of an answer that failed, aborting their uploads
+                    for prepared_mesh in prepared_meshes:
+                        prepared_mesh.cancel()
+                    await asyncio.gather(*prepared_meshes, return_exceptions=True)
                     await assistant_pool.release(chat_assistant)
-                    del MessageService._stream_pool[stream_id]
 
     @staticmethod
     async def stop_generation(stream_id: uuid.UUID) -> None:
         debug_logger.debug('stop_generation')
-        if stream_id not in MessageService._stream_pool:
-            raise ValueError("Stream not found")
-
-        stream = MessageService._stream_pool[stream_id]
-        assert stream.generator
+        assert MessageService._stream_registry
 
-        stream.is_running = False
+        await MessageService._stream_registry.request_stop(stream_id)
     
     @staticmethod
     def shutdown() -> None:
@@ -1,8 +1,18 @@
+import asyncio
+from collections.abc import Iterator
 from typing import Annotated
 
 from fastapi import Depends
 
-from ..repository.model import AsyncModelRepository, AsyncS3ModelRepository, ModelDTO
+from ..mesh.streaming import count_elements, iter_ply, iter_stl
+from ..models.model import DownloadFormat, ModelFilter, ModelFormat, SimilarModelDTO
+from ..repository.model import (
+    AsyncModelRepository,
+    AsyncS3ModelRepository,
+    ModelDTO,
+    get_model_repository,
+    get_object_file,
+)
 from ..repository.user import AsyncUserRepository
 
 
@@ -10,18 +20,62 @@ class ModelService:
     def __init__(
         self,
         model_repository: Annotated[
-            AsyncModelRepository, Depends(AsyncS3ModelRepository)
+            AsyncModelRepository, Depends(get_model_repository)
         ],
         user_repository: Annotated[AsyncUserRepository, Depends()],
     ):
         self._model_repository = model_repository
         self._user_repository = user_repository
 
-    async def get_url_by_id(self, model_id: int) -> str:
-        return await self._model_repository.get_url(model_id)
+    async def get_url_by_id(
+        self, model_id: int, lod: int = 0, model_format: ModelFormat = "obj"
+    ) -> str | None:
+        return await self._model_repository.get_url(model_id, lod, model_format)
 
-    async def get_batch_urls(self, model_ids: list[int]) -> dict[int, str]:
-        return await self._model_repository.get_batch_urls(model_ids)
+    async def get_batch_urls(
+        self, model_ids: list[int], lod: int = 0, model_format: ModelFormat = "obj"
+    ) -> dict[int, str | None]:
+        return await self._model_repository.get_batch_urls(model_ids, lod, model_format)
+
+    async def get_content(self, model_id: int, lod: int = 0) -> str:
+        return await self._model_repository.get_content(model_id, lod)
+
+    async def get_download(
+        self, model_id: int, download_format: DownloadFormat, lod: int = 0
+    ) -> tuple[str, Iterator[bytes]]:
+        """Name of the model and its content converted chunk by chunk, to iterate in a thread."""
+        source = await self._model_repository.get_content_source(model_id, lod)
+
+        if download_format == "obj":
+            return source.name, iter(source.open())
+
+        vertex_count, face_count = source.vertex_count, source.face_count
+        if vertex_count is None or face_count is None:
+            # Counted before responding, the headers need them
+            vertex_count, face_count = await asyncio.to_thread(
+                count_elements, source.open()
+            )
+
+        if download_format == "stl":
+            return source.name, iter_stl(source.open, face_count)
+        return source.name, iter_ply(source.open, vertex_count, face_count)
+
+    @staticmethod
+    async def get_object_file(object_key: str) -> tuple[str, str] | None:
+        """Path and content type of an object served by the API."""
+        return await get_object_file(object_key)
+
+    @staticmethod
+    async def get_uploaded_url(object_key: str) -> str | None:
+        return await AsyncS3ModelRepository.get_uploaded_url(object_key)
+
+    async def get_thumbnail_url(self, model_id: int) -> str | None:
+        return await self._model_repository.get_thumbnail_url(model_id)
+
+    async def get_batch_thumbnail_urls(
+        self, model_ids: list[int]
+    ) -> dict[int, str | None]:
+        return await self._model_repository.get_batch_thumbnail_urls(model_ids)
 
     async def add_to_favorites(self, auth_id: str, model_id: int) -> None:
         user = await self._user_repository.get_by_auth_id(auth_id)
@@ -36,7 +90,9 @@ class ModelService:
     async def remove_from_favorites(self, model_id: int) -> None:
         await self._model_repository.set_user_id(None, model_id)
 
-    async def get_favorite_models(self, auth_id: str) -> list[ModelDTO]:
+    async def get_favorite_models(
+        self, auth_id: str, model_filter: ModelFilter | None = None
+    ) -> list[ModelDTO]:
         user = await self._user_repository.get_by_auth_id(auth_id)
 
         if not user:
@@ -44,8 +100,20 @@ class ModelService:
 
         assert user.id
 
-        models = await self._model_repository.get_having_user_id(user.id)
+        models = await self._model_repository.get_having_user_id(user.id, model_filter)
         return models
     
+    async def get_similar_models(
+        self, auth_id: str, model_id: int, limit: int
+    ) -> list[SimilarModelDTO]:
+        user = await self._user_repository.get_by_auth_id(auth_id)
+
+        if not user:
+            raise ValueError("User not found")
+
+        assert user.id
+
+        return await self._model_repository.get_similar(model_id, user.id, limit)
+
     async def update_model_name(self, model_id: int, model_name: str) -> ModelDTO:
         return await self._model_repository.update_model_name(model_id, model_name)
\ No newline at end of file
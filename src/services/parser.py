@@ -1,12 +1,18 @@
+import base64
+import io
 import logging
-from collections import deque
+import math
+import sys
+from array import array
+from enum import Enum
 from types import TracebackType
-from typing import ClassVar, Self, TypedDict
+from typing import ClassVar, Literal, Self, TypeAlias, TypedDict
 
 debug_logger = logging.getLogger("debug")
 
 
 class OutputIndexes(TypedDict):
+    # Character offsets into the response
     obj_start: int
     obj_end: int
     exclude_start: int
@@ -18,15 +24,67 @@ class ParsedContent(TypedDict):
     obj_contents: list[str]
 
 
+class MeshDelta(TypedDict):
+    block: int  # Index of the OBJ block in the response
+    vertex_offset: int  # Index of the first vertex of this delta within the block
+    face_offset: int  # Index of the first triangle of this delta within the block
+    vertices: str  # Base64 of little-endian float32 x, y, z triples
+    faces: str  # Base64 of little-endian uint32 zero-based vertex index triples
+
+
+SpanKind: TypeAlias = Literal["message", "obj", "markup"]
+LineKind: TypeAlias = Literal[
+    "blank", "comment", "statement", "obj_fence", "bare_fence", "fence", "other"
+]
+
+
+# (kind, text, block): message text, OBJ body or the fences around an OBJ block,
+# with the index of the block for "obj" and "markup" spans. A plain tuple, as
+# one is created for every token.
+ContentSpan: TypeAlias = tuple[SpanKind, str, int | None]
+
+
+class _ScanMode(Enum):
+    TEXT = "text"
+    OBJ = "obj"  # Unfenced OBJ block
+    FENCED_OBJ = "fenced_obj"
+    PENDING_FENCE = "pending_fence"  # Bare ``` line, the next line tells what it opens
+    FOREIGN_FENCE = "foreign_fence"  # Code block in another language
+
+
 class OBJParser:
+    """Finds OBJ blocks in a streamed response, independently of token boundaries.
+
+    The response is scanned line by line. A line is classified as soon as its
+    first word is known, which takes a few characters, and the rest of it is
+    passed through after a `str.find` for the line break. The work per
+    character is constant and at most the beginning of the current line is
+    buffered, however the tokenizer splits or merges the text.
+
+    A block is either fenced (```obj, or a bare ``` followed by an OBJ line) or
+    unfenced: it starts with an OBJ statement and ends before the first line
+    that is neither a statement, a comment nor blank. Code blocks in other
+    languages are never searched. `process_token` returns the token split into
+    message text, OBJ body and fence markup, blocks are recorded with their
+    character offsets as soon as they end.
+    """
+
     _obj_indexes: list[OutputIndexes]
-    _obj_start: int | None = None  # The index of the first token of the OBJ block
-    _obj_end: int | None = None  # The index of the first token after the OBJ block
+    _obj_start: int | None = None  # Offset of the first character of the OBJ block
+    _obj_end: int | None = None  # Offset of the first character after the OBJ block
     _exclude_start: int | None = None
-    _exclude_end: int | None = None
-    _counter: int = 0
-    _backtrack_queue: deque[str]
-
+    _fence_start: int | None = None  # Offset of a pending bare fence
+    _pending_fence: str = ""
+    _mode: _ScanMode = _ScanMode.TEXT
+    _offset: int = 0  # Characters processed so far
+    _line_start: int = 0
+    _line_head: str = ""  # The beginning of the current line while it is unclassified
+    _line_span: SpanKind | None = None  # Span kind of the rest of the current line
+    _opening_fence: bool = False  # The current line is an ```obj fence
+    _closing_fence: bool = False  # The current line closes the OBJ block
+    _finished: bool = False
+
+    # "#" comments only continue a block, markdown headings would start one
     OBJ_VALID_STARTERS: ClassVar[set[str]] = {
         "v",
         "vt",
@@ -37,112 +95,260 @@ class OBJParser:
         "mtllib",
         "s",
         "usemtl",
-        "#",
     }
-    BACKTRACK_WINDOW_SIZE: ClassVar[int] = 4
+    OBJ_FENCE_LANGUAGE: ClassVar[str] = "obj"
+    MAX_LINE_HEAD: ClassVar[int] = 64
+    _UNDECIDED_HEADS: ClassVar[set[str]] = {"`", "``"} | {
+        starter[:i] for starter in OBJ_VALID_STARTERS for i in range(1, len(starter) + 1)
+    }
 
     def __init__(self) -> None:
         self._obj_indexes = []
-        self._backtrack_queue = deque(maxlen=OBJParser.BACKTRACK_WINDOW_SIZE)
 
-    def process_token(self, token: str) -> None:
-        self._backtrack_queue.append(token)
+    def process_token(self, token: str) -> list[ContentSpan]:
+        span_kind = self._line_span
 
-        # Check for start of direct OBJ content (without markdown markers)
-        if not self._obj_start and self._is_obj_start_line(token):
-            self._obj_start = self._counter
+        if span_kind is not None and "\n" not in token:
+            # Most tokens continue a line that is already classified
+            self._offset += len(token)
+            block = None if span_kind == "message" else len(self._obj_indexes)
+            return [(span_kind, token, block)]
 
-            # Check for code block start (-2 must be a newline): ['```', 'obj', '\n', token]
-            if (
-                self._backtrack_queue[-4] == "```"
-                and self._backtrack_queue[-3] == "obj"
-            ):
-                self._exclude_start = self._counter - 3
-            else:
-                self._exclude_start = self._counter
-
-        # Check for end of direct OBJ content
-        elif (
-            self._obj_start
-            and not self._obj_end
-            and self._backtrack_queue[-2].endswith("\n")  # Previous token is a newline
-            and not self._is_obj_content(token)
-        ):
-            self._obj_end = self._counter
-
-            if token == "```":
-                self._exclude_end = (
-                    self._counter + 2
-                )  # +2 to include the closing ``` and the newline
-            else:
-                self._exclude_end = self._counter
+        spans: list[ContentSpan] = []
+        position = 0
+
+        while position < len(token):
+            if self._line_span is None:
+                position = self._scan_line_head(token, position, spans)
+                continue
+
+            line_end = token.find("\n", position)
+            end = len(token) if line_end == -1 else line_end + 1
+
+            self._emit(spans, token[position:end])
+            self._offset += end - position
+            position = end
+
+            if line_end != -1:
+                self._end_line()
 
-            self._finalize_indexes()
+        return spans
 
-        self._counter += 1
+    def _scan_line_head(self, token: str, position: int, spans: list[ContentSpan]) -> int:
+        """Consume the beginning of an unclassified line, up to the end of the token."""
+        line_end = token.find("\n", position)
+        end = len(token) if line_end == -1 else line_end + 1
+        is_complete = line_end != -1
 
-    def _finalize_indexes(self) -> None:
-        """Store the current set of indices and reset for next potential OBJ block."""
-        if (
-            self._obj_start
-            and self._obj_end
-            and self._exclude_start
-            and self._exclude_end
-        ):
-            indexes = OutputIndexes(
+        self._line_head += token[position:end]
+        self._offset += end - position
+
+        line = self._line_head[:-1] if is_complete else self._line_head
+        kind = self._classify_line(line, is_complete)
+
+        if kind is not None:
+            self._start_line(kind, spans)
+
+            if is_complete:
+                self._end_line()
+
+        return end
+
+    def _classify_line(self, line: str, is_complete: bool) -> LineKind | None:
+        """Kind of the line from its beginning, None if more characters are needed."""
+        is_truncated = len(line) >= OBJParser.MAX_LINE_HEAD
+        stripped = line.lstrip(" \t\r")
+
+        if not stripped:
+            if is_complete:
+                return "blank"
+            return "other" if is_truncated else None
+
+        if stripped[0] == "#":
+            return "comment"
+
+        if stripped.startswith("```"):
+            if is_truncated and not is_complete:
+                return "fence"
+            if not is_complete:
+                return None
+
+            language = stripped[3:].strip().lower()
+            if language == OBJParser.OBJ_FENCE_LANGUAGE:
+                return "obj_fence"
+            return "bare_fence" if not language else "fence"
+
+        word = stripped.split(maxsplit=1)[0]
+        if word != stripped or is_complete:
+            return "statement" if word in OBJParser.OBJ_VALID_STARTERS else "other"
+
+        return None if stripped in OBJParser._UNDECIDED_HEADS else "other"
+
+    def _start_line(self, kind: LineKind, spans: list[ContentSpan]) -> None:
+        """Apply the classified line to the block state and emit its beginning."""
+        head, self._line_head = self._line_head, ""
+
+        if self._mode is _ScanMode.OBJ:
+            if kind in ("statement", "comment", "blank"):
+                self._line_span = "obj"
+            elif kind == "bare_fence":
+                # Closing fence of a block that was opened without one
+                self._line_span = "markup"
+                self._obj_end = self._line_start
+                self._closing_fence = True
+            else:
+                self._finalize_indexes(self._line_start, self._line_start)
+
+        elif self._mode is _ScanMode.FENCED_OBJ:
+            if kind in ("obj_fence", "bare_fence", "fence"):
+                self._line_span = "markup"
+                self._obj_end = self._line_start
+                self._closing_fence = True
+            else:
+                self._line_span = "obj"
+
+        elif self._mode is _ScanMode.PENDING_FENCE:
+            if kind in ("statement", "comment"):
+                self._obj_start = self._line_start
+                self._exclude_start = self._fence_start
+                self._mode = _ScanMode.FENCED_OBJ
+                self._line_span = "markup"
+                self._emit(spans, self._pending_fence)
+                self._line_span = "obj"
+            else:
+                self._line_span = "message"
+                self._emit(spans, self._pending_fence)
+                self._mode = (
+                    _ScanMode.TEXT
+                    if kind in ("obj_fence", "bare_fence", "fence")  # Empty code block
+                    else _ScanMode.FOREIGN_FENCE
+                )
+
+            self._pending_fence = ""
+            self._fence_start = None
+
+        elif self._mode is _ScanMode.FOREIGN_FENCE:
+            self._line_span = "message"
+            if kind in ("obj_fence", "bare_fence", "fence"):
+                self._mode = _ScanMode.TEXT
+
+        if self._mode is _ScanMode.TEXT and self._line_span is None:
+            self._line_span = "message"
+
+            if kind == "statement":
+                self._obj_start = self._exclude_start = self._line_start
+                self._mode = _ScanMode.OBJ
+                self._line_span = "obj"
+            elif kind == "obj_fence":
+                self._exclude_start = self._line_start
+                self._mode = _ScanMode.FENCED_OBJ
+                self._line_span = "markup"
+                self._opening_fence = True
+            elif kind == "bare_fence":
+                self._fence_start = self._line_start
+                self._mode = _ScanMode.PENDING_FENCE
+                self._pending_fence = head
+                return
+            elif kind == "fence":
+                self._mode = _ScanMode.FOREIGN_FENCE
+
+        self._emit(spans, head)
+
+    def _end_line(self) -> None:
+        if self._opening_fence:
+            self._obj_start = self._offset
+            self._opening_fence = False
+
+        if self._closing_fence:
+            assert self._obj_end is not None
+            self._finalize_indexes(self._obj_end, self._offset)
+            self._closing_fence = False
+
+        self._line_start = self._offset
+        self._line_span = None
+
+    def _emit(self, spans: list[ContentSpan], text: str) -> None:
+        if not text:
+            return
+
+        assert self._line_span
+        block = None if self._line_span == "message" else len(self._obj_indexes)
+        spans.append((self._line_span, text, block))
+
+    def _finalize_indexes(self, obj_end: int, exclude_end: int) -> None:
+        """Store the indexes of the current block and go back to message text."""
+        assert self._obj_start is not None and self._exclude_start is not None
+
+        self._obj_indexes.append(
+            OutputIndexes(
                 obj_start=self._obj_start,
-                obj_end=self._obj_end,
+                obj_end=obj_end,
                 exclude_start=self._exclude_start,
-                exclude_end=self._exclude_end,
+                exclude_end=exclude_end,
             )
-            self._obj_indexes.append(indexes)
-            self._reset_indexes()
+        )
+        self._reset_indexes()
+
+    @property
+    def current_obj_block(self) -> int | None:
+        """Index of the OBJ block being scanned, if any."""
+        if self._mode not in (_ScanMode.OBJ, _ScanMode.FENCED_OBJ):
+            return None
+        return len(self._obj_indexes)
+
+    @property
+    def obj_indexes(self) -> list[OutputIndexes]:
+        """Indexes of the OBJ blocks that have ended so far."""
+        return self._obj_indexes
 
-    def _is_obj_start_line(self, token: str) -> bool:
-        """Check if token starts with valid OBJ commands."""
-        if not token.strip():
-            return False
+    def finish(self) -> list[ContentSpan]:
+        """Process the end of the response, returns the spans of its last line."""
+        spans: list[ContentSpan] = []
 
-        return any(token.strip() == starter for starter in OBJParser.OBJ_VALID_STARTERS)
+        if self._finished:
+            return spans
+        self._finished = True
 
-    def _is_obj_content(self, token: str) -> bool:
-        """Check if token is valid OBJ content."""
-        if not token.strip():
-            return True  # Empty lines are allowed in OBJ files
+        if self._line_span is None and self._line_head:
+            kind = self._classify_line(self._line_head, is_complete=True)
+            assert kind is not None
+            self._start_line(kind, spans)
 
-        return any(token.strip() == elem for elem in OBJParser.OBJ_VALID_STARTERS)
+        if self._mode is _ScanMode.PENDING_FENCE:
+            self._line_span = "message"
+            self._emit(spans, self._pending_fence)
+            self._pending_fence = ""
+
+        if self._opening_fence:
+            self._obj_start = self._offset
+
+        if self._closing_fence:
+            assert self._obj_end is not None
+            self._finalize_indexes(self._obj_end, self._offset)
+        elif self._mode in (_ScanMode.OBJ, _ScanMode.FENCED_OBJ):
+            self._finalize_indexes(self._offset, self._offset)
+
+        return spans
 
     def get_obj_indexes(self) -> list[OutputIndexes]:
-        if not self._obj_end or not self._exclude_end:
-            self._obj_end = self._counter
-            self._exclude_end = self._counter
-            self._finalize_indexes()
+        self.finish()
         return self._obj_indexes
 
     @staticmethod
     def extract_obj_content(
-        tokens: list[str], obj_indexes_list: list[OutputIndexes]
+        content: str, obj_indexes_list: list[OutputIndexes]
     ) -> ParsedContent:
         obj_contents = []
         message_parts = []
         prev_obj_end_idx = 0
 
         for obj_indexes in obj_indexes_list:
-            obj_start = obj_indexes["obj_start"]
-            obj_end = obj_indexes["obj_end"]
-            exclude_start = obj_indexes["exclude_start"]
-            exclude_end = obj_indexes["exclude_end"]
-
-            excluded_content = "".join(tokens[prev_obj_end_idx:exclude_start])
-            message_parts.append(excluded_content)
+            message_parts.append(content[prev_obj_end_idx : obj_indexes["exclude_start"]])
+            obj_contents.append(content[obj_indexes["obj_start"] : obj_indexes["obj_end"]])
 
-            obj_content = "".join(tokens[obj_start:obj_end])
-            obj_contents.append(obj_content)
+            prev_obj_end_idx = obj_indexes["exclude_end"]
 
-            prev_obj_end_idx = exclude_end
-
-        excluded_content = "".join(tokens[prev_obj_end_idx:])
-        message_parts.append(excluded_content)
+        message_parts.append(content[prev_obj_end_idx:])
 
         result = ParsedContent(
             message_content="".join(message_parts), obj_contents=obj_contents
@@ -153,13 +359,21 @@ class OBJParser:
         self._obj_start = None
         self._obj_end = None
         self._exclude_start = None
-        self._exclude_end = None
+        self._mode = _ScanMode.TEXT
 
     def clear(self) -> None:
         self._obj_indexes.clear()
 
         self._reset_indexes()
-        self._counter = 0
+        self._fence_start = None
+        self._pending_fence = ""
+        self._offset = 0
+        self._line_start = 0
+        self._line_head = ""
+        self._line_span = None
+        self._opening_fence = False
+        self._closing_fence = False
+        self._finished = False
 
     def __enter__(self) -> Self:
         return self
@@ -171,3 +385,173 @@ class OBJParser:
         traceback: TracebackType | None,
     ) -> None:
         self.clear()
+
+
+class ContentAccumulator:
+    """Collects the message text and OBJ bodies of a streamed response.
+
+    The spans returned by `OBJParser` are written into growable buffers as
+    they come, fence markup is dropped. The finished message and OBJ blocks
+    are available without another pass over the response, and the tokens
+    don't have to be kept around.
+    """
+
+    _message: io.StringIO
+    _obj_contents: list[io.StringIO]
+
+    def __init__(self) -> None:
+        self._message = io.StringIO()
+        self._obj_contents = []
+
+    def process_spans(self, spans: list[ContentSpan]) -> None:
+        for kind, text, block in spans:
+            if kind == "message":
+                self._message.write(text)
+                continue
+
+            assert block is not None
+            while len(self._obj_contents) <= block:
+                self._obj_contents.append(io.StringIO())
+
+            if kind == "obj":
+                self._obj_contents[block].write(text)
+
+    def get_obj_content(self, block: int) -> str:
+        """OBJ body of a block, complete once the parser has ended the block."""
+        return self._obj_contents[block].getvalue()
+
+    def get_parsed_content(self) -> ParsedContent:
+        return ParsedContent(
+            message_content=self._message.getvalue(),
+            obj_contents=[obj_content.getvalue() for obj_content in self._obj_contents],
+        )
+
+
+class OBJMeshBuilder:
+    """Incrementally builds the geometry of OBJ blocks from streamed text.
+
+    Text is fed together with the index of the OBJ block it belongs to. Every
+    completed `v` and `f` line is parsed right away, polygons are triangulated
+    as fans, and `pop_deltas` returns what was added since the previous call,
+    one delta per block.
+    """
+
+    _block: int | None = None
+    _line: list[str]
+    _vertex_count: int = 0  # Vertices of the current block, including popped ones
+    _face_count: int = 0
+    _vertex_offset: int = 0  # Vertex count at the previous delta
+    _face_offset: int = 0
+    _vertices: array
+    _faces: array
+    _deltas: list[MeshDelta]  # Of the blocks ended since `pop_deltas`
+
+    def __init__(self) -> None:
+        self._line = []
+        self._vertices = array("f")
+        self._faces = array("I")
+        self._deltas = []
+
+    def process_text(self, text: str, block: int) -> None:
+        if block != self._block:
+            self._start_block(block)
+
+        *lines, rest = text.split("\n")
+        for line in lines:
+            self._line.append(line)
+            self._process_line("".join(self._line))
+            self._line.clear()
+
+        if rest:
+            self._line.append(rest)
+
+    def finish(self) -> None:
+        """Process the last line of the current block if it has no line break."""
+        if self._line:
+            self._process_line("".join(self._line))
+            self._line.clear()
+
+    def _start_block(self, block: int) -> None:
+        # A token can end a block and start the next one
+        self.finish()
+        self._end_delta()
+
+        self._block = block
+        self._vertex_count = 0
+        self._face_count = 0
+        self._vertex_offset = 0
+        self._face_offset = 0
+
+    def _process_line(self, line: str) -> None:
+        parts = line.split()
+
+        if not parts:
+            return
+
+        try:
+            if parts[0] == "v":
+                self._vertices.extend(self._to_vertex(parts))
+                self._vertex_count += 1
+            elif parts[0] == "f" and len(parts) >= 4:
+                indexes = [self._to_vertex_index(part) for part in parts[1:]]
+
+                for i in range(1, len(indexes) - 1):
+                    self._faces.extend((indexes[0], indexes[i], indexes[i + 1]))
+                    self._face_count += 1
+        except ValueError:
+            debug_logger.debug(f"Skipped malformed OBJ line: {line!r}")
+
+    @staticmethod
+    def _to_vertex(parts: list[str]) -> tuple[float, float, float]:
+        """x, y, z of a `v` line, NaN if malformed: the next vertices keep their indexes.
+
+        As src.mesh.arrays.parse_obj does for missing coordinates, the faces
+        using it are dropped by the repair of the block.
+        """
+        try:
+            x, y, z = (float(coord) for coord in parts[1:4])
+            return x, y, z
+        except ValueError:
+            debug_logger.debug(f"Malformed OBJ vertex: {' '.join(parts)!r}")
+            return math.nan, math.nan, math.nan
+
+    def _to_vertex_index(self, part: str) -> int:
+        """Convert `v`, `v/vt`, `v//vn` or `v/vt/vn` reference to a zero-based index."""
+        index = int(part.split("/", 1)[0])
+        index = index - 1 if index > 0 else self._vertex_count + index
+
+        if index < 0:
+            raise ValueError(f"Vertex index out of range: {part}")
+
+        return index
+
+    @staticmethod
+    def _encode(values: array) -> str:
+        if sys.byteorder == "big":
+            values.byteswap()
+        return base64.b64encode(values.tobytes()).decode("ascii")
+
+    def pop_deltas(self) -> list[MeshDelta]:
+        self._end_delta()
+        deltas, self._deltas = self._deltas, []
+        return deltas
+
+    def _end_delta(self) -> None:
+        if self._block is None or (not self._vertices and not self._faces):
+            return
+
+        # The faces of a delta are whole triangles, a pending polygon is never split
+        self._deltas.append(
+            MeshDelta(
+                block=self._block,
+                vertex_offset=self._vertex_offset,
+                face_offset=self._face_offset,
+                vertices=self._encode(self._vertices),
+                faces=self._encode(self._faces),
+            )
+        )
+
+        self._vertex_offset = self._vertex_count
+        self._face_offset = self._face_count
+        self._vertices = array("f")
+        self._faces = array("I")
@@ -1,7 +1,8 @@
 import logging
 from dataclasses import dataclass
-from typing import AsyncGenerator, TypeAlias
+from typing import AsyncGenerator, Callable, TypeAlias
 
+from ..assistant.budget import GenerationBudget
 from ..models.message import ResponseChunkDTO
 from ..my_logging.logging_config import setup_logging
 
@@ -16,5 +17,13 @@ AsyncResponseGenerator: TypeAlias = AsyncGenerator[ResponseChunkDTO, None]
 class Stream:
     chat_id: int
     message_id: int
+    budget: GenerationBudget = GenerationBudget()
     is_running: bool = False
     generator: AsyncResponseGenerator | None = None
+    on_stop: Callable[[], None] | None = None
+
+    def stop(self) -> None:
+        self.is_running = False
+
+        if self.on_stop:
+            self.on_stop()
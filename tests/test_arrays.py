@@ -0,0 +1,16 @@
+import numpy as np
+
+from src.mesh.arrays import parse_obj
+from src.mesh.repair import repair_mesh
+
+
+def test_short_vertex_keeps_the_indexes_of_the_next_ones() -> None:
+    mesh = parse_obj("v 0 0 0\nv 1 2\nv 1 0 0\nv 0 1 0\nv 0 0 1 1\nf 1 3 4\nf 1 2 3\nf 3 4 5\n")
+
+    assert mesh.vertices.shape == (5, 3)
+    assert np.isnan(mesh.vertices[1]).all()
+    np.testing.assert_array_equal(mesh.vertices[[2, 4]], [[1, 0, 0], [0, 0, 1]])
+
+    repaired, report = repair_mesh(mesh)
+    assert report["non_finite_vertices"] == 1
+    assert len(repaired.faces) == 2
@@ -0,0 +1,107 @@
+import base64
+from collections import defaultdict
+from typing import cast
+
+import numpy as np
+import pytest
+
+from src.services.parser import MeshDelta, OBJMeshBuilder, OBJParser
+
+RESPONSE = (
+    "Two boxes.\n"
+    "```obj\n"
+    "v 0 0 0\nv 1 0 0\nv 1 1 0\nv 0 1 0\n"
+    "f 1 2 3 4\n"
+    "```\n"
+    "\n"
+    "```obj\n"
+    "v 5 5 5\nv 6 5 5\nv 6 6 5\n"
+    "f 1 2 3\n"
+    "f -3 -2 -1\n"
+    "```\n"
+    "Done.\n"
+)
+
+
+def split_fixed(text: str, size: int) -> list[str]:
+    return [text[i : i + size] for i in range(0, len(text), size)]
+
+
+def split_random(text: str, seed: int) -> list[str]:
+    rng = np.random.default_rng(seed)
+    tokens, start = [], 0
+    while start < len(text):
+        end = start + int(rng.integers(1, 12))
+        tokens.append(text[start:end])
+        start = end
+    return tokens
+
+
+def stream_deltas(tokens: list[str]) -> list[MeshDelta]:
+    parser = OBJParser()
+    builder = OBJMeshBuilder()
+    deltas = []
+
+    def feed(spans: list) -> None:
+        for kind, text, block in spans:
+            if kind == "obj":
+                builder.process_text(text, cast(int, block))
+
+    for token in tokens:
+        feed(parser.process_token(token))
+        deltas += builder.pop_deltas()
+
+    feed(parser.finish())
+    builder.finish()
+    deltas += builder.pop_deltas()
+    return deltas
+
+
+def merge_blocks(deltas: list[MeshDelta]) -> dict[int, tuple[list[float], list[int]]]:
+    """Geometry of every block, checking the deltas continue each other."""
+    blocks: dict[int, tuple[list[float], list[int]]] = defaultdict(lambda: ([], []))
+
+    for delta in deltas:
+        vertices, faces = blocks[delta["block"]]
+        assert delta["vertex_offset"] == len(vertices) // 3
+        assert delta["face_offset"] == len(faces) // 3
+
+        vertices += np.frombuffer(base64.b64decode(delta["vertices"]), "<f4").tolist()
+        faces += np.frombuffer(base64.b64decode(delta["faces"]), "<u4").tolist()
+
+    return dict(blocks)
+
+
+EXPECTED = {
+    0: ([0, 0, 0, 1, 0, 0, 1, 1, 0, 0, 1, 0], [0, 1, 2, 0, 2, 3]),
+    1: ([5, 5, 5, 6, 5, 5, 6, 6, 5], [0, 1, 2, 0, 1, 2]),
+}
+
+
+@pytest.mark.parametrize(
+    "tokens",
+    [
+        [RESPONSE],
+        split_fixed(RESPONSE, 1),
+        split_fixed(RESPONSE, 7),
+        # Ends the last face of the first block, then starts the second one
+        [
+            RESPONSE.partition("f 1 2 3 4")[0] + "f 1 2 3",
+            " 4\n```\n\n```obj\nv 5 5 5\n",
+            RESPONSE.partition("v 5 5 5\n")[2],
+        ],
+        *(split_random(RESPONSE, seed) for seed in range(20)),
+    ],
+)
+def test_mesh_deltas_per_block_dont_depend_on_the_token_split(tokens: list[str]) -> None:
+    assert "".join(tokens) == RESPONSE
+    assert merge_blocks(stream_deltas(tokens)) == EXPECTED
+
+
+def test_malformed_vertex_keeps_the_indexes_of_the_next_ones() -> None:
+    response = "```obj\nv 0 0 0\nv 1 2\nv 1 x 0\nv 0 1 0\nf 1 4 -1\n```\n"
+    [(_, (vertices, faces))] = merge_blocks(stream_deltas([response])).items()
+
+    assert len(vertices) == 12
+    assert np.isnan(vertices[3:9]).all()
+    assert faces == [0, 3, 3]
@@ -0,0 +1,29 @@
+import numpy as np
+
+from src.repository.shape_index import ShapeIndex
+
+
+def test_owner_search_finds_the_owners_nearest_models() -> None:
+    rng = np.random.default_rng(0)
+    count = ShapeIndex.TRAIN_MIN * 2
+    vectors = rng.random((count, 8), dtype=np.float32)
+    owners = np.where(np.arange(count) % 100 == 0, 7, ShapeIndex.NO_OWNER)
+    index = ShapeIndex.build(np.arange(count), owners, vectors, dimensions=8, probes=2)
+
+    owned = np.flatnonzero(owners == 7)
+    distances = ((vectors[owned] - vectors[0]) ** 2).sum(axis=1)
+    expected = owned[np.argsort(distances)[:5]].tolist()
+
+    assert [model_id for model_id, _ in index.search(vectors[0], 5, owner=7)] == expected
+    assert index.search(vectors[0], 5, owner=8) == []
+
+
+def test_removed_model_is_not_found() -> None:
+    index = ShapeIndex(dimensions=2)
+    index.add(1, 7, np.array([0, 0], dtype=np.float32))
+    index.add(2, 7, np.array([1, 0], dtype=np.float32))
+    index.add(3, 8, np.array([0, 1], dtype=np.float32))
+    index.remove(1)
+
+    assert [model_id for model_id, _ in index.search(np.zeros(2), 5, owner=7)] == [2]
+    assert {model_id for model_id, _ in index.search(np.zeros(2), 5)} == {2, 3}